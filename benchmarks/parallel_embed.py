@@ -0,0 +1,63 @@
+"""
+Compare serial and row-band parallel embedding on a large carrier.
+
+Run from the repository root:
+
+    $ python benchmarks/parallel_embed.py [--megapixels 50] [--workers 1 2 4 8]
+
+The carrier is filled up to its capacity (1 bit per channel by default) and
+every run is checked to give the same pixels as the serial one.
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from cryptosteganography import container, engine
+
+__author__ = 'computationalcore@gmail.com'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--megapixels', type=float, default=50)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--bits', type=int, default=1, help='Bits per channel.')
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    width = int((args.megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = int(args.megapixels * 1e6 / width)
+    rng = np.random.default_rng(0)
+    carrier = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    data = rng.bytes(container.body_capacity(engine.capacity(carrier), args.bits))
+    print('{}x{} carrier, {} bytes, {} CPUs'.format(width, height, len(data), os.cpu_count()))
+
+    expected = None
+    serial = None
+    for workers in args.workers:
+        embed = extract = float('inf')
+        for _ in range(args.repeat):
+            pixels = carrier.copy()
+            start = time.perf_counter()
+            container.write_body(pixels, data, depth=args.bits, workers=workers)
+            embed = min(embed, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            engine.extract(pixels, len(data), container.HEADER_BITS, args.bits, workers=workers)
+            extract = min(extract, time.perf_counter() - start)
+
+        if expected is None:
+            expected = pixels
+            serial = embed
+        elif not np.array_equal(pixels, expected):
+            raise AssertionError('Different output with {} workers'.format(workers))
+
+        print('{:>2} workers: embed {:.3f}s ({:.2f}x), extract {:.3f}s'.format(
+            workers, embed, serial / embed, extract
+        ))
+
+
+if __name__ == '__main__':
+    main()
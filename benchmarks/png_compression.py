@@ -0,0 +1,65 @@
+"""
+Compare the PNG encode time and output size of the compression settings.
+
+Run from the repository root:
+
+    $ python benchmarks/png_compression.py [image ...] [-r REPEAT]
+
+The secret is hidden once per image, then the output is encoded in memory
+with every setting (the best of REPEAT runs is reported).
+"""
+import argparse
+import io
+
+from cryptosteganography import CryptoSteganography, formats
+
+__author__ = 'computationalcore@gmail.com'
+
+DEFAULT_IMAGES = ['tests/assets/test_image.jpg']
+
+SETTINGS = [
+    (None, None),
+    (0, None),
+    (1, None),
+    (1, 'rle'),
+    (1, 'huffman'),
+    (3, None),
+    (6, 'rle'),
+    (9, None),
+]
+
+
+def encode_time(image, compress_level, compress_strategy, repeat):
+    """Return the best encode time and the output size."""
+    best = float('inf')
+    for _ in range(repeat):
+        report = formats.save(image, io.BytesIO(), 'png', compress_level, compress_strategy)
+        best = min(best, report.seconds)
+    return best, report.bytes_written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('images', nargs='*', default=DEFAULT_IMAGES)
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    crypto_steganography = CryptoSteganography('benchmark')
+    print('{:<32} {:>5} {:>9} {:>10} {:>12}'.format(
+        'image', 'level', 'strategy', 'time (ms)', 'size (bytes)'
+    ))
+    for input_image_file in args.images:
+        image = crypto_steganography.hide_image(input_image_file, b'benchmark' * 1000)
+        for compress_level, compress_strategy in SETTINGS:
+            seconds, size = encode_time(image, compress_level, compress_strategy, args.repeat)
+            print('{:<32} {:>5} {:>9} {:>10.1f} {:>12}'.format(
+                input_image_file[-32:],
+                'def' if compress_level is None else compress_level,
+                compress_strategy or 'default',
+                seconds * 1000,
+                size
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""
+Benchmark hide/retrieve over synthetic carriers and payloads.
+
+Run from the repository root:
+
+    $ python benchmarks/run.py -o results.json
+    $ python benchmarks/run.py --quick --compare results.json
+
+Each case (image size, payload size, bits per channel) runs in a fresh
+process, so its peak RSS is not polluted by the previous ones. The carriers
+are random noise PNG images (the worst case for the encoder) written to a
+temporary directory. The payloads go from 10 bytes to the carrier capacity.
+
+Stages timed (in seconds):
+
+- hide: decode (open and convert the carrier), kdf (key derivation, cold
+  cache), embed (encrypt and embed in the pixels), encode (PNG output) and
+  total (hide from file to file).
+- retrieve: header (read the container header), total (retrieve from the
+  file).
+
+The results are written as JSON, together with the platform and library
+versions; --compare prints the time ratios against a previous run.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import datetime
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+import PIL
+from PIL import Image
+
+from cryptosteganography import container, CryptoSteganography, engine, formats, kdf
+
+__author__ = 'computationalcore@gmail.com'
+
+MEGAPIXELS = [0.3, 1, 4, 12, 24]
+QUICK_MEGAPIXELS = [0.3, 1]
+PAYLOADS = [10, 1000, 100_000, 1_000_000, 'capacity']
+QUICK_PAYLOADS = [10, 1000, 'capacity']
+BITS_PER_CHANNEL = [1]
+
+PASSWORD = 'benchmark password'
+
+
+def carrier(directory, megapixels):
+    """Write a 4:3 random noise carrier and return its path."""
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = int(megapixels * 1e6 / width)
+    path = os.path.join(directory, '{}mp.png'.format(megapixels))
+    if not os.path.exists(path):
+        pixels = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(path, compress_level=1)
+    return path
+
+
+def timed(function, *args, **kwargs):
+    """Return the result of the function and the time it took."""
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def peak_rss_kb():
+    """Return the peak resident set size of the process, in KB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KB elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def run_case(input_image_file, payload, bits_per_channel, directory):
+    """Run one case (in a worker process) and return its result."""
+    crypto_steganography = CryptoSteganography(PASSWORD, bits_per_channel=bits_per_channel)
+    capacity = crypto_steganography.capacity(input_image_file)
+    size = capacity if payload == 'capacity' else payload
+    data = os.urandom(size)
+    output_image_file = os.path.join(directory, 'output_{}.png'.format(os.getpid()))
+
+    with Image.open(input_image_file) as image:
+        pixels, decode = timed(engine.to_array, image, True)
+
+    kdf.cache_clear()
+    _, key_derivation = timed(
+        kdf.derive_key,
+        PASSWORD,
+        crypto_steganography.salt,
+        crypto_steganography.kdf_params
+    )
+
+    secret, embed = timed(crypto_steganography.hide_image, pixels, data)
+    encode = timed(formats.save, secret, io.BytesIO())[0].seconds
+    _, hide_total = timed(crypto_steganography.hide, input_image_file, output_image_file, data)
+
+    with Image.open(output_image_file) as image:
+        _, header = timed(container.read_header, image)
+    # Keep the key cached, only the extraction and decryption are measured
+    secret_data, retrieve_total = timed(crypto_steganography.retrieve, output_image_file)
+    os.remove(output_image_file)
+
+    with Image.open(input_image_file) as image:
+        width, height = image.size
+
+    return {
+        'width': width,
+        'height': height,
+        'megapixels': round(width * height / 1e6, 2),
+        'payload': size,
+        'capacity': capacity,
+        'bits_per_channel': bits_per_channel,
+        'ok': secret_data == data,
+        'hide': {
+            'decode': decode,
+            'kdf': key_derivation,
+            'embed': embed,
+            'encode': encode,
+            'total': hide_total,
+        },
+        'retrieve': {
+            'header': header,
+            'total': retrieve_total,
+        },
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+
+def case_key(result):
+    """Return the key identifying a case across runs."""
+    return result['megapixels'], result['payload'], result['bits_per_channel']
+
+
+def compare(results, baseline_file):
+    """Print the total time ratios against a previous run (to stderr)."""
+    with open(baseline_file, encoding='utf-8') as f:
+        baseline = {case_key(result): result for result in json.load(f)['results']}
+
+    print(
+        '{:>8} {:>10} {:>4} {:>12} {:>12}'.format('MP', 'payload', 'bits', 'hide', 'retrieve'),
+        file=sys.stderr
+    )
+    for result in results:
+        previous = baseline.get(case_key(result))
+        if not previous:
+            continue
+        print('{:>8} {:>10} {:>4} {:>11.2f}x {:>11.2f}x'.format(
+            result['megapixels'],
+            result['payload'],
+            result['bits_per_channel'],
+            result['hide']['total'] / previous['hide']['total'],
+            result['retrieve']['total'] / previous['retrieve']['total'],
+        ), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='Small carriers and payloads only.')
+    parser.add_argument('--megapixels', type=float, nargs='+', help='Carrier sizes.')
+    parser.add_argument('--payloads', nargs='+', help="Payload sizes in bytes, or 'capacity'.")
+    parser.add_argument('--bits', type=int, nargs='+', default=BITS_PER_CHANNEL,
+                        help='Bits per channel.')
+    parser.add_argument('-o', '--output', help='JSON output file (stdout if not informed).')
+    parser.add_argument('--compare', help='Previous JSON output to compare with.')
+    args = parser.parse_args()
+
+    megapixels = args.megapixels or (QUICK_MEGAPIXELS if args.quick else MEGAPIXELS)
+    payloads = [
+        payload if payload == 'capacity' else int(payload)
+        for payload in args.payloads or (QUICK_PAYLOADS if args.quick else PAYLOADS)
+    ]
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in megapixels:
+            input_image_file = carrier(directory, size)
+            for bits_per_channel in args.bits:
+                capacity = CryptoSteganography(
+                    PASSWORD,
+                    bits_per_channel=bits_per_channel
+                ).capacity(input_image_file)
+                for payload in payloads:
+                    if payload != 'capacity' and payload > capacity:
+                        continue
+                    # A fresh process per case, for a meaningful peak RSS
+                    with ProcessPoolExecutor(max_workers=1) as executor:
+                        result = executor.submit(
+                            run_case,
+                            input_image_file,
+                            payload,
+                            bits_per_channel,
+                            directory
+                        ).result()
+                    print('{megapixels} MP, {payload} B, {bits_per_channel} bits: '
+                          'hide {hide[total]:.3f}s, retrieve {retrieve[total]:.3f}s, '
+                          '{peak_rss_kb} KB'.format(**result), file=sys.stderr)
+                    results.append(result)
+
+    report = {
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pillow': PIL.__version__,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -40,6 +40,8 @@ setuptools.setup(
     #   Example: 'requests @ git+https://github.com/requests/requests.git@branch_or_tag'
     #   See: https://github.com/pypa/pip/issues/6162
     install_requires=[line.strip() for line in open('requirements.txt').readlines()],
+    # Optional zstd compression of the hidden data
+    extras_require={'zstd': ['zstandard']},
     zip_safe=False,
 
     license='MIT',
@@ -0,0 +1,376 @@
+"""
+PNG files compressed in bands of rows that can be re-encoded on their own.
+
+A PNG image is one zlib stream over all its (filtered) rows, so changing a
+few rows normally means compressing the whole image again. The files
+written here split that stream in bands of rows:
+
+- every row uses the Sub filter, which only looks at the row itself,
+- every band is compressed by its own deflate compressor (ending on a full
+  flush, the last one on the final block) and stored in its own IDAT chunk,
+- the zlib header and the Adler-32 trailer get IDAT chunks of their own,
+- a private csBD chunk records the band height, the compression level and
+  the Adler-32 checksum of each band.
+
+Any PNG decoder reads them as usual, and a band can be decoded, or replaced
+by a newly compressed one, without touching the others: the trailer is
+recomputed by combining the band checksums. Rewriting a few bands costs the
+compression of those bands (plus copying the other chunks), not of the
+whole image.
+
+The first pixels of any 8-bit RGB(A) PNG file can be read too, inflating
+the data only up to them (first_pixels), which is how the container header
+is found without decoding the image.
+"""
+import os
+import struct
+from typing import BinaryIO, Iterable, List, NamedTuple, Optional, Tuple, Union
+import zlib
+
+import numpy as np
+
+from cryptosteganography import formats
+
+__author__ = 'computationalcore@gmail.com'
+
+SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# Ancillary, private, not safe to copy (editors drop it when they change the
+# image data)
+CHUNK_TYPE = b'csBD'
+# Big-endian: band height in rows, compression level
+BANDS = struct.Struct('>IB')
+CHUNK = struct.Struct('>I4s')
+IHDR = struct.Struct('>IIBBBBB')
+
+# PNG colour types of the supported pixel layouts, by number of channels
+COLOUR_TYPES = {3: 2, 4: 6}
+SUB_FILTER = 1
+# Filtered bytes per band (about)
+BAND_SIZE = 256 * 1024
+DEFAULT_LEVEL = 6
+ADLER_BASE = 65521
+# Read size of the compressed data when looking for the first pixels
+READ_SIZE = 64 * 1024
+
+
+class BandedPng(NamedTuple):
+    """Layout of a banded PNG file."""
+    width: int
+    height: int
+    channels: int
+    band_rows: int
+    level: int
+    # Adler-32 checksum of each band's filtered rows
+    adlers: Tuple[int, ...]
+    # (position, length) of each band's compressed data in the file
+    bands: Tuple[Tuple[int, int], ...]
+
+    def band_range(self, band: int) -> Tuple[int, int]:
+        """Return the first row and the row after the last one of a band."""
+        first = band * self.band_rows
+        return first, min(first + self.band_rows, self.height)
+
+    def bands_for(self, rows: int) -> int:
+        """Return the number of bands holding the first rows."""
+        return -(-min(rows, self.height) // self.band_rows)
+
+    def rows(self, bands: int) -> int:
+        """Return the number of rows of the first bands."""
+        return min(bands * self.band_rows, self.height)
+
+    def empty_pixels(self) -> np.ndarray:
+        """Return a zero pixel array of the image size (pages allocated on use)."""
+        return np.zeros((self.height, self.width, self.channels), dtype=np.uint8)
+
+
+def band_rows(width: int, channels: int) -> int:
+    """Return the band height of an image width."""
+    return max(BAND_SIZE // (1 + width * channels), 1)
+
+
+def adler32_combine(adler1: int, adler2: int, length2: int) -> int:
+    """Return the Adler-32 checksum of two pieces of data from theirs."""
+    remainder = length2 % ADLER_BASE
+    sum1 = ((adler1 & 0xffff) + (adler2 & 0xffff) - 1) % ADLER_BASE
+    sum2 = ((adler1 >> 16) + (adler2 >> 16) + remainder * ((adler1 & 0xffff) - 1)) % ADLER_BASE
+    return sum1 | sum2 << 16
+
+
+def _filter(rows: np.ndarray) -> bytes:
+    """Return the rows (an (height, width, channels) array) Sub filtered."""
+    height, width, channels = rows.shape
+    flat = rows.reshape(height, width * channels)
+    filtered = np.empty((height, 1 + width * channels), dtype=np.uint8)
+    filtered[:, 0] = SUB_FILTER
+    filtered[:, 1:1 + channels] = flat[:, :channels]
+    np.subtract(flat[:, channels:], flat[:, :-channels], out=filtered[:, 1 + channels:])
+    return filtered.tobytes()
+
+
+def _unfilter(data: bytes, width: int, channels: int) -> np.ndarray:
+    """Return the rows of Sub filtered data. Raise ValueError if invalid."""
+    filtered = np.frombuffer(data, dtype=np.uint8).reshape(-1, 1 + width * channels)
+    if (filtered[:, 0] != SUB_FILTER).any():
+        raise ValueError('Unexpected PNG row filter')
+    rows = filtered[:, 1:].reshape(len(filtered), width, channels)
+    return np.cumsum(rows, axis=1, dtype=np.uint8)
+
+
+def _compress(rows: np.ndarray, level: int, last: bool) -> Tuple[bytes, int]:
+    """Compress a band of rows on its own, return its data and Adler-32 checksum."""
+    data = _filter(rows)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    compressed = compressor.compress(data)
+    compressed += compressor.flush(zlib.Z_FINISH if last else zlib.Z_FULL_FLUSH)
+    return compressed, zlib.adler32(data)
+
+
+def _write_chunk(f: BinaryIO, chunk_type: bytes, data: bytes) -> None:
+    f.write(CHUNK.pack(len(data), chunk_type))
+    f.write(data)
+    f.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type))))
+
+
+def _write(
+    f: BinaryIO,
+    shape: Tuple[int, int, int],
+    rows_per_band: int,
+    level: int,
+    bands: Iterable[Tuple[bytes, int]]
+) -> None:
+    """Write a banded PNG file from the compressed bands and their checksums."""
+    height, width, channels = shape
+    bands = list(bands)
+    adlers = [adler for _, adler in bands]
+    f.write(SIGNATURE)
+    _write_chunk(f, b'IHDR', IHDR.pack(width, height, 8, COLOUR_TYPES[channels], 0, 0, 0))
+    _write_chunk(
+        f,
+        CHUNK_TYPE,
+        BANDS.pack(rows_per_band, level) + struct.pack('>{}I'.format(len(adlers)), *adlers)
+    )
+    # zlib stream header of the compression level
+    _write_chunk(f, b'IDAT', zlib.compress(b'', level)[:2])
+    adler = 1
+    for band, (data, band_adler) in enumerate(bands):
+        _write_chunk(f, b'IDAT', data)
+        rows = min(rows_per_band, height - band * rows_per_band)
+        adler = adler32_combine(adler, band_adler, rows * (1 + width * channels))
+    _write_chunk(f, b'IDAT', struct.pack('>I', adler))
+    _write_chunk(f, b'IEND', b'')
+
+
+def write(
+    pixels: np.ndarray,
+    output: Union[str, os.PathLike, BinaryIO],
+    level: int = DEFAULT_LEVEL
+) -> None:
+    """
+    Save a (height, width, 3 or 4) uint8 pixel array as a banded PNG file
+    (file path or binary file object), with the zlib compression level.
+    """
+    height, width, channels = pixels.shape
+    if channels not in COLOUR_TYPES:
+        raise ValueError('Only RGB and RGBA images can be saved as banded PNG files')
+    rows_per_band = band_rows(width, channels)
+    bands = [
+        _compress(pixels[first:first + rows_per_band], level, first + rows_per_band >= height)
+        for first in range(0, height, rows_per_band)
+    ]
+    if isinstance(output, (str, os.PathLike)):
+        with open(output, 'wb') as f:
+            _write(f, (height, width, channels), rows_per_band, level, bands)
+    else:
+        _write(output, (height, width, channels), rows_per_band, level, bands)
+
+
+def chunks(f: BinaryIO) -> Iterable[Tuple[bytes, int, int]]:
+    """Return the type, data position and length of the chunks of a PNG file."""
+    if f.read(len(SIGNATURE)) != SIGNATURE:
+        return
+    while True:
+        head = f.read(CHUNK.size)
+        if len(head) < CHUNK.size:
+            return
+        length, chunk_type = CHUNK.unpack(head)
+        position = f.tell()
+        yield chunk_type, position, length
+        if chunk_type == b'IEND':
+            return
+        f.seek(position + length + 4)
+
+
+def _predictor(kind: int, left: int, up: int, up_left: int) -> int:
+    """Return the PNG filter prediction of a byte from its neighbours."""
+    if kind == 0:
+        return 0
+    if kind == 1:
+        return left
+    if kind == 2:
+        return up
+    if kind == 3:
+        return (left + up) // 2
+    if kind == 4:
+        # Paeth: the neighbour closest to left + up - up_left
+        estimate = left + up - up_left
+        distances = [abs(estimate - left), abs(estimate - up), abs(estimate - up_left)]
+        return (left, up, up_left)[distances.index(min(distances))]
+    raise ValueError('Invalid PNG row filter: {}'.format(kind))
+
+
+def _unfilter_first(data: bytes, width: int, channels: int, count: int) -> np.ndarray:
+    """
+    Return the first count pixels of PNG rows (each one a filter type byte
+    and the filtered row, any filter), as a (1, count, channels) array. Only
+    the bytes of those pixels are unfiltered.
+    """
+    stride = width * channels
+    out = np.zeros((-(-count // width), stride), dtype=np.uint8)
+    previous = [0] * stride
+    for row in range(len(out)):
+        size = min(stride, (count - row * width) * channels)
+        start = row * (stride + 1)
+        kind = data[start]
+        current = [0] * size
+        for i, value in enumerate(data[start + 1:start + 1 + size]):
+            if i >= channels:
+                left, up_left = current[i - channels], previous[i - channels]
+            else:
+                left = up_left = 0
+            current[i] = (value + _predictor(kind, left, previous[i], up_left)) & 0xff
+        out[row, :size] = current
+        previous = current + previous[size:]
+    return out.reshape(-1, channels)[:count][np.newaxis]
+
+
+def first_pixels(f: BinaryIO, count: int) -> Optional[np.ndarray]:
+    """
+    Return the first count pixels of any 8-bit RGB(A) non interlaced PNG
+    file (banded or not), as a (1, count, channels) array: the IDAT stream
+    is only inflated until the bytes of those pixels. Return None for other
+    PNG files, or if the data is invalid.
+    """
+    decompressor = zlib.decompressobj()
+    data = b''
+    needed = 0
+    width = height = channels = 0
+    for chunk_type, position, length in chunks(f):
+        if chunk_type == b'IHDR':
+            width, height, bit_depth, colour_type, _, _, interlace = IHDR.unpack(
+                f.read(IHDR.size)
+            )
+            channels = {colour: channels for channels, colour in COLOUR_TYPES.items()}.get(
+                colour_type, 0
+            )
+            if bit_depth != 8 or not channels or interlace or not width:
+                return None
+            count = min(count, width * height)
+            # Whole rows before the last one, then its first pixels
+            rows = (count - 1) // width
+            needed = rows * (width * channels + 1) + 1 + (count - rows * width) * channels
+        elif chunk_type == b'IDAT' and needed:
+            for offset in range(0, length, READ_SIZE):
+                try:
+                    data += decompressor.decompress(
+                        f.read(min(READ_SIZE, length - offset)),
+                        needed - len(data)
+                    )
+                except zlib.error:
+                    return None
+                if len(data) >= needed:
+                    return _unfilter_first(data, width, channels, count)
+            f.seek(position + length)
+    return None
+
+
+def read_layout(file_path: Union[str, os.PathLike]) -> Optional[BandedPng]:
+    """
+    Return the layout of a banded PNG file (only its chunk headers are
+    read), None if it is not one.
+    """
+    header = None
+    bands = None
+    idat: List[Tuple[int, int]] = []
+    with open(file_path, 'rb') as f:
+        for chunk_type, position, length in chunks(f):
+            if chunk_type == b'IHDR' and length == IHDR.size:
+                header = IHDR.unpack(f.read(length))
+            elif chunk_type == CHUNK_TYPE and length >= BANDS.size:
+                bands = f.read(length)
+            elif chunk_type == b'IDAT':
+                idat.append((position, length))
+
+    if header is None or bands is None:
+        return None
+    width, height, bit_depth, colour_type, _, _, interlace = header
+    channels = {colour: channels for channels, colour in COLOUR_TYPES.items()}.get(colour_type)
+    rows_per_band, level = BANDS.unpack_from(bands)
+    count = (len(bands) - BANDS.size) // 4
+    if (
+        bit_depth != 8
+        or channels is None
+        or interlace
+        or not rows_per_band
+        or count != -(-height // rows_per_band)
+        or len(idat) != count + 2
+    ):
+        return None
+    adlers = struct.unpack_from('>{}I'.format(count), bands, BANDS.size)
+    return BandedPng(width, height, channels, rows_per_band, level, adlers, tuple(idat[1:-1]))
+
+
+def read_bands(
+    file_path: Union[str, os.PathLike],
+    layout: BandedPng,
+    pixels: np.ndarray,
+    first: int,
+    last: int
+) -> None:
+    """
+    Decode the bands [first, last) of a banded PNG file into the rows of the
+    pixel array. Raise ValueError if they are invalid.
+    """
+    with open(file_path, 'rb') as f:
+        for band in range(first, last):
+            position, length = layout.bands[band]
+            f.seek(position)
+            first_row, last_row = layout.band_range(band)
+            size = (last_row - first_row) * (1 + layout.width * layout.channels)
+            try:
+                data = zlib.decompressobj(-zlib.MAX_WBITS).decompress(f.read(length), size)
+            except zlib.error as error:
+                raise ValueError('Invalid PNG band {}: {}'.format(band, error)) from None
+            if len(data) != size:
+                raise ValueError('Invalid PNG band {}'.format(band))
+            pixels[first_row:last_row] = _unfilter(data, layout.width, layout.channels)
+
+
+def rewrite(
+    file_path: Union[str, os.PathLike],
+    layout: BandedPng,
+    pixels: np.ndarray,
+    bands: int,
+    output: Union[str, os.PathLike]
+) -> None:
+    """
+    Save a banded PNG file with its first bands compressed again from the
+    rows of the pixel array, the other ones copied from the file. The output
+    can be the file itself (replaced once written).
+    """
+    def compressed(f: BinaryIO) -> Iterable[Tuple[bytes, int]]:
+        for band, (position, length) in enumerate(layout.bands):
+            if band < bands:
+                first_row, last_row = layout.band_range(band)
+                yield _compress(
+                    pixels[first_row:last_row],
+                    layout.level,
+                    band == len(layout.bands) - 1
+                )
+            else:
+                f.seek(position)
+                yield f.read(length), layout.adlers[band]
+
+    shape = (layout.height, layout.width, layout.channels)
+    with formats.replacing(output) as temporary_file:
+        with open(file_path, 'rb') as source, open(temporary_file, 'wb') as f:
+            _write(f, shape, layout.band_rows, layout.level, compressed(source))
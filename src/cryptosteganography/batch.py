@@ -0,0 +1,250 @@
+"""
+Save or retrieve secrets over many images at once, with a process pool.
+
+The images come from a manifest file (CSV with a header line, or JSONL) with
+the keys ``input``, ``output``, ``message`` and ``file``, or from a list of
+glob patterns. Saved items need an output file, and no two items can write
+the same one.
+"""
+import csv
+import glob
+import json
+import os
+import time
+from typing import Callable, Iterable, List, NamedTuple, Optional, Union
+
+import cryptosteganography.utils as utils
+
+__author__ = 'computationalcore@gmail.com'
+
+SAVE = 'save'
+RETRIEVE = 'retrieve'
+
+# Manifest keys
+MANIFEST_KEYS = ('input', 'output', 'message', 'file')
+
+# Password of the worker process (set once by the pool initializer)
+_password: Optional[str] = None
+
+
+class BatchItem(NamedTuple):
+    """One image of a batch."""
+    input_image_file: str
+    output_file: Optional[str] = None
+    message: Optional[str] = None
+    message_file: Optional[str] = None
+
+
+class BatchResult(NamedTuple):
+    """Outcome of one image of a batch."""
+    item: BatchItem
+    error: Optional[str] = None
+    # Bytes of secret data saved or retrieved
+    size: int = 0
+    # Retrieved secret, when there is no output file
+    secret: Union[str, bytes, None] = None
+
+
+class BatchSummary(NamedTuple):
+    """Outcome of a whole batch."""
+    images: int
+    failed: int
+    size: int
+    seconds: float
+
+    @property
+    def images_per_second(self) -> float:
+        return self.images / self.seconds if self.seconds else 0.0
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.size / 1e6 / self.seconds if self.seconds else 0.0
+
+
+def read_manifest(file_path: str) -> List[BatchItem]:
+    """
+    Read the batch items from a CSV or JSONL manifest file.
+    Raise ValueError if the format is unknown or an item has no input.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    with open(file_path, newline='', encoding='utf-8') as f:
+        if extension == '.csv':
+            rows = list(csv.DictReader(f))
+        elif extension in ('.jsonl', '.ndjson'):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            raise ValueError('Unknown manifest format: {}'.format(file_path))
+
+    items = []
+    for row in rows:
+        input_image_file, output_file, message, message_file = (
+            row.get(key) or None for key in MANIFEST_KEYS
+        )
+        if not input_image_file:
+            raise ValueError('Manifest item without input: {}'.format(row))
+        items.append(BatchItem(input_image_file, output_file, message, message_file))
+
+    return items
+
+
+def items_from_patterns(
+    patterns: Iterable[str],
+    output_dir: Optional[str] = None,
+    suffix: str = '.png',
+    message: Optional[str] = None,
+    message_file: Optional[str] = None
+) -> List[BatchItem]:
+    """
+    Build the batch items from glob patterns (plain paths work too).
+    The output file is the image name with the suffix, inside output_dir.
+    """
+    items = []
+    input_image_files = []
+    for pattern in patterns:
+        input_image_files += sorted(glob.glob(pattern)) or [pattern]
+
+    # Patterns can overlap, keep each image once
+    for input_image_file in dict.fromkeys(input_image_files):
+        output_file = None
+        if output_dir:
+            name = os.path.splitext(os.path.basename(input_image_file))[0]
+            output_file = os.path.join(output_dir, name + suffix)
+        items.append(BatchItem(input_image_file, output_file, message, message_file))
+
+    return items
+
+
+def duplicate_paths(file_paths: Iterable[str]) -> List[str]:
+    """Return the file paths given more than once (as the same file), in order."""
+    seen = set()
+    duplicates = []
+    for file_path in file_paths:
+        key = os.path.normcase(os.path.abspath(file_path))
+        if key in seen and file_path not in duplicates:
+            duplicates.append(file_path)
+        seen.add(key)
+    return duplicates
+
+
+def check_items(action: str, items: Iterable[BatchItem]) -> None:
+    """
+    Check the batch items of an action before running any of them.
+    Raise ValueError if a save item has no output file, or if several items
+    would write the same output file.
+    """
+    output_files = []
+    for item in items:
+        if action == SAVE:
+            if not item.output_file:
+                raise ValueError('Batch item without output: {}'.format(item.input_image_file))
+            output_files.append(utils.get_output_image_filename(item.output_file))
+        elif item.output_file:
+            output_files.append(item.output_file)
+
+    duplicates = duplicate_paths(output_files)
+    if duplicates:
+        raise ValueError('Several images write the same output: {}'.format(', '.join(duplicates)))
+
+
+def _init_worker(password: Optional[str]) -> None:
+    """Keep the password in the worker process."""
+    global _password
+    _password = password
+
+
+def _save(item: BatchItem) -> BatchResult:
+    """Save the secret of one item."""
+    if not item.output_file:
+        return BatchResult(item, 'Failed: Output file is required')
+    output_image_file = utils.get_output_image_filename(item.output_file)
+    item = item._replace(output_file=output_image_file)
+
+    if item.message:
+        size = len(item.message.encode())
+        error = utils.save_output_image(
+            _password,
+            item.input_image_file,
+            item.message.encode(),
+            output_image_file
+        )
+    elif item.message_file:
+        error = utils.check_data_file(item.message_file)
+        size = 0 if error else os.path.getsize(item.message_file)
+        error = error or utils.save_output_image_from_file(
+            _password,
+            item.input_image_file,
+            item.message_file,
+            output_image_file
+        )
+    else:
+        return BatchResult(item, "Failed: Message can't be empty")
+
+    return BatchResult(item, error, 0 if error else size)
+
+
+def _retrieve(item: BatchItem) -> BatchResult:
+    """Retrieve the secret of one item."""
+    if item.output_file:
+        _, error = utils.save_secret_file_from_image(
+            _password,
+            item.input_image_file,
+            item.output_file
+        )
+        size = 0 if error else os.path.getsize(item.output_file)
+        return BatchResult(item, error, size)
+
+    secret, error = utils.get_secret_from_image(_password, item.input_image_file)
+    if error:
+        return BatchResult(item, error)
+
+    size = len(secret.encode() if isinstance(secret, str) else secret or b'')
+    return BatchResult(item, None, size, secret)
+
+
+def _run_item(action: str, item: BatchItem) -> BatchResult:
+    """Run the action for one item, in a worker process."""
+    try:
+        if action == SAVE:
+            return _save(item)
+        return _retrieve(item)
+    except Exception as error:
+        # Report it and keep going with the rest of the batch
+        return BatchResult(item, 'Failed: {}'.format(error))
+
+
+def run(
+    action: str,
+    password: Optional[str],
+    items: List[BatchItem],
+    workers: Optional[int] = None,
+    on_result: Optional[Callable[[BatchResult], None]] = None
+) -> BatchSummary:
+    """
+    Run the action (SAVE or RETRIEVE) for every item in a process pool.
+    on_result is called with each result as soon as it is done.
+    Raise ValueError if the items are invalid (see check_items), before
+    any of them is run.
+    """
+    check_items(action, items)
+
+    # Loaded here, multiprocessing is slow to import (CLI startup)
+    from concurrent.futures import as_completed, ProcessPoolExecutor
+
+    failed = 0
+    size = 0
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(password,)
+    ) as executor:
+        futures = [executor.submit(_run_item, action, item) for item in items]
+        for future in as_completed(futures):
+            result = future.result()
+            failed += bool(result.error)
+            size += result.size
+            if on_result:
+                on_result(result)
+
+    return BatchSummary(len(items), failed, size, time.perf_counter() - start)
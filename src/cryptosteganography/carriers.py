@@ -0,0 +1,79 @@
+"""
+Decoded cover images reused across hides.
+
+Hiding data in the same cover image again and again decodes it every time,
+and for JPEG or PNG covers decoding takes most of the time of a hide. A
+Carrier holds the decoded pixels of an image (converted to RGB or RGBA, read
+only): hides into it copy the array, write the data and go straight to
+encoding.
+
+load returns the Carrier of an image file from a bounded per-process LRU
+cache, keyed on the file path, modification time and size, so a cover
+replaced on disk is decoded again. Each entry holds the whole pixel array (3
+or 4 bytes per pixel).
+"""
+import functools
+import os
+from typing import Union
+
+import numpy as np
+
+from cryptosteganography import engine
+
+__author__ = 'computationalcore@gmail.com'
+
+# Carriers kept in the cache
+CACHE_SIZE = 8
+
+
+class Carrier(object):
+    """Decoded pixels of a cover image, shared (read only) by the hides into it."""
+
+    def __init__(self, source: engine.ImageSource) -> None:
+        with engine.open_image(source) as image:
+            # Always a copy: the carrier owns its pixels
+            pixels = np.array(engine.to_array(image))
+        pixels.flags.writeable = False
+        self.pixels = pixels
+
+    @property
+    def width(self) -> int:
+        return self.pixels.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self.pixels.shape[0]
+
+    def copy(self) -> np.ndarray:
+        """Return a writable copy of the pixels to hide data in."""
+        return self.pixels.copy()
+
+
+def source(image_source: Union[engine.ImageSource, Carrier]) -> engine.ImageSource:
+    """Return the pixels of a Carrier, any other image source as it is."""
+    if isinstance(image_source, Carrier):
+        return image_source.pixels
+    return image_source
+
+
+def load(file_path: Union[str, os.PathLike]) -> Carrier:
+    """Return the Carrier of an image file, cached while the file is unchanged."""
+    file_path = os.path.abspath(os.fspath(file_path))
+    stat = os.stat(file_path)
+    return _load(file_path, stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _load(file_path: str, mtime_ns: int, size: int) -> Carrier:
+    """Decode an image file (the modification time and size key the cache)."""
+    return Carrier(file_path)
+
+
+def cache_info():
+    """Return the cache statistics (hits, misses, maxsize, currsize)."""
+    return _load.cache_info()
+
+
+def cache_clear() -> None:
+    """Remove every carrier from the cache."""
+    _load.cache_clear()
@@ -5,12 +5,17 @@ A python steganography module to store messages and files AES-256 encrypted
 inside an image.
 """
 import argparse
+import cProfile
 import getpass
+import os
 import sys
+from typing import Union
 
 from exitstatus import ExitStatus
-from importlib.metadata import version, PackageNotFoundError
 
+import cryptosteganography.batch as batch
+import cryptosteganography.formats as formats
+import cryptosteganography.shards as shards
 import cryptosteganography.utils as utils
 
 __author__ = 'computationalcore@gmail.com'
@@ -29,8 +34,7 @@ def get_parser(parse_this=None) -> argparse.ArgumentParser:
     parser.add_argument(
         '-v',
         '--version',
-        action='version',
-        version=get_package_version('cryptosteganography')
+        action=_VersionAction
     )
 
     subparsers = parser.add_subparsers(help='sub-command help', dest='command')
@@ -73,6 +77,28 @@ def get_parser(parse_this=None) -> argparse.ArgumentParser:
         required=True,
         help='Output image containing the secret.'
     )
+    # PNG encoder settings
+    parser_save.add_argument(
+        '--compression-level',
+        dest='compress_level',
+        type=int,
+        choices=range(10),
+        metavar='{0-9}',
+        help='PNG compression level, 0 (none, fastest) to 9 (smallest). Default: 6.'
+    )
+    parser_save.add_argument(
+        '--compression-strategy',
+        dest='compress_strategy',
+        choices=list(formats.PNG_STRATEGIES),
+        help='zlib strategy for the PNG compression.'
+    )
+    parser_save.add_argument(
+        '--format',
+        dest='output_format',
+        choices=list(formats.FORMATS),
+        help='Lossless output image format. Default: from the output file extension, or png.'
+    )
+    _add_profile_argument(parser_save)
 
     # Sub parser: Retrieve
     parser_retrieve = subparsers.add_parser(
@@ -92,12 +118,190 @@ def get_parser(parse_this=None) -> argparse.ArgumentParser:
         dest='retrieved_file',
         help='Output for the binary secret file (Text or any binary file).'
     )
+    _add_profile_argument(parser_retrieve)
+
+    # Sub parser: Batch save
+    parser_batch_save = subparsers.add_parser(
+        'batch-save',
+        help='batch-save help'
+    )
+    _add_batch_arguments(parser_batch_save, 'Directory for the output images.')
+    group_batch_secret = parser_batch_save.add_mutually_exclusive_group()
+    group_batch_secret.add_argument(
+        '-m',
+        '--message',
+        dest='message',
+        help='Secret message to hide in every input image (non binary).'
+    )
+    group_batch_secret.add_argument(
+        '-f',
+        '--file',
+        dest='message_file',
+        help='Secret to hide in every input image (Text or any binary file).'
+    )
+
+    # Sub parser: Batch retrieve
+    parser_batch_retrieve = subparsers.add_parser(
+        'batch-retrieve',
+        help='batch-retrieve help'
+    )
+    _add_batch_arguments(
+        parser_batch_retrieve,
+        'Directory for the secret files (printed if not informed).'
+    )
+
+    # Sub parser: Shard save
+    parser_shard_save = subparsers.add_parser(
+        'shard-save',
+        help='shard-save help'
+    )
+    parser_shard_save.add_argument(
+        '-i',
+        '--input',
+        dest='input_patterns',
+        nargs='+',
+        required=True,
+        help='Input image files or glob patterns, the secret is split across them.'
+    )
+    parser_shard_save.add_argument(
+        '-f',
+        '--file',
+        dest='message_file',
+        required=True,
+        help='Secret file to split across the images (Text or any binary file).'
+    )
+    parser_shard_save.add_argument(
+        '-o',
+        '--output-dir',
+        dest='output_dir',
+        required=True,
+        help='Directory for the output images.'
+    )
+    parser_shard_save.add_argument(
+        '-p',
+        '--parity',
+        dest='parity',
+        type=int,
+        default=0,
+        help='Number of images that can be lost: the last ones get parity shards.'
+    )
+    _add_workers_argument(parser_shard_save)
+
+    # Sub parser: Shard retrieve
+    parser_shard_retrieve = subparsers.add_parser(
+        'shard-retrieve',
+        help='shard-retrieve help'
+    )
+    parser_shard_retrieve.add_argument(
+        '-i',
+        '--input',
+        dest='input_patterns',
+        nargs='+',
+        required=True,
+        help='Image files or glob patterns holding the shards (in any order).'
+    )
+    parser_shard_retrieve.add_argument(
+        '-o',
+        '--output',
+        dest='retrieved_file',
+        required=True,
+        help='Output for the secret file.'
+    )
+    _add_workers_argument(parser_shard_retrieve)
+
+    # Sub parser: Scan
+    parser_scan = subparsers.add_parser(
+        'scan',
+        help='scan help'
+    )
+    parser_scan.add_argument(
+        '-i',
+        '--input',
+        dest='input_paths',
+        nargs='+',
+        required=True,
+        help='Image files or directories (walked for lossless images) to scan.'
+    )
+    parser_scan.add_argument(
+        '-o',
+        '--output',
+        dest='index_file',
+        help='JSONL index of the images holding a secret (default: standard output).'
+    )
+    _add_workers_argument(parser_scan)
 
     return parser
 
 
+def _add_profile_argument(parser):
+    """Add the --profile option to a sub command parser."""
+    parser.add_argument(
+        '--profile',
+        nargs='?',
+        const=True,
+        metavar='FILE',
+        help='Print the time, bytes and pixels of each stage. With FILE, also save '
+             'the cProfile stats to it.'
+    )
+
+
+def _add_batch_arguments(parser, output_help):
+    """Add the arguments shared by the batch sub commands."""
+    group_input = parser.add_mutually_exclusive_group(required=True)
+    group_input.add_argument(
+        '--manifest',
+        dest='manifest_file',
+        help='CSV or JSONL manifest (keys: input, output, message, file).'
+    )
+    group_input.add_argument(
+        '-i',
+        '--input',
+        dest='input_patterns',
+        nargs='+',
+        help='Input image files or glob patterns.'
+    )
+    parser.add_argument(
+        '-o',
+        '--output-dir',
+        dest='output_dir',
+        help=output_help
+    )
+    _add_workers_argument(parser)
+
+
+def _add_workers_argument(parser):
+    """Add the --workers option to a sub command parser."""
+    parser.add_argument(
+        '-w',
+        '--workers',
+        dest='workers',
+        type=int,
+        help='Number of worker processes (default: number of CPUs).'
+    )
+
+
+class _VersionAction(argparse.Action):
+    """Print the package version and exit, looked up only when asked for."""
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS,
+                 help="show program's version number and exit"):
+        super().__init__(
+            option_strings=option_strings,
+            dest=dest,
+            default=default,
+            nargs=0,
+            help=help
+        )
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        parser.exit(message=get_package_version('cryptosteganography') + '\n')
+
+
 def get_package_version(package_name):
     """Get the version of the package."""
+    # Slow to import, only needed for --version
+    from importlib.metadata import PackageNotFoundError, version
+
     try:
         return version(package_name)
     except PackageNotFoundError:
@@ -112,7 +316,10 @@ def _save_parse_input(args):
     if args.message:
         message = args.message
     elif args.message_file:
-        message, error = utils.get_data_from_file(args.message_file)
+        # The file is streamed to the image, only check it here
+        error = utils.check_data_file(args.message_file)
+        if not error:
+            return args.message_file, None
 
     # Validate message
     if not message and not error:
@@ -121,6 +328,35 @@ def _save_parse_input(args):
     return message, error
 
 
+def _run_profiled(args, password, action):
+    """
+    Run the action. With --profile print the time, bytes and pixels of each
+    stage (to stderr), with --profile FILE also dump the cProfile stats.
+    """
+    profile = getattr(args, 'profile', None)
+    if not profile:
+        return action()
+
+    crypto_steganography = utils.get_crypto_steganography(password)
+    collected = []
+    crypto_steganography.on_stats = collected.append
+    try:
+        if profile is True:
+            result = action()
+        else:
+            profiler = cProfile.Profile()
+            result = profiler.runcall(action)
+            profiler.dump_stats(profile)
+    finally:
+        crypto_steganography.on_stats = None
+
+    for call_stats in collected:
+        print(call_stats.report(), file=sys.stderr)
+    if profile is not True:
+        print(f'Profile saved to {profile}', file=sys.stderr)
+    return result
+
+
 def _handle_save_action(args) -> ExitStatus:
     """Save secret in file action."""
     message, error = _save_parse_input(args)
@@ -131,16 +367,39 @@ def _handle_save_action(args) -> ExitStatus:
         error = "Failed: Password can't be empty"
 
     if not error:
-        output_image_file = utils.get_output_image_filename(args.output_image_file)
-
-        # Hide message and save the image
-        error = utils.save_output_image(
-            password,
-            args.input_image_file,
-            message,
-            output_image_file
+        # Output settings (optional in namespaces built by hand)
+        output_format = getattr(args, 'output_format', None)
+        compress_level = getattr(args, 'compress_level', None)
+        compress_strategy = getattr(args, 'compress_strategy', None)
+        output_image_file = utils.get_output_image_filename(
+            args.output_image_file,
+            output_format
         )
 
+        def hide():
+            # Hide message and save the image
+            if args.message:
+                return utils.save_output_image(
+                    password,
+                    args.input_image_file,
+                    message,
+                    output_image_file,
+                    compress_level,
+                    compress_strategy,
+                    output_format
+                )
+            return utils.save_output_image_from_file(
+                password,
+                args.input_image_file,
+                message,
+                output_image_file,
+                compress_level,
+                compress_strategy,
+                output_format
+            )
+
+        error = _run_profiled(args, password, hide)
+
     if not error:
         print(f'Output image {output_image_file} saved with success')
         return ExitStatus.success
@@ -151,6 +410,7 @@ def _handle_save_action(args) -> ExitStatus:
 
 def _handle_retrieve_action(args) -> ExitStatus:
     """Retrieve secret from file action."""
+    secret: Union[str, bytes, None] = None
     error = None
 
     # Get password (the string used to derive the encryption key)
@@ -159,11 +419,23 @@ def _handle_retrieve_action(args) -> ExitStatus:
         error = "Failed: Password can't be empty"
 
     if not error:
-        secret, error = utils.get_secret_from_image(password, args.input_image_file)
-
-    # Print or save to a file the data
-    if not error and args.retrieved_file:
-        secret = utils.save_secret_file(secret, args.retrieved_file)
+        if args.retrieved_file:
+            # Stream the data straight to the file
+            secret, error = _run_profiled(
+                args,
+                password,
+                lambda: utils.save_secret_file_from_image(
+                    password,
+                    args.input_image_file,
+                    args.retrieved_file
+                )
+            )
+        else:
+            secret, error = _run_profiled(
+                args,
+                password,
+                lambda: utils.get_secret_from_image(password, args.input_image_file)
+            )
 
     if not error:
         print(secret)
@@ -173,6 +445,178 @@ def _handle_retrieve_action(args) -> ExitStatus:
     return ExitStatus.failure
 
 
+def _batch_parse_input(args, action):
+    """Parse input args of the batch actions"""
+    if args.workers is not None and args.workers < 1:
+        return None, 'Failed: The number of workers must be at least 1'
+
+    if args.manifest_file:
+        try:
+            return batch.read_manifest(args.manifest_file), None
+        except FileNotFoundError:
+            return None, 'Failed: File {} not found.'.format(args.manifest_file)
+        except ValueError as error:
+            return None, 'Failed: {}'.format(error)
+
+    if action == batch.SAVE:
+        if not args.output_dir:
+            return None, 'Failed: The output directory is required with --input'
+        if not args.message and not args.message_file:
+            return None, "Failed: Message can't be empty"
+
+    items = batch.items_from_patterns(
+        args.input_patterns,
+        args.output_dir,
+        '.png' if action == batch.SAVE else '.bin',
+        getattr(args, 'message', None),
+        getattr(args, 'message_file', None)
+    )
+    return items, None
+
+
+def _print_batch_result(result) -> None:
+    """Print the status of one batch item."""
+    item = result.item
+    if result.error:
+        print(f'[FAILED] {item.input_image_file}: {result.error}')
+    elif result.secret is not None:
+        print(f'[OK] {item.input_image_file}: {result.secret}')
+    else:
+        print(f'[OK] {item.input_image_file} -> {item.output_file}')
+
+
+def _handle_batch_action(args, action) -> ExitStatus:
+    """Save or retrieve secrets over many images action."""
+    items, error = _batch_parse_input(args, action)
+
+    if not error:
+        try:
+            batch.check_items(action, items)
+        except ValueError as items_error:
+            error = 'Failed: {}'.format(items_error)
+
+    if not error:
+        # Get password once for the whole batch
+        password = getpass.getpass('Enter the key password: ').strip()
+        if not password:
+            error = "Failed: Password can't be empty"
+
+    if error:
+        print(error)
+        return ExitStatus.failure
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    summary = batch.run(action, password, items, args.workers, _print_batch_result)
+    print(
+        f'{summary.images} images in {summary.seconds:.2f}s '
+        f'({summary.images_per_second:.2f} images/s, {summary.mb_per_second:.2f} MB/s), '
+        f'{summary.failed} failed'
+    )
+
+    return ExitStatus.failure if summary.failed else ExitStatus.success
+
+
+def _shard_parse_input(args, action):
+    """Parse input args of the shard actions"""
+    if args.workers is not None and args.workers < 1:
+        return None, 'Failed: The number of workers must be at least 1'
+    if action == batch.RETRIEVE:
+        return batch.items_from_patterns(args.input_patterns), None
+
+    if args.parity < 0:
+        return None, "Failed: The number of parity shards can't be negative"
+    error = utils.check_data_file(args.message_file)
+    if error:
+        return None, error
+
+    items = batch.items_from_patterns(args.input_patterns, args.output_dir)
+    try:
+        batch.check_items(action, items)
+    except ValueError as items_error:
+        return None, 'Failed: {}'.format(items_error)
+    return items, None
+
+
+def _handle_shard_action(args, action) -> ExitStatus:
+    """Split a secret file across many images, or put it back together, action."""
+    items, error = _shard_parse_input(args, action)
+
+    if not error:
+        password = getpass.getpass('Enter the key password: ').strip()
+        if not password:
+            error = "Failed: Password can't be empty"
+
+    if error:
+        print(error)
+        return ExitStatus.failure
+
+    input_image_files = [item.input_image_file for item in items]
+    crypto_steganography = utils.get_crypto_steganography(password)
+    try:
+        if action == batch.SAVE:
+            os.makedirs(args.output_dir, exist_ok=True)
+            summary = shards.hide(
+                crypto_steganography,
+                input_image_files,
+                [item.output_file for item in items if item.output_file],
+                args.message_file,
+                args.workers,
+                args.parity
+            )
+        else:
+            summary = shards.retrieve(
+                crypto_steganography,
+                input_image_files,
+                args.retrieved_file,
+                args.workers
+            )
+    except (OSError, ValueError) as shard_error:
+        print('Failed: {}'.format(shard_error))
+        return ExitStatus.failure
+
+    print(
+        f'{summary.shards} shards, {summary.size} bytes in {summary.seconds:.2f}s '
+        f'({summary.mb_per_second:.2f} MB/s)'
+    )
+    return ExitStatus.success
+
+
+def _handle_scan(args) -> ExitStatus:
+    """Find the images holding a secret action."""
+    if args.workers is not None and args.workers < 1:
+        print('Failed: The number of workers must be at least 1')
+        return ExitStatus.failure
+
+    # Loaded here, it needs NumPy and PIL (CLI startup)
+    import json
+    import cryptosteganography.scan as scan
+
+    index = open(args.index_file, 'w', encoding='utf-8') if args.index_file else sys.stdout
+
+    def write_hit(result) -> None:
+        if result.header is not None:
+            index.write(json.dumps(result.as_dict()) + '\n')
+        elif result.error:
+            print(f'[FAILED] {result.image_file}: {result.error}', file=sys.stderr)
+
+    try:
+        summary = scan.scan(args.input_paths, args.workers, write_hit)
+    finally:
+        if index is not sys.stdout:
+            index.close()
+
+    # The index can be the standard output
+    print(
+        f'{summary.images} images in {summary.seconds:.2f}s '
+        f'({summary.images_per_second:.2f} images/s), {summary.hits} hits, '
+        f'{summary.failed} failed',
+        file=sys.stderr
+    )
+    return ExitStatus.failure if summary.failed else ExitStatus.success
+
+
 def main() -> ExitStatus:
     """Accept arguments and run the script."""
     parser = get_parser()
@@ -182,6 +626,16 @@ def main() -> ExitStatus:
         return _handle_save_action(args)
     elif args.command == 'retrieve':
         return _handle_retrieve_action(args)
+    elif args.command == 'batch-save':
+        return _handle_batch_action(args, batch.SAVE)
+    elif args.command == 'batch-retrieve':
+        return _handle_batch_action(args, batch.RETRIEVE)
+    elif args.command == 'shard-save':
+        return _handle_shard_action(args, batch.SAVE)
+    elif args.command == 'shard-retrieve':
+        return _handle_shard_action(args, batch.RETRIEVE)
+    elif args.command == 'scan':
+        return _handle_scan(args)
     else:
         parser.print_help()
         return ExitStatus.failure
@@ -0,0 +1,196 @@
+"""
+Compression of the data before encryption.
+
+Cipher data does not compress, so compressible payloads (text, logs...) are
+compressed before being encrypted: they take less of the carrier capacity
+and less time to embed. The codec is recorded in the container header flags
+(see the container module) and retrieve undoes it.
+
+zlib and lzma come with Python, zstd needs the zstandard package
+(``pip install cryptosteganography[zstd]``). The adaptive mode ('auto')
+compresses a sample of the data first and stores the data as it is when the
+sample does not shrink (JPEG, MP3, archives...).
+"""
+import importlib.util
+import lzma
+from typing import Any, Optional, Tuple, Type
+import zlib
+
+__author__ = 'computationalcore@gmail.com'
+
+# Codecs, as saved in the container header flags
+NONE = 0
+ZLIB = 1
+LZMA = 2
+ZSTD = 3
+
+CODECS = {
+    'zlib': ZLIB,
+    'lzma': LZMA,
+    'zstd': ZSTD,
+}
+AUTO = 'auto'
+
+ZSTD_LEVEL = 3
+ZSTD_BLOCK_SIZE = 128 * 1024
+LZMA2_CHUNK_SIZE = 64 * 1024
+# Stream header and footer (12 bytes each), block header (12), padding (3),
+# CRC64 check (8), LZMA2 end marker (1) and index (16)
+XZ_OVERHEAD = 64
+# Bytes compressed by the adaptive mode to estimate the ratio
+SAMPLE_SIZE = 64 * 1024
+# The adaptive mode compresses the data when the sample shrinks below it
+MAX_RATIO = 0.9
+
+
+def _zstd() -> Any:
+    """Return the zstandard module, raise ValueError if not installed."""
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError('zstd compression needs the zstandard package') from None
+    return zstandard
+
+
+def available() -> Tuple[str, ...]:
+    """Return the names of the codecs that can be used."""
+    return tuple(
+        name for name in CODECS
+        if name != 'zstd' or importlib.util.find_spec('zstandard') is not None
+    )
+
+
+def validate(name: Optional[str]) -> None:
+    """Raise ValueError if the compression setting is not supported."""
+    if name is None or name == AUTO:
+        return
+    if name not in CODECS:
+        raise ValueError('Invalid compression: {}'.format(name))
+    if name not in available():
+        # Raises the error explaining what is missing
+        _zstd()
+
+
+def ratio(sample: bytes) -> float:
+    """Return the size ratio of the sample compressed with fast zlib."""
+    if not sample:
+        return 1.0
+    return len(zlib.compress(sample, 1)) / len(sample)
+
+
+def select(name: Optional[str], sample: bytes) -> int:
+    """
+    Return the codec for the compression setting: None (no compression), a
+    codec name, or 'auto' (the best available codec if the sample of the
+    data compresses well, else no compression).
+    """
+    if name is None:
+        return NONE
+    if name != AUTO:
+        return CODECS[name]
+    if ratio(sample[:SAMPLE_SIZE]) > MAX_RATIO:
+        return NONE
+    return ZSTD if 'zstd' in available() else ZLIB
+
+
+def codecs(name: Optional[str]) -> Tuple[int, ...]:
+    """
+    Return the codecs the compression setting can store data with (NONE
+    excepted, see select).
+    """
+    if name is None:
+        return ()
+    if name != AUTO:
+        return (CODECS[name],)
+    return (ZSTD if 'zstd' in available() else ZLIB,)
+
+
+def codec_bound(size: int, codec: int) -> int:
+    """Return the largest size of size bytes compressed with the codec."""
+    if codec == ZLIB:
+        # zlib's deflateBound: 5 bytes per 16 KiB stored block, the zlib
+        # header and checksum and the last block
+        return size + (size >> 12) + (size >> 14) + (size >> 25) + 13
+    if codec == LZMA:
+        # xz stream and block headers, check, index and footer, and the
+        # LZMA2 chunk headers (3 bytes per 64 KiB, 1 more for the chunks
+        # resetting the encoder state)
+        return size + -(-size // LZMA2_CHUNK_SIZE) * 4 + XZ_OVERHEAD
+    if codec == ZSTD:
+        # ZSTD_COMPRESSBOUND
+        margin = (ZSTD_BLOCK_SIZE - size) >> 11 if size < ZSTD_BLOCK_SIZE else 0
+        return size + (size >> 8) + margin
+    return size
+
+
+def bound(size: int, name: Optional[str]) -> int:
+    """
+    Return an upper bound of the size of size bytes stored with the
+    compression setting (see select).
+    """
+    return max([size] + [codec_bound(size, codec) for codec in codecs(name)])
+
+
+def max_size(size: int, name: Optional[str]) -> int:
+    """
+    Return the largest data size whose bound (see bound) is at most size
+    bytes, -1 if even empty data may not fit.
+    """
+    if bound(0, name) > size:
+        return -1
+    # bound is increasing
+    low, high = 0, size
+    while low < high:
+        middle = (low + high + 1) // 2
+        if bound(middle, name) <= size:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def compressor(codec: int) -> Any:
+    """Return a streaming compressor (compress and flush methods) of the codec."""
+    if codec == ZLIB:
+        return zlib.compressobj()
+    if codec == LZMA:
+        return lzma.LZMACompressor()
+    if codec == ZSTD:
+        return _zstd().ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    raise ValueError('Unknown compression codec: {}'.format(codec))
+
+
+class Decompressor(object):
+    """Streaming decompressor of a codec (NONE passes the data through)."""
+
+    def __init__(self, codec: int) -> None:
+        self.codec = codec
+        self._decompressor: Any = None
+        self._errors: Tuple[Type[Exception], ...] = (zlib.error, lzma.LZMAError)
+        if codec == NONE:
+            pass
+        elif codec == ZLIB:
+            self._decompressor = zlib.decompressobj()
+        elif codec == LZMA:
+            self._decompressor = lzma.LZMADecompressor()
+        elif codec == ZSTD:
+            zstandard = _zstd()
+            self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+            self._errors = (zstandard.ZstdError,)
+        else:
+            raise ValueError('Unknown compression codec: {}'.format(codec))
+
+    def decompress(self, data: bytes) -> bytes:
+        """Return the data decompressed from the next chunk."""
+        if self._decompressor is None:
+            return data
+        try:
+            return self._decompressor.decompress(data)
+        except self._errors as error:
+            raise ValueError('Invalid compressed data: {}'.format(error)) from None
+
+    def finish(self) -> None:
+        """Raise ValueError if the compressed data was truncated."""
+        # zstandard's decompressobj does not report the end of the frame
+        if self.codec in (ZLIB, LZMA) and not self._decompressor.eof:
+            raise ValueError('Truncated compressed data')
@@ -0,0 +1,244 @@
+"""
+Binary container format for the data hidden inside an image.
+
+The container is embedded bit by bit in the image (see the engine module)
+and starts with a fixed size header::
+
+    +-------+---------+-------+--------+-------------------+
+    | magic | version | flags | length | body              |
+    +-------+---------+-------+--------+-------------------+
+      4       1         1       4        length bytes
+
+The header is always stored with one bit per channel, so it can be read
+without knowing anything about the image. The flags select how the body is
+stored:
+
+- bits 0-1: number of bits stored per channel in the body, minus one.
+- bit 2: scattered body. The body is written to the pixels after the ones
+  holding the header in a key-seeded order (see the permutation module)
+  instead of right after the header.
+- bits 3-4: codec the data was compressed with before being encrypted (see
+  the compression module), 0 if it was not.
+- bit 5: shard of a secret split across several images (see the shards
+  module), only read by the shard reassembly.
+
+Version 3 body: key derivation parameters and salt (see the kdf module),
+key check value (4 bytes), AES-256-GCM nonce (12 bytes), cipher data (same
+size as the data) and authentication tag (16 bytes). The key derivation
+parameters, salt and key check value are authenticated too.
+
+Version 2 body: key derivation parameters and salt, AES-256-CBC
+initialization vector (16 bytes) and the cipher data (PKCS#7 padded).
+
+Version 1 body: initialization vector and cipher data, encrypted with the
+unsalted SHA-256 hash of the password.
+
+Images written before the container existed hold a base64 string in
+stegano's LSB format instead. They never start with the magic value
+(stegano's format starts with an ASCII digit), so both can be told apart.
+"""
+import struct
+from typing import NamedTuple, Optional, Union
+
+import numpy as np
+from PIL import Image
+
+from cryptosteganography import engine
+
+__author__ = 'computationalcore@gmail.com'
+
+MAGIC = b'CSTG'
+VERSION = 3
+SUPPORTED_VERSIONS = (1, 2, 3)
+
+# Big-endian: magic, version, flags, body length
+HEADER = struct.Struct('>4sBBI')
+# Number of channels (bits) used by the header
+HEADER_BITS = HEADER.size * 8
+# Number of pixels used by the header, a scattered body starts after them
+HEADER_PIXELS = -(-HEADER_BITS // engine.CHANNELS)
+
+# Flags
+DEPTH_MASK = 0b11
+SCATTERED = 0b100
+CODEC_SHIFT = 3
+CODEC_MASK = 0b11 << CODEC_SHIFT
+SHARD = 0b100000
+KNOWN_FLAGS = DEPTH_MASK | SCATTERED | CODEC_MASK | SHARD
+
+
+class Header(NamedTuple):
+    """Container header fields."""
+    version: int
+    flags: int
+    length: int
+
+    @property
+    def depth(self) -> int:
+        """Number of bits stored per channel in the body."""
+        return (self.flags & DEPTH_MASK) + 1
+
+    @property
+    def scattered(self) -> bool:
+        """Whether the body is written in a key-seeded pixel order."""
+        return bool(self.flags & SCATTERED)
+
+    @property
+    def codec(self) -> int:
+        """Codec the data was compressed with (see the compression module)."""
+        return (self.flags & CODEC_MASK) >> CODEC_SHIFT
+
+    @property
+    def shard(self) -> bool:
+        """Whether the body holds a shard of a secret."""
+        return bool(self.flags & SHARD)
+
+
+def depth_flags(depth: int) -> int:
+    """Return the flags for a body stored with depth bits per channel."""
+    if not 1 <= depth <= engine.MAX_DEPTH:
+        raise ValueError('Invalid bits per channel: {}'.format(depth))
+    return depth - 1
+
+
+def codec_flags(codec: int) -> int:
+    """Return the flags for data compressed with the codec."""
+    if codec << CODEC_SHIFT & ~CODEC_MASK:
+        raise ValueError('Invalid compression codec: {}'.format(codec))
+    return codec << CODEC_SHIFT
+
+
+def body_capacity(channels: int, depth: int = 1, scattered: bool = False) -> int:
+    """Return the largest body (in bytes) that fits in the informed channels."""
+    header = HEADER_PIXELS * engine.CHANNELS if scattered else HEADER_BITS
+    return max((channels - header) * depth // 8, 0)
+
+
+def order_size(channels: int) -> int:
+    """Return the number of pixels a scattered body is spread over."""
+    return max(channels // engine.CHANNELS - HEADER_PIXELS, 0)
+
+
+def pack_header(length: int, version: int = VERSION, flags: int = 0) -> bytes:
+    """Return the header bytes for a body of the informed length."""
+    return HEADER.pack(MAGIC, version, flags, length)
+
+
+def unpack_header(data: bytes) -> Optional[Header]:
+    """
+    Parse the header bytes.
+    Return None if the data is not a header of a supported version.
+    """
+    if len(data) < HEADER.size:
+        return None
+
+    magic, version, flags, length = HEADER.unpack_from(data)
+    if magic != MAGIC or version not in SUPPORTED_VERSIONS or flags & ~KNOWN_FLAGS:
+        return None
+
+    return Header(version, flags, length)
+
+
+def write_header(pixels: np.ndarray, length: int, version: int = VERSION, flags: int = 0) -> None:
+    """Embed the header of a body of the informed length in the pixels."""
+    engine.embed(pixels, pack_header(length, version, flags))
+
+
+def write_body(
+    pixels: np.ndarray,
+    data: bytes,
+    position: int = 0,
+    depth: int = 1,
+    workers: int = 1,
+    order: Optional[np.ndarray] = None
+) -> None:
+    """
+    Embed data in the pixels at the informed byte position of the body,
+    stored with depth bits per channel (in up to workers row bands). A
+    scattered body is written in the pixel order (see order_size) instead.
+    Raise ValueError if the image is too small to hold it.
+    """
+    if order is not None:
+        engine.embed_ordered(pixels, data, order, HEADER_PIXELS, depth, position * 8)
+        return
+    engine.embed(pixels, data, HEADER_BITS, depth, position * 8, workers)
+
+
+def read_header(image: Union[Image.Image, np.ndarray]) -> Optional[Header]:
+    """
+    Return the container header hidden in the image, or its pixel array
+    (if any).
+
+    Only the first pixels are read (see engine.head_pixels: 8-bit RGB(A)
+    PNG files and uncompressed BMP and TIFF files are not decoded, other
+    images are), and a header announcing a body larger than the image can
+    hold is rejected, so images without a container are discarded without
+    extracting their body.
+    """
+    if isinstance(image, np.ndarray):
+        channels = engine.capacity(image)
+    else:
+        channels = engine.image_capacity(image)
+    if channels < HEADER_BITS:
+        return None
+
+    if isinstance(image, np.ndarray):
+        return parse_header(engine.extract(image, HEADER.size), channels)
+    return parse_header(
+        engine.extract(engine.head_pixels(image, HEADER_PIXELS), HEADER.size),
+        channels
+    )
+
+
+def parse_header(data: bytes, channels: int) -> Optional[Header]:
+    """
+    Parse the header bytes read from an image with the informed number of
+    channels. Return None if they are not a header, or if it announces a
+    body larger than the image can hold.
+    """
+    header = unpack_header(data)
+    if header and header.length > body_capacity(channels, header.depth, header.scattered):
+        return None
+    return header
+
+
+def read_body(
+    image: Union[Image.Image, np.ndarray],
+    header: Header,
+    position: int = 0,
+    size: Optional[int] = None,
+    workers: int = 1,
+    order: Optional[np.ndarray] = None
+) -> bytes:
+    """
+    Return the container body described by the header, or size bytes of it
+    from the informed byte position (read in up to workers row bands).
+    Scattered bodies are read in the pixel order, from the image or,
+    better, from its pixel array decoded once.
+    """
+    if size is None:
+        size = header.length - position
+    if position + size > header.length:
+        raise ValueError('Reading past the end of the body')
+    if header.scattered:
+        if order is None:
+            raise ValueError('A scattered body needs a pixel order')
+        pixels = image if isinstance(image, np.ndarray) else engine.to_array(image)
+        return engine.extract_ordered(
+            pixels,
+            size,
+            order,
+            HEADER_PIXELS,
+            header.depth,
+            position * 8
+        )
+    if isinstance(image, np.ndarray):
+        return engine.extract(image, size, HEADER_BITS, header.depth, position * 8, workers)
+    return engine.extract_from_image(
+        image,
+        size,
+        HEADER_BITS,
+        header.depth,
+        position * 8,
+        workers
+    )
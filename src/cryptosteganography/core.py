@@ -0,0 +1,1058 @@
+"""
+CryptoSteganography class.
+
+stegano (which loads OpenCV) and asyncio are slow to import and only needed
+by the stegano engine and the async methods, they are imported on first use.
+"""
+import base64
+import functools
+import hashlib
+import io
+import os
+import shutil
+import weakref
+
+from Cryptodome import Random
+from Cryptodome.Cipher import AES
+from Cryptodome.Util.Padding import pad, unpad
+from PIL import UnidentifiedImageError
+
+from cryptosteganography import (
+    banded,
+    carriers,
+    compression as compression_codecs,
+    container,
+    engine as lsb_engine,
+    formats,
+    kdf,
+    mapped,
+    permutation,
+    stats
+)
+
+__author__ = 'computationalcore@gmail.com'
+
+# Bytes read, encrypted and embedded at a time by the streaming methods
+CHUNK_SIZE = 1024 * 1024
+# AES-GCM nonce and authentication tag sizes
+NONCE_SIZE = 12
+TAG_SIZE = 16
+
+
+class CryptoSteganography(object):
+    """
+    Main class to handle Steganography encrypted data.
+    """
+
+    # Available LSB embedding engines
+    ENGINES = ('numpy', 'stegano')
+
+    def __init__(
+        self,
+        key,
+        engine='numpy',
+        kdf_params=None,
+        bits_per_channel=1,
+        executor=None,
+        max_concurrency=None,
+        on_stats=None,
+        workers=1,
+        scatter=False,
+        compression=None,
+        carrier_cache=False
+    ):
+        """
+        Constructor
+        :param key: string that used to derive the key
+        :param engine: LSB engine, 'numpy' (vectorized, default) or
+        'stegano' (the stegano library, one pixel at a time). The stegano
+        engine can only hide text, so it saves the legacy base64 format.
+        Both engines read every format.
+        :param kdf_params: Key derivation function and parameters
+        (kdf.KDFParams), scrypt by default
+        :param bits_per_channel: Bits of data stored in each colour channel
+        (1 to 4). More bits touch fewer pixels but change them more. Saved
+        in the image, retrieve detects it. The stegano engine only
+        supports 1.
+        :param executor: concurrent.futures executor the async methods run
+        the work on (thread or process pool), asyncio's default thread pool
+        if not informed
+        :param max_concurrency: Maximum number of async calls running at
+        the same time (per event loop), the number of CPUs by default
+        :param on_stats: Callable called with the per-stage wall time, bytes
+        and pixels (stats.Stats) of every hide or retrieve call. Called
+        from the thread running the work, not called in process pools.
+        :param workers: Threads embedding (or extracting) the data of large
+        images, each one in its own band of rows. The output is the same
+        whatever the number of workers.
+        :param scatter: Spread the data over the whole image, in a pixel
+        order seeded by the key, instead of writing it to the first rows.
+        Saved in the image, retrieve detects it. The order of each image
+        size is cached (see the permutation module).
+        :param compression: Compress the data before encrypting it: 'zlib',
+        'lzma', 'zstd' (needs the zstandard package) or 'auto' (zstd if
+        installed, else zlib, skipped when a sample of the data does not
+        shrink). Saved in the image, retrieve detects it.
+        :param carrier_cache: Keep the decoded pixels of the input image
+        files hidden into (see the carriers module), so hiding again in the
+        same cover skips decoding it. Files changed on disk are decoded
+        again.
+        """
+        if engine not in self.ENGINES:
+            raise ValueError('Invalid engine: {}'.format(engine))
+        if engine == 'stegano' and bits_per_channel != 1:
+            raise ValueError('The stegano engine only stores 1 bit per channel')
+        if engine == 'stegano' and scatter:
+            raise ValueError('The stegano engine can not scatter the data')
+        if engine == 'stegano' and compression:
+            raise ValueError('The stegano engine can not compress the data')
+        compression_codecs.validate(compression)
+        if workers < 1:
+            raise ValueError('Invalid number of workers: {}'.format(workers))
+
+        self.engine = engine
+        self.bits_per_channel = bits_per_channel
+        self.scatter = scatter
+        self.compression = compression
+        self._flags = container.depth_flags(bits_per_channel)
+        if scatter:
+            self._flags |= container.SCATTERED
+        self.block_size = 32
+        self.kdf_params = kdf_params or kdf.DEFAULT_PARAMS
+        kdf.validate(self.kdf_params)
+        self._password = key
+        # One salt per instance, so the key is derived once for all the
+        # images saved with it (the IV is still random for each image)
+        self.salt = kdf.new_salt()
+        # Create a sha256 hash from the informed string key (legacy formats)
+        self.key = hashlib.sha256(key.encode()).digest()
+        self._order_seed = permutation.seed(key)
+        self.executor = executor
+        self.max_concurrency = max_concurrency or os.cpu_count() or 1
+        # Semaphores bounding the async calls, one per event loop
+        self._semaphores = weakref.WeakKeyDictionary()
+        self.on_stats = on_stats
+        self.workers = workers
+        self.carrier_cache = carrier_cache
+
+    def __getstate__(self):
+        """
+        Drop the executor, semaphores and stats callback when pickled, to
+        run the work in a process pool.
+        """
+        state = self.__dict__.copy()
+        state['executor'] = None
+        state['on_stats'] = None
+        state['_semaphores'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def hide(
+        self,
+        input_filename,
+        output_filename,
+        data,
+        compress_level=None,
+        compress_strategy=None,
+        output_format=None
+    ):
+        """
+        Encrypt and save the data inside the image.
+        :param input_filename: Input image file path, encoded image bytes,
+        binary file object, PIL image, pixel array or decoded carrier
+        (carriers.Carrier)
+        :param output_filename: Output image file path or binary file object
+        :param data: Information to be encrypted and saved
+        :param compress_level: PNG compression level, 0 (none, fastest) to
+        9 (smallest). PIL's default (6) if not informed.
+        :param compress_strategy: zlib strategy for the PNG compression
+        ('default', 'filtered', 'huffman', 'rle' or 'fixed')
+        :param output_format: Lossless output format ('png', 'webp', 'tiff'
+        or 'bmp'). From the output file extension if not informed, PNG for
+        file objects.
+        :return: The format, bytes written and encode time
+        (formats.SaveReport)
+        """
+        # Check the output settings before doing any work
+        formats.resolve(output_format, output_filename, compress_level, compress_strategy)
+        hide_stats = stats.Stats(stats.HIDE)
+        secret = self._hide_image(input_filename, data, hide_stats)
+        # Save the image file
+        report = self._save(
+            secret,
+            output_filename,
+            hide_stats,
+            output_format,
+            compress_level,
+            compress_strategy
+        )
+        self._report(hide_stats)
+        return report
+
+    def hide_image(self, input_filename, data):
+        """
+        Encrypt and hide the data inside the image, without saving it.
+        :param input_filename: Input image file path, encoded image bytes,
+        binary file object, PIL image, pixel array or decoded carrier
+        (carriers.Carrier)
+        :param data: Information to be encrypted and saved
+        :return: The output PIL image
+        """
+        hide_stats = stats.Stats(stats.HIDE)
+        secret = self._hide_image(input_filename, data, hide_stats)
+        self._report(hide_stats)
+        return secret
+
+    def hide_bytes(
+        self,
+        input_filename,
+        data,
+        compress_level=None,
+        compress_strategy=None,
+        output_format=None
+    ):
+        """
+        Encrypt and hide the data inside the image, in memory.
+        :param input_filename: Input image file path, encoded image bytes,
+        binary file object, PIL image, pixel array or decoded carrier
+        (carriers.Carrier)
+        :param data: Information to be encrypted and saved
+        :param compress_level: PNG compression level (see hide)
+        :param compress_strategy: zlib strategy for the PNG compression
+        (see hide)
+        :param output_format: Lossless output format, PNG by default
+        (see hide)
+        :return: The encoded output image
+        """
+        output = io.BytesIO()
+        self.hide(input_filename, output, data, compress_level, compress_strategy, output_format)
+        return output.getvalue()
+
+    def retrieve(self, input_image_file):
+        """
+        Retrieve the encrypted data from the image.
+        :param input_image_file: Input image file path, encoded image bytes,
+        binary file object, PIL image, pixel array or decoded carrier
+        (carriers.Carrier)
+        :return:
+        """
+        output = io.BytesIO()
+        if self.retrieve_stream(input_image_file, output) is None:
+            return None
+        decrypted_data = output.getvalue()
+
+        try:
+            return decrypted_data.decode('utf-8')
+        except UnicodeDecodeError:
+            # Binary data - returns as it is
+            return decrypted_data
+
+    def capacity(self, input_filename):
+        """
+        Number of bytes of data that can be hidden in the image with the
+        current engine and settings (container format and encryption
+        overhead included). With compression, it is the size that fits even
+        if the data does not compress (codecs grow such data a little).
+        Only the image header is read, the pixels are not decoded.
+        :param input_filename: Input image (any source accepted by hide)
+        :return: Usable payload size in bytes
+        """
+        return max(self._capacity(input_filename), 0)
+
+    def fits(self, input_filename, size):
+        """
+        Check if data of the informed size can be hidden in the image.
+        Only the image header is read, the pixels are not decoded.
+        :param input_filename: Input image (any source accepted by hide)
+        :param size: Data size in bytes
+        :return: True if it fits
+        """
+        return size <= self._capacity(input_filename)
+
+    def _capacity(self, input_filename):
+        """
+        Largest data size that can be hidden in the image, -1 if even empty
+        data does not fit.
+        :param input_filename: Input image (any source accepted by hide)
+        :return: Size in bytes
+        """
+        with lsb_engine.open_image(carriers.source(input_filename)) as image:
+            channels = lsb_engine.image_capacity(image)
+
+        if self.engine == 'stegano':
+            # "<length>:" prefix and one byte per base64 character
+            chars = channels // 8
+            chars -= len(str(chars)) + 1
+            cypher_size = chars // 4 * 3 - AES.block_size
+            return cypher_size // self.block_size * self.block_size - 1
+
+        capacity = self._container_capacity(channels)
+        if self.compression:
+            return compression_codecs.max_size(capacity, self.compression)
+        return capacity
+
+    def _container_capacity(self, channels):
+        """
+        Largest data size that fits in a binary container (see _capacity).
+        :param channels: Number of channels that can carry data
+        :return: Size in bytes
+        """
+        return (
+            container.body_capacity(channels, self.bits_per_channel, self.scatter)
+            - self._prefix_size(container.VERSION)
+            - TAG_SIZE
+        )
+
+    def hide_stream(
+        self,
+        input_filename,
+        output_filename,
+        fileobj,
+        chunk_size=CHUNK_SIZE,
+        compress_level=None,
+        compress_strategy=None,
+        output_format=None
+    ):
+        """
+        Encrypt and save the content of a binary file object inside the image,
+        one chunk at a time (the data is never fully loaded in memory).
+        The vectorized engine is always used.
+        :param input_filename: Input image file path, encoded image bytes,
+        binary file object, PIL image, pixel array or decoded carrier
+        (carriers.Carrier)
+        :param output_filename: Output image file path or binary file object
+        :param fileobj: Binary file object to read the data from
+        :param chunk_size: Bytes read and encrypted at a time
+        :param compress_level: PNG compression level (see hide)
+        :param compress_strategy: zlib strategy for the PNG compression
+        (see hide)
+        :param output_format: Lossless output format (see hide)
+        :return: Number of bytes hidden
+        """
+        # Check the output settings before doing any work
+        formats.resolve(output_format, output_filename, compress_level, compress_strategy)
+        hide_stats = stats.Stats(stats.HIDE)
+        secret, size = self._embed(input_filename, fileobj, chunk_size, hide_stats)
+        self._save(
+            secret,
+            output_filename,
+            hide_stats,
+            output_format,
+            compress_level,
+            compress_strategy
+        )
+        self._report(hide_stats)
+        return size
+
+    def hide_in_place(self, input_filename, data, output_filename=None):
+        """
+        Encrypt and hide the data in an uncompressed BMP or TIFF file
+        without decoding or encoding the image: its pixels are memory-mapped
+        and only the bytes of the ones carrying the data are changed, so the
+        I/O grows with the data size instead of the image size.
+        The vectorized engine is always used.
+        :param input_filename: Uncompressed BMP or TIFF file path, changed
+        in place unless output_filename is informed
+        :param data: Information to be encrypted and saved
+        :param output_filename: Output file path. The input file is copied
+        there first and the copy is changed.
+        :return: Number of bytes hidden
+        """
+        # If it is string convert to byte string before use it
+        if isinstance(data, str):
+            data = data.encode()
+
+        # Check the carrier before changing (or copying) any file
+        layout = mapped.file_layout(input_filename)
+        capacity = self._container_capacity(layout.width * layout.height * lsb_engine.CHANNELS)
+        if not self._fits_data(data, capacity):
+            raise ValueError(
+                'The message you want to hide is too long: {} bytes'.format(len(data))
+            )
+
+        hide_stats = stats.Stats(stats.HIDE)
+        if output_filename is not None:
+            with hide_stats.stage('copy', os.path.getsize(input_filename)):
+                shutil.copyfile(input_filename, output_filename)
+            input_filename = output_filename
+
+        with mapped.open_pixels(input_filename, writable=True) as pixels:
+            size = self._embed_pixels(pixels, io.BytesIO(data), CHUNK_SIZE, hide_stats)
+        self._report(hide_stats)
+        return size
+
+    def update(self, input_filename, data, output_filename=None):
+        """
+        Replace the data hidden in an image file (new secret, same
+        carrier). The new container is written over the old one and what is
+        left of the old one is overwritten with random bits, so only the
+        pixels carrying either of them change. The vectorized engine is
+        always used.
+        PNG files saved by update are compressed in bands of rows (see the
+        banded module): updating them again only decodes and compresses the
+        bands holding the old and new containers. Other images are decoded
+        and saved whole.
+        Raise ValueError if the image holds no container, or one the
+        password does not open (nothing is changed then).
+        :param input_filename: Image file path holding a binary container
+        :param data: Information to be encrypted and saved
+        :param output_filename: Output file path (lossless format from its
+        extension, PNG files are saved banded). The input file is replaced
+        if not informed.
+        :return: Number of bytes hidden
+        """
+        # If it is string convert to byte string before use it
+        if isinstance(data, str):
+            data = data.encode()
+        if output_filename is None:
+            output_filename = input_filename
+        output_format = formats.get_format(output=output_filename)
+
+        hide_stats = stats.Stats(stats.HIDE)
+        layout = banded.read_layout(input_filename)
+        if layout is not None and output_format.name == 'png':
+            size = self._update_bands(input_filename, layout, data, output_filename, hide_stats)
+        else:
+            with lsb_engine.open_image(input_filename) as image:
+                with hide_stats.stage('decode', pixels=image.width * image.height):
+                    pixels = lsb_engine.to_array(image, writable=True)
+            header = self._updated_header(pixels)
+            rows = self._update_rows(pixels, header, len(data))
+            size = self._replace(pixels, header, data, rows, hide_stats)
+            # Often the input file itself: never left half written
+            with formats.replacing(output_filename) as temporary_file:
+                if output_format.name == 'png':
+                    with hide_stats.stage('encode', pixels=pixels.shape[0] * pixels.shape[1]):
+                        banded.write(pixels, temporary_file)
+                else:
+                    self._save(lsb_engine.to_image(pixels), temporary_file, hide_stats)
+        self._report(hide_stats)
+        return size
+
+    def _update_bands(self, input_filename, layout, data, output_filename, hide_stats):
+        """
+        Replace the data hidden in a banded PNG file, only decoding and
+        compressing again the bands holding the containers (see update).
+        :param input_filename: Banded PNG file path
+        :param layout: Layout of the file (banded.BandedPng)
+        :param data: Data bytes
+        :param output_filename: Output PNG file path
+        :param hide_stats: Stats of the call
+        :return: Number of bytes hidden
+        """
+        # The bands not decoded stay zero (and are never written)
+        pixels = layout.empty_pixels()
+        loaded = layout.bands_for(-(-container.HEADER_PIXELS // layout.width))
+        with hide_stats.stage('decode', pixels=layout.rows(loaded) * layout.width):
+            banded.read_bands(input_filename, layout, pixels, 0, loaded)
+        header = self._updated_header(pixels)
+        rows = self._update_rows(pixels, header, len(data))
+        bands = layout.bands_for(rows)
+        decoded = layout.rows(bands) - layout.rows(loaded)
+        with hide_stats.stage('decode', pixels=decoded * layout.width):
+            banded.read_bands(input_filename, layout, pixels, loaded, bands)
+
+        size = self._replace(pixels, header, data, rows, hide_stats)
+        with hide_stats.stage('encode', pixels=layout.rows(bands) * layout.width):
+            banded.rewrite(input_filename, layout, pixels, bands, output_filename)
+        return size
+
+    @staticmethod
+    def _updated_header(pixels):
+        """
+        Header of the container to replace.
+        :param pixels: Pixel array
+        :return: The header (container.Header)
+        """
+        header = container.read_header(pixels)
+        if header is None:
+            raise ValueError('No hidden data to update')
+        return header
+
+    def _update_rows(self, pixels, header, size):
+        """
+        Number of rows the old and new containers can be in.
+        :param pixels: Pixel array
+        :param header: Header of the old container
+        :param size: Size of the new data
+        :return: Number of rows from the top of the image
+        """
+        height, width = pixels.shape[:2]
+        if header.scattered or self.scatter:
+            return height
+        if self.compression:
+            size = compression_codecs.bound(size, self.compression)
+        length = self._prefix_size(container.VERSION) + size + TAG_SIZE
+        used = max(self._pixels(header.length, header.depth), self._pixels(length))
+        return min(-(-used // width), height)
+
+    def _replace(self, pixels, header, data, rows, hide_stats):
+        """
+        Overwrite the old container with random bits and hide the data.
+        :param pixels: Pixel array (changed in place)
+        :param header: Header of the old container
+        :param data: Data bytes
+        :param rows: Rows holding the containers (see _update_rows)
+        :param hide_stats: Stats of the call
+        :return: Number of bytes hidden
+        """
+        before = pixels[:rows].copy()
+        order = self._order(pixels, hide_stats) if header.scattered else None
+        # Erasing with another password would miss (or destroy) the secret
+        self._check_key(pixels, header, order, hide_stats)
+        with hide_stats.stage('erase', header.length):
+            container.write_body(pixels, os.urandom(header.length), 0, header.depth, order=order)
+        size = self._embed_pixels(pixels, io.BytesIO(data), CHUNK_SIZE, hide_stats)
+        hide_stats.set('pixels changed', int((pixels[:rows] != before).any(axis=-1).sum()))
+        return size
+
+    def _check_key(self, pixels, header, order, call_stats):
+        """
+        Check that the password opens a container (the key check value, or
+        the CBC padding of the older versions).
+        Raise ValueError if it does not.
+        :param pixels: Pixel array
+        :param header: Container header
+        :param order: Pixel order of a scattered body (None otherwise)
+        :param call_stats: Stats of the call
+        """
+        position = self._prefix_size(header.version)
+        with call_stats.stage('extract', header.length):
+            prefix = container.read_body(pixels, header, 0, position, order=order)
+            if header.version == 3:
+                cypher_data = b''
+            else:
+                cypher_data = container.read_body(pixels, header, position, order=order)
+        decryption_suite = self._decryptor(prefix, header.version, call_stats)
+        if header.version != 3:
+            if not cypher_data or len(cypher_data) % AES.block_size:
+                raise ValueError('Invalid container length')
+            with call_stats.stage('decrypt', len(cypher_data)):
+                try:
+                    unpad(decryption_suite.decrypt(cypher_data), AES.block_size)
+                except ValueError:
+                    raise ValueError('Invalid key') from None
+
+    def _hide_shard(self, input_filename, output_filename, fileobj):
+        """
+        Encrypt and save a shard of a secret (see the shards module), flagged
+        as such in the container header.
+        :param input_filename: Input image source (see hide_stream)
+        :param output_filename: Output image file path (lossless format from
+        its extension)
+        :param fileobj: Binary file object to read the shard from
+        :return: Number of bytes hidden
+        """
+        formats.resolve(output=output_filename)
+        hide_stats = stats.Stats(stats.HIDE)
+        secret, size = self._embed(
+            input_filename,
+            fileobj,
+            CHUNK_SIZE,
+            hide_stats,
+            container.SHARD
+        )
+        self._save(secret, output_filename, hide_stats)
+        self._report(hide_stats)
+        return size
+
+    def retrieve_stream(self, input_image_file, fileobj, chunk_size=CHUNK_SIZE):
+        """
+        Retrieve the encrypted data from the image and write it to a binary
+        file object, one chunk at a time.
+        A wrong key is detected before writing anything. Data tampered with
+        is only detected at the end (legacy formats: wrong keys too), in
+        that case the file object holds partial data and None is returned.
+        :param input_image_file: Input image file path, encoded image bytes,
+        binary file object, PIL image, pixel array or decoded carrier
+        (carriers.Carrier)
+        :param fileobj: Binary file object to write the data to
+        :param chunk_size: Bytes extracted and decrypted at a time
+        :return: Number of bytes written or None
+        """
+        return self._retrieve_stream(input_image_file, fileobj, chunk_size)
+
+    def _retrieve_stream(self, input_image_file, fileobj, chunk_size, shard=False):
+        """
+        Retrieve the data from the image to a binary file object (see
+        retrieve_stream).
+        :param input_image_file: Input image source (see retrieve_stream)
+        :param fileobj: Binary file object to write the data to
+        :param chunk_size: Bytes extracted and decrypted at a time
+        :param shard: Retrieve a shard of a secret (see the shards module)
+        instead of a whole secret
+        :return: Number of bytes written or None
+        """
+        retrieve_stats = stats.Stats(stats.RETRIEVE)
+        try:
+            with lsb_engine.open_image(carriers.source(input_image_file)) as image:
+                with retrieve_stats.stage('header', container.HEADER.size):
+                    header = container.read_header(image)
+                if header and header.shard == shard:
+                    return self._decrypt_stream(
+                        image,
+                        header,
+                        fileobj,
+                        chunk_size,
+                        retrieve_stats
+                    )
+                if header or shard:
+                    # A shard where a whole secret is expected, or the opposite
+                    return None
+
+                # Image saved before the binary container format
+                with retrieve_stats.stage('extract'):
+                    cypher_data = self._reveal(image)
+                with retrieve_stats.stage('decrypt', len(cypher_data or '')):
+                    decrypted_data = self._decrypt_legacy(cypher_data)
+        except (UnidentifiedImageError, FileNotFoundError, ValueError, IndexError):
+            return None
+        finally:
+            self._report(retrieve_stats)
+
+        if decrypted_data is None:
+            return None
+
+        fileobj.write(decrypted_data)
+        return len(decrypted_data)
+
+    async def ahide(self, input_filename, output_filename, data, **options):
+        """
+        Coroutine version of hide. The work (image decoding, key derivation,
+        embedding and encoding) runs on the executor, so the event loop is
+        not blocked.
+        With a process pool the arguments are pickled: use file paths,
+        bytes, PIL images or arrays, not open file objects.
+        :param input_filename: Input image (see hide)
+        :param output_filename: Output image file path or binary file object
+        :param data: Information to be encrypted and saved
+        :param options: Output options (see hide)
+        :return: The format, bytes written and encode time
+        """
+        return await self._run(self.hide, input_filename, output_filename, data, **options)
+
+    async def ahide_bytes(self, input_filename, data, **options):
+        """
+        Coroutine version of hide_bytes (see ahide).
+        :param input_filename: Input image (see hide)
+        :param data: Information to be encrypted and saved
+        :param options: Output options (see hide)
+        :return: The encoded output image
+        """
+        return await self._run(self.hide_bytes, input_filename, data, **options)
+
+    async def aretrieve(self, input_image_file):
+        """
+        Coroutine version of retrieve (see ahide).
+        :param input_image_file: Input image (see retrieve)
+        :return:
+        """
+        return await self._run(self.retrieve, input_image_file)
+
+    async def _run(self, method, *args, **kwargs):
+        """
+        Run a method on the executor, once there are less than
+        max_concurrency calls running in the event loop.
+        :param method: Method to run
+        :return: The method result
+        """
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+
+        async with semaphore:
+            return await loop.run_in_executor(
+                self.executor,
+                functools.partial(method, *args, **kwargs)
+            )
+
+    def _hide_image(self, input_filename, data, hide_stats):
+        """
+        Encrypt and hide the data inside the image.
+        :param input_filename: Input image source (see hide_image)
+        :param data: Information to be encrypted and saved
+        :param hide_stats: Stats of the call
+        :return: The output PIL image
+        """
+        # If it is string convert to byte string before use it
+        if isinstance(data, str):
+            data = data.encode()
+
+        if self.engine == 'stegano':
+            from stegano import lsb
+
+            # stegano only hides text, use the legacy base64 format.
+            # It closes the image it gets, give it a copy.
+            with hide_stats.stage('encrypt', len(data)):
+                cypher_data = self._encrypt_legacy(data)
+            with lsb_engine.open_image(carriers.source(input_filename)) as image:
+                # stegano decodes the image too
+                pixels = image.width * image.height
+                with hide_stats.stage('embed', len(cypher_data), pixels):
+                    return lsb.hide(image.copy(), cypher_data)
+
+        secret, _ = self._embed(input_filename, io.BytesIO(data), CHUNK_SIZE, hide_stats)
+        return secret
+
+    def _embed(self, input_filename, fileobj, chunk_size, hide_stats, flags=0):
+        """
+        Encrypt the content of a binary file object and hide it in a binary
+        container, one chunk at a time.
+        :param input_filename: Input image source (see hide_image)
+        :param fileobj: Binary file object to read the data from
+        :param chunk_size: Bytes read and encrypted at a time
+        :param hide_stats: Stats of the call
+        :param flags: Extra container header flags
+        :return: The output PIL image and the number of bytes hidden
+        """
+        if self.carrier_cache and isinstance(input_filename, (str, os.PathLike)):
+            with hide_stats.stage('load'):
+                input_filename = carriers.load(input_filename)
+
+        if isinstance(input_filename, carriers.Carrier):
+            # Decoded already, only copied
+            with hide_stats.stage('copy', pixels=input_filename.width * input_filename.height):
+                pixels = input_filename.copy()
+        else:
+            with lsb_engine.open_image(input_filename) as image:
+                with hide_stats.stage('decode', pixels=image.width * image.height):
+                    pixels = lsb_engine.to_array(image, writable=True)
+
+        size = self._embed_pixels(pixels, fileobj, chunk_size, hide_stats, flags)
+        return lsb_engine.to_image(pixels), size
+
+    def _embed_pixels(self, pixels, fileobj, chunk_size, hide_stats, flags=0):
+        """
+        Encrypt the content of a binary file object and hide it in a binary
+        container in the pixel array (changed in place).
+        :param pixels: Pixel array (see engine.to_array)
+        :param fileobj: Binary file object to read the data from
+        :param chunk_size: Bytes read and encrypted at a time
+        :param hide_stats: Stats of the call
+        :param flags: Extra container header flags
+        :return: Number of bytes hidden
+        """
+        depth = self.bits_per_channel
+        order = self._order(pixels, hide_stats) if self.scatter else None
+        chunk = fileobj.read(chunk_size)
+        codec = compression_codecs.select(self.compression, chunk)
+        prefix, encryption_suite = self._encryptor(hide_stats)
+        with hide_stats.stage('embed', len(prefix)):
+            container.write_body(pixels, prefix, depth=depth, order=order)
+        position = len(prefix)
+        size = 0
+
+        for plain_size, chunk in self._chunks(fileobj, chunk, chunk_size, codec, hide_stats):
+            size += plain_size
+            if not chunk:
+                continue
+            with hide_stats.stage('encrypt', len(chunk)):
+                cypher_data = encryption_suite.encrypt(chunk)
+            with hide_stats.stage('embed', len(chunk)):
+                container.write_body(pixels, cypher_data, position, depth, self.workers, order)
+            position += len(chunk)
+
+        with hide_stats.stage('encrypt'):
+            tag = encryption_suite.digest()
+        # The length is only known now, write the header last
+        length = position + TAG_SIZE
+        with hide_stats.stage('embed', TAG_SIZE + container.HEADER.size, self._pixels(length)):
+            container.write_body(pixels, tag, position, depth, order=order)
+            container.write_header(
+                pixels,
+                length,
+                flags=self._flags | container.codec_flags(codec) | flags
+            )
+
+        if codec:
+            hide_stats.set('compression ratio', (position - len(prefix)) / size if size else 1)
+            hide_stats.set(
+                'pixels saved',
+                self._pixels(len(prefix) + size + TAG_SIZE) - self._pixels(length)
+            )
+        return size
+
+    def _chunks(self, fileobj, chunk, chunk_size, codec, hide_stats):
+        """
+        Read the data to encrypt from a binary file object, compressed with
+        the codec (if any).
+        :param fileobj: Binary file object to read the data from
+        :param chunk: First chunk, already read
+        :param chunk_size: Bytes read at a time
+        :param codec: Compression codec (see the compression module)
+        :param hide_stats: Stats of the call
+        :return: Iterator of the size read and the data to encrypt (empty
+        when the compressor keeps it for the next chunks)
+        """
+        compressor = compression_codecs.compressor(codec) if codec else None
+        while chunk:
+            if compressor is None:
+                yield len(chunk), chunk
+            else:
+                with hide_stats.stage('compress', len(chunk)):
+                    data = compressor.compress(chunk)
+                yield len(chunk), data
+            chunk = fileobj.read(chunk_size)
+
+        if compressor is not None:
+            with hide_stats.stage('compress'):
+                data = compressor.flush()
+            yield 0, data
+
+    def _fits_data(self, data, capacity):
+        """
+        Check if the data fits in the capacity as it will be embedded:
+        compressed with the instance settings, which can make it larger.
+        :param data: Data bytes
+        :param capacity: Capacity in bytes (see _container_capacity)
+        :return: True if it fits
+        """
+        if not self.compression:
+            return len(data) <= capacity
+        if compression_codecs.bound(len(data), self.compression) <= capacity:
+            return True
+        codec = compression_codecs.select(self.compression, data)
+        if not codec:
+            return len(data) <= capacity
+        compressor = compression_codecs.compressor(codec)
+        return len(compressor.compress(data)) + len(compressor.flush()) <= capacity
+
+    def _order(self, pixels, call_stats):
+        """
+        Pixel order of a scattered body in the image (cached).
+        :param pixels: Pixel array
+        :param call_stats: Stats of the call
+        :return: The order (see the permutation module)
+        """
+        size = container.order_size(lsb_engine.capacity(pixels))
+        with call_stats.stage('order', pixels=size):
+            return permutation.pixel_order(self._order_seed, size)
+
+    def _pixels(self, length, depth=None):
+        """
+        Number of pixels holding a binary container.
+        :param length: Container body length
+        :param depth: Bits per channel of the body (the instance one if not
+        informed)
+        :return: Number of pixels
+        """
+        depth = depth or self.bits_per_channel
+        channels = container.HEADER_BITS + -(-length * 8 // depth)
+        return -(-channels // lsb_engine.CHANNELS)
+
+    def _save(self, secret, output_filename, hide_stats, *options):
+        """
+        Save the output image.
+        :param secret: Output PIL image
+        :param output_filename: Output image file path or binary file object
+        :param hide_stats: Stats of the call
+        :param options: Output format and compression options (see hide)
+        :return: The format, bytes written and encode time
+        """
+        report = formats.save(secret, output_filename, *options)
+        pixels = secret.width * secret.height
+        hide_stats.add('encode', report.seconds, report.bytes_written, pixels)
+        return report
+
+    def _report(self, call_stats):
+        """
+        Hand the stats of a call to the on_stats callback (if any).
+        :param call_stats: Stats of the call
+        """
+        if self.on_stats:
+            self.on_stats(call_stats)
+
+    def _encryptor(self, hide_stats):
+        """
+        Create the encryption suite for a binary container body.
+        :param hide_stats: Stats of the call
+        :return: The body prefix (key derivation parameters, salt, key check
+        value and nonce) and the AES-GCM encryption suite
+        """
+        with hide_stats.stage('kdf'):
+            key = kdf.derive_key(self._password, self.salt, self.kdf_params)
+        # Generate a random nonce
+        nonce = Random.new().read(NONCE_SIZE)
+        associated_data = kdf.pack(self.kdf_params, self.salt) + kdf.key_check(key)
+        encryption_suite = AES.new(key, AES.MODE_GCM, nonce, mac_len=TAG_SIZE)
+        encryption_suite.update(associated_data)
+        return associated_data + nonce, encryption_suite
+
+    def _decryptor(self, prefix, version, retrieve_stats):
+        """
+        Create the decryption suite for a binary container body.
+        Raise ValueError if the key check value does not match.
+        :param prefix: Start of the container body (_prefix_size bytes)
+        :param version: Container version
+        :param retrieve_stats: Stats of the call
+        :return: The decryption suite (AES-GCM or AES-CBC)
+        """
+        if version == 1:
+            return AES.new(self.key, AES.MODE_CBC, prefix)
+
+        params, salt = kdf.unpack(prefix)
+        with retrieve_stats.stage('kdf'):
+            key = kdf.derive_key(self._password, salt, params)
+        if version == 2:
+            return AES.new(key, AES.MODE_CBC, prefix[kdf.HEADER.size:])
+
+        associated_data = prefix[:-NONCE_SIZE]
+        if associated_data[kdf.HEADER.size:] != kdf.key_check(key):
+            raise ValueError('Invalid key')
+        decryption_suite = AES.new(key, AES.MODE_GCM, prefix[-NONCE_SIZE:], mac_len=TAG_SIZE)
+        decryption_suite.update(associated_data)
+        return decryption_suite
+
+    @staticmethod
+    def _prefix_size(version):
+        """
+        Size of the data preceding the cypher data in a container body.
+        :param version: Container version
+        :return: Size in bytes
+        """
+        if version == 1:
+            return AES.block_size
+        if version == 2:
+            return kdf.HEADER.size + AES.block_size
+        return kdf.HEADER.size + kdf.KEY_CHECK_SIZE + NONCE_SIZE
+
+    def _decrypt_stream(self, image, header, fileobj, chunk_size, retrieve_stats):
+        """
+        Decrypt the body of a binary container to a file object.
+        Raise ValueError if the key is wrong or the data was tampered with.
+        :param image: Opened input image
+        :param header: Container header
+        :param fileobj: Binary file object to write the data to
+        :param chunk_size: Bytes extracted and decrypted at a time
+        :param retrieve_stats: Stats of the call
+        :return: Number of bytes written
+        """
+        position = self._prefix_size(header.version)
+        if header.version == 3:
+            # GCM: no padding, the authentication tag closes the body
+            end = header.length - TAG_SIZE
+            if end < position:
+                raise ValueError('Invalid container length')
+        else:
+            end = header.length
+            if end <= position or (end - position) % AES.block_size:
+                raise ValueError('Invalid container length')
+            # Decrypt whole CBC blocks only
+            chunk_size = max(chunk_size - chunk_size % AES.block_size, AES.block_size)
+
+        order = None
+        if header.scattered:
+            # The body can be anywhere, decode the whole image once
+            with retrieve_stats.stage('decode', pixels=image.width * image.height):
+                image = lsb_engine.to_array(image)
+            order = self._order(image, retrieve_stats)
+
+        # Only the prefix is read before checking the key
+        with retrieve_stats.stage('extract', position, self._pixels(header.length, header.depth)):
+            prefix = container.read_body(image, header, 0, position, order=order)
+        decryption_suite = self._decryptor(prefix, header.version, retrieve_stats)
+        decompressor = compression_codecs.Decompressor(header.codec)
+        size = 0
+        pending = b''
+
+        def write(data):
+            if header.codec:
+                with retrieve_stats.stage('decompress', len(data)):
+                    data = decompressor.decompress(data)
+            fileobj.write(data)
+            return len(data)
+
+        while position < end:
+            length = min(chunk_size, end - position)
+            with retrieve_stats.stage('extract', length):
+                cypher_data = container.read_body(
+                    image,
+                    header,
+                    position,
+                    length,
+                    self.workers,
+                    order
+                )
+            with retrieve_stats.stage('decrypt', length):
+                data = pending + decryption_suite.decrypt(cypher_data)
+            position += length
+            if header.version != 3:
+                # Keep the last CBC block, it holds the padding
+                pending = data[-AES.block_size:]
+                data = data[:-AES.block_size]
+            size += write(data)
+
+        if header.version == 3:
+            with retrieve_stats.stage('extract', TAG_SIZE):
+                tag = container.read_body(image, header, end, TAG_SIZE, order=order)
+            with retrieve_stats.stage('decrypt'):
+                decryption_suite.verify(tag)
+        else:
+            with retrieve_stats.stage('decrypt'):
+                data = unpad(pending, AES.block_size)
+            size += write(data)
+
+        decompressor.finish()
+        return size
+
+    def _encrypt_legacy(self, data):
+        """
+        Encrypt the data in the legacy base64 format.
+        :param data: Byte string to encrypt
+        :return: The base64 encoded cypher data
+        """
+        # Generate a random initialization vector
+        iv = Random.new().read(AES.block_size)
+        encryption_suite = AES.new(self.key, AES.MODE_CBC, iv)
+
+        # Encrypt the random initialization vector concatenated
+        # with the padded data
+        cypher_data = encryption_suite.encrypt(iv + pad(data, self.block_size))
+
+        # Convert the cypher byte string to a base64 string to avoid
+        # decode padding error
+        return base64.b64encode(cypher_data).decode()
+
+    def _decrypt_legacy(self, cypher_data):
+        """
+        Decrypt data saved in the legacy base64 format.
+        :param cypher_data: The base64 encoded cypher data
+        :return: The decrypted byte string or None
+        """
+        if not cypher_data:
+            return None
+
+        cypher_data = base64.b64decode(cypher_data)
+        # Retrieve the dynamic initialization vector saved
+        iv = cypher_data[:AES.block_size]
+        # Retrieved the cypher data
+        cypher_data = cypher_data[AES.block_size:]
+
+        decryption_suite = AES.new(self.key, AES.MODE_CBC, iv)
+        return unpad(
+            decryption_suite.decrypt(cypher_data),
+            self.block_size
+        )
+
+    def _reveal(self, image):
+        """
+        Read the legacy message hidden in the image with the selected engine.
+        :param image: Opened input image
+        :return: The hidden message or None
+        """
+        if self.engine == 'stegano':
+            from stegano import lsb
+
+            # Check the length prefix first, stegano would scan the whole
+            # image before failing when there is no message
+            if lsb_engine.legacy_length(image) is None:
+                return None
+            # It closes the image it gets, give it a copy
+            return lsb.reveal(image.copy())
+        return lsb_engine.reveal_legacy(image)
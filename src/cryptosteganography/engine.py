@@ -0,0 +1,444 @@
+"""
+Vectorized LSB (Least Significant Bit) embedding engine.
+
+The carrier pixels are handled as a NumPy array and the bitstream is written
+to (or read from) the colour channels with whole-array bit operations, instead
+of walking the image one pixel at a time.
+
+Bits are laid out like stegano's LSB module does it: pixels in row-major
+order, one bit per R, G and B channel, the alpha channel untouched. To store
+more data per pixel, up to 4 bits (most significant first) can be written
+per channel.
+
+The data can also be written to the pixels in a given order (a permutation
+of the pixel indexes), only the visited pixels are gathered and scattered
+back.
+
+Large writes and reads can be split in row bands processed by a thread pool
+(NumPy releases the GIL in the bit operations). Each band gets its own slice
+of the bitstream, computed from its channel range, so the result is the same
+as the serial path.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import io
+import os
+from typing import Callable, IO, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image, ImageFile
+
+from cryptosteganography import banded, mapped
+
+__author__ = 'computationalcore@gmail.com'
+
+# Number of colour channels per pixel that carry data
+CHANNELS = 3
+# Maximum number of bits stored per channel
+MAX_DEPTH = 4
+# Smallest number of channels worth splitting in row bands
+PARALLEL_MIN_CHANNELS = 1 << 20
+
+# Everything an image can be read from: a file path, encoded image bytes, a
+# binary file object, a PIL image or a pixel array
+ImageSource = Union[str, os.PathLike, bytes, bytearray, memoryview, IO[bytes], Image.Image,
+                    np.ndarray]
+
+
+@contextlib.contextmanager
+def open_image(source: ImageSource) -> Iterator[Image.Image]:
+    """
+    Open an image from any ImageSource, without copying it to a file.
+    Images opened here are closed on exit, PIL images given by the caller
+    are left open.
+    """
+    if isinstance(source, Image.Image):
+        yield source
+        return
+    if isinstance(source, np.ndarray):
+        yield Image.fromarray(source)
+        return
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    with Image.open(source) as image:
+        yield image
+
+
+def to_array(image: Image.Image, writable: bool = False) -> np.ndarray:
+    """
+    Return the pixels of an image as an (height, width, channels) uint8 array.
+
+    Images that are not RGB or RGBA are converted to RGB first.
+    """
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGB')
+    if writable:
+        return np.array(image)
+    return np.asarray(image)
+
+
+def to_image(pixels: np.ndarray) -> Image.Image:
+    """Build a PIL image from a pixel array."""
+    return Image.fromarray(pixels)
+
+
+def capacity(pixels: np.ndarray) -> int:
+    """Return the number of channels that can carry data."""
+    height, width = pixels.shape[:2]
+    return height * width * CHANNELS
+
+
+def _span(pixels: np.ndarray, start: int, stop: int) -> Tuple[np.ndarray, np.ndarray, int]:
+    """
+    Return the rows holding the channels [start, stop), their colour
+    channels as a flat array and the position of start inside that array.
+
+    The flat array is a view whenever the pixel layout allows it, otherwise
+    a copy that has to be written back to the rows.
+    """
+    row_size = pixels.shape[1] * CHANNELS
+    first_row = start // row_size
+    last_row = -(-stop // row_size)
+    rows = pixels[first_row:last_row]
+    flat = rows[..., :CHANNELS].reshape(-1)
+    return rows, flat, start - first_row * row_size
+
+
+def _check_depth(depth: int) -> None:
+    """Raise ValueError if the number of bits per channel is not supported."""
+    if not 1 <= depth <= MAX_DEPTH:
+        raise ValueError('Invalid bits per channel: {}'.format(depth))
+
+
+def embed_bits(pixels: np.ndarray, bits: np.ndarray, offset: int = 0, depth: int = 1) -> None:
+    """
+    Write a bit array (one 0/1 value per item) into the depth lowest bits of
+    the pixel channels, starting at the channel offset. The last channel is
+    padded with zeros. The pixels are changed in place.
+    """
+    _check_depth(depth)
+    count = -(-len(bits) // depth)
+    stop = offset + count
+    if stop > capacity(pixels):
+        raise ValueError(
+            'The message you want to hide is too long: {} bits'.format(len(bits))
+        )
+    if not count:
+        return
+
+    if depth == 1:
+        values = bits
+    else:
+        # Group the bits by channel, packbits fills each group up to a byte
+        bits = np.pad(bits, (0, count * depth - len(bits)))
+        values = np.packbits(bits.reshape(count, depth), axis=1).ravel() >> (8 - depth)
+
+    rows, flat, begin = _span(pixels, offset, stop)
+    segment = flat[begin:begin + count]
+    segment &= 0xFF ^ ((1 << depth) - 1)
+    segment |= values
+    if not np.shares_memory(flat, rows):
+        rows[..., :CHANNELS] = flat.reshape(rows.shape[:2] + (CHANNELS,))
+
+
+def extract_bits(pixels: np.ndarray, count: int, offset: int = 0, depth: int = 1) -> np.ndarray:
+    """
+    Read count bits from the depth lowest bits of the pixel channels,
+    starting at the channel offset.
+    """
+    _check_depth(depth)
+    channels = -(-count // depth)
+    stop = offset + channels
+    if stop > capacity(pixels):
+        raise ValueError('Not enough pixels to read {} bits'.format(count))
+
+    _, flat, begin = _span(pixels, offset, stop)
+    values = flat[begin:begin + channels] & np.uint8((1 << depth) - 1)
+    if depth == 1:
+        return values
+    return np.unpackbits(values[:, np.newaxis], axis=1)[:, 8 - depth:].ravel()[:count]
+
+
+def bands(pixels: np.ndarray, start: int, stop: int, workers: int = 1) -> List[Tuple[int, int]]:
+    """
+    Split the channels [start, stop) in up to workers ranges that start on a
+    row boundary, so no two ranges share a row.
+    """
+    if workers <= 1 or stop - start < PARALLEL_MIN_CHANNELS:
+        return [(start, stop)]
+
+    row_size = pixels.shape[1] * CHANNELS
+    first_row = start // row_size
+    rows = -(-stop // row_size) - first_row
+    count = min(workers, rows)
+    bounds = [start]
+    bounds += [(first_row + rows * band // count) * row_size for band in range(1, count)]
+    bounds.append(stop)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _map(function: Callable[[int, int], None], ranges: List[Tuple[int, int]]) -> None:
+    """Call the function for each channel range, in a thread pool if more than one."""
+    if len(ranges) == 1:
+        function(*ranges[0])
+        return
+
+    with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+        # Consume the results to raise the exceptions
+        list(executor.map(lambda channels: function(*channels), ranges))
+
+
+def _stream_bits(prefix: np.ndarray, data: bytes, first: int, last: int) -> np.ndarray:
+    """Return the bits [first, last) of the prefix bits followed by the data bits."""
+    parts = []
+    if first < len(prefix):
+        parts.append(prefix[first:last])
+
+    first = max(first - len(prefix), 0)
+    last -= len(prefix)
+    if last > first:
+        # Only unpack the bytes holding the requested bits
+        first_byte = first // 8
+        last_byte = -(-last // 8)
+        data_bits = np.unpackbits(
+            np.frombuffer(data, dtype=np.uint8, count=last_byte - first_byte, offset=first_byte)
+        )
+        parts.append(data_bits[first - first_byte * 8:last - first_byte * 8])
+
+    if len(parts) == 1:
+        return parts[0]
+    return np.concatenate(parts) if parts else np.empty(0, dtype=np.uint8)
+
+
+def embed(
+    pixels: np.ndarray,
+    data: bytes,
+    offset: int = 0,
+    depth: int = 1,
+    position: int = 0,
+    workers: int = 1
+) -> None:
+    """
+    Write the bytes into the pixels, in a bitstream of depth bits per channel
+    starting at the channel offset. position is the bit position of the data
+    inside that bitstream. Large writes are split in up to workers row bands.
+    """
+    _check_depth(depth)
+    channel, skip = divmod(position, depth)
+    start = offset + channel
+    count = skip + len(data) * 8
+    stop = start + -(-count // depth)
+    if stop > capacity(pixels):
+        raise ValueError('The message you want to hide is too long: {} bits'.format(count))
+
+    # Keep the bits already written in the first channel
+    prefix = extract_bits(pixels, skip, start, depth)
+
+    def write(first: int, last: int) -> None:
+        end = min((last - start) * depth, count)
+        bits = _stream_bits(prefix, data, (first - start) * depth, end)
+        embed_bits(pixels, bits, first, depth)
+
+    _map(write, bands(pixels, start, stop, workers))
+
+
+def extract(
+    pixels: np.ndarray,
+    length: int,
+    offset: int = 0,
+    depth: int = 1,
+    position: int = 0,
+    workers: int = 1
+) -> bytes:
+    """
+    Read length bytes from the pixels, in a bitstream of depth bits per
+    channel starting at the channel offset, from the bit position. Large
+    reads are split in up to workers row bands.
+    """
+    _check_depth(depth)
+    channel, skip = divmod(position, depth)
+    start = offset + channel
+    count = skip + length * 8
+    stop = start + -(-count // depth)
+    if stop > capacity(pixels):
+        raise ValueError('Not enough pixels to read {} bits'.format(count))
+
+    bits = np.empty(count, dtype=np.uint8)
+
+    def read(first: int, last: int) -> None:
+        begin = (first - start) * depth
+        end = min((last - start) * depth, count)
+        bits[begin:end] = extract_bits(pixels, end - begin, first, depth)
+
+    _map(read, bands(pixels, start, stop, workers))
+    return np.packbits(bits[skip:]).tobytes()
+
+
+def _ordered_span(
+    pixels: np.ndarray,
+    order: np.ndarray,
+    start: int,
+    first: int,
+    last: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return the row and column indexes of the pixels [first, last) of the
+    order. The order numbers the pixels from the start pixel on.
+    """
+    indexes = order[first:last].astype(np.int64) + start
+    return np.divmod(indexes, pixels.shape[1])
+
+
+def _ordered_range(
+    length: int,
+    depth: int,
+    position: int
+) -> Tuple[int, int, int, int]:
+    """
+    Return the first and last pixel of the order holding length bytes at the
+    bit position, the channel offset and the bit position inside the first.
+    """
+    channel, skip = divmod(position, depth)
+    stop = channel + -(-(skip + length * 8) // depth)
+    first = channel // CHANNELS
+    return first, -(-stop // CHANNELS), channel - first * CHANNELS, skip
+
+
+def embed_ordered(
+    pixels: np.ndarray,
+    data: bytes,
+    order: np.ndarray,
+    start: int = 0,
+    depth: int = 1,
+    position: int = 0
+) -> None:
+    """
+    Write the bytes into the pixels visited in the informed order (see
+    _ordered_span), in a bitstream of depth bits per channel. position is
+    the bit position of the data inside that bitstream. Only the pixels
+    holding the data are read and written back.
+    """
+    first, last, offset, skip = _ordered_range(len(data), depth, position)
+    if last > len(order):
+        raise ValueError(
+            'The message you want to hide is too long: {} bits'.format(skip + len(data) * 8)
+        )
+
+    rows, columns = _ordered_span(pixels, order, start, first, last)
+    # The visited pixels as a one row image
+    visited = pixels[rows, columns][np.newaxis]
+    embed(visited, data, offset, depth, skip)
+    pixels[rows, columns] = visited[0]
+
+
+def extract_ordered(
+    pixels: np.ndarray,
+    length: int,
+    order: np.ndarray,
+    start: int = 0,
+    depth: int = 1,
+    position: int = 0
+) -> bytes:
+    """Read length bytes from the pixels visited in the order (see embed_ordered)."""
+    first, last, offset, skip = _ordered_range(length, depth, position)
+    if last > len(order):
+        raise ValueError('Not enough pixels to read {} bytes'.format(length))
+
+    rows, columns = _ordered_span(pixels, order, start, first, last)
+    return extract(pixels[rows, columns][np.newaxis], length, offset, depth, skip)
+
+
+def image_capacity(image: Image.Image) -> int:
+    """Return the number of channels of the image that can carry data."""
+    return image.width * image.height * CHANNELS
+
+
+def read_rows(image: Image.Image, first: int, last: int) -> np.ndarray:
+    """Return the rows [first, last) of the image as a pixel array."""
+    return to_array(image.crop((0, first, image.width, last)))
+
+
+def head_pixels(image: Image.Image, count: int) -> np.ndarray:
+    """
+    Return a pixel array starting with the first count pixels of the image.
+
+    read_rows decodes the whole image (PIL crops loaded images), so image
+    files not loaded yet are read without decoding them when their format
+    allows it: 8-bit RGB(A) PNG files are only inflated up to those pixels,
+    uncompressed BMP and TIFF files are memory-mapped. Other images (WebP,
+    other PNG modes, compressed TIFF...) are decoded whole by read_rows.
+    """
+    rows = -(-count // image.width)
+    if isinstance(image, ImageFile.ImageFile) and image.im is None:
+        if image.format == 'PNG' and image.fp is not None:
+            position = image.fp.tell()
+            image.fp.seek(0)
+            try:
+                pixels = banded.first_pixels(image.fp, count)
+            finally:
+                image.fp.seek(position)
+            if pixels is not None:
+                return pixels
+        if image.filename and mapped.layout(image) is not None:
+            with mapped.open_pixels(image.filename) as mapped_pixels:
+                return np.array(mapped_pixels[:rows])
+    return read_rows(image, 0, rows)
+
+
+def extract_from_image(
+    image: Image.Image,
+    length: int,
+    offset: int = 0,
+    depth: int = 1,
+    position: int = 0,
+    workers: int = 1
+) -> bytes:
+    """
+    Read length bytes from the image (see extract for the arguments).
+    Only the rows holding the requested bits are converted to an array.
+    """
+    _check_depth(depth)
+    start = offset + position // depth
+    stop = offset + -(-(position + length * 8) // depth)
+    if stop > image_capacity(image):
+        raise ValueError('Not enough pixels to read {} bytes'.format(length))
+
+    row_size = image.width * CHANNELS
+    first_row = start // row_size
+    pixels = read_rows(image, first_row, -(-stop // row_size))
+    return extract(pixels, length, offset - first_row * row_size, depth, position, workers)
+
+
+def legacy_length(image: Image.Image) -> Optional[Tuple[int, int]]:
+    """
+    Parse the "<length>:" prefix of stegano's LSB format.
+    Return the message length and the channel offset where the message
+    starts, or None if the image does not hold a message that fits in it.
+    """
+    max_chars = image_capacity(image) // 8
+    # The length prefix can't have more digits than the capacity has
+    length = min(len(str(max_chars)) + 1, max_chars)
+    prefix = extract(head_pixels(image, -(-length * 8 // CHANNELS)), length)
+    separator = prefix.find(b':')
+    if separator < 1 or not prefix[:separator].isdigit():
+        return None
+
+    length = int(prefix[:separator])
+    start = (separator + 1) * 8
+    if start + length * 8 > image_capacity(image):
+        return None
+
+    return length, start
+
+
+def reveal_legacy(image: Image.Image) -> Optional[str]:
+    """
+    Find a message hidden with stegano's LSB format.
+    Return None if the image does not hold one.
+    """
+    prefix = legacy_length(image)
+    if prefix is None:
+        return None
+
+    length, start = prefix
+    return extract_from_image(image, length, start).decode('latin-1')
@@ -0,0 +1,142 @@
+"""
+Reed-Solomon erasure coding over GF(2^8), vectorized with NumPy.
+
+k data shards of the same size are extended with m parity shards, and any k
+of the n = k + m shards give the data shards back. The code is systematic
+(the data shards are kept as they are), the parity rows of the generator
+matrix form a Cauchy matrix, so every k rows of it can be inverted.
+
+A whole shard is multiplied by a coefficient with one lookup per byte in
+that coefficient's row of the multiplication table, and the products are
+added up with XOR, so coding runs at memory speed instead of byte by byte.
+"""
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+__author__ = 'computationalcore@gmail.com'
+
+# x^8 + x^4 + x^3 + x^2 + 1, the usual Reed-Solomon field polynomial
+POLYNOMIAL = 0x11d
+# Largest number of shards (data and parity) of one code
+MAX_SHARDS = 256
+
+
+def _tables() -> np.ndarray:
+    """Return the multiplication table of the field."""
+    exp = np.zeros(512, dtype=np.int64)
+    log = np.zeros(256, dtype=np.int64)
+    value = 1
+    for power in range(255):
+        exp[power] = value
+        log[value] = power
+        value <<= 1
+        if value & 0x100:
+            value ^= POLYNOMIAL
+    # No modulo needed when adding two logarithms
+    exp[255:510] = exp[:255]
+
+    table = exp[log[:, np.newaxis] + log[np.newaxis, :]].astype(np.uint8)
+    table[0, :] = 0
+    table[:, 0] = 0
+    return table
+
+
+MUL = _tables()
+# Multiplicative inverses (0 has none, left at 0)
+INVERSES = np.argmax(MUL == 1, axis=1).astype(np.uint8)
+
+
+def inverse(value: int) -> int:
+    """Return the multiplicative inverse of a non zero field element."""
+    if not value:
+        raise ValueError('0 has no inverse')
+    return int(INVERSES[value])
+
+
+def cauchy_matrix(data_shards: int, parity_shards: int) -> np.ndarray:
+    """Return the (parity_shards, data_shards) parity rows of the generator."""
+    if data_shards < 1 or parity_shards < 0 or data_shards + parity_shards > MAX_SHARDS:
+        raise ValueError('Invalid number of shards: {} + {}'.format(data_shards, parity_shards))
+    rows = np.arange(data_shards, data_shards + parity_shards)[:, np.newaxis]
+    columns = np.arange(data_shards)[np.newaxis, :]
+    # Row and column indexes differ, so no XOR is 0
+    return INVERSES[rows ^ columns]
+
+
+def generator(data_shards: int, parity_shards: int) -> np.ndarray:
+    """Return the (data_shards + parity_shards, data_shards) generator matrix."""
+    return np.vstack([
+        np.identity(data_shards, dtype=np.uint8),
+        cauchy_matrix(data_shards, parity_shards)
+    ])
+
+
+def combine(matrix: np.ndarray, shards: np.ndarray) -> np.ndarray:
+    """Return the field product of the matrix and the shards (one per row)."""
+    result = np.zeros((matrix.shape[0], shards.shape[1]), dtype=np.uint8)
+    for row, coefficients in zip(result, matrix):
+        for coefficient, shard in zip(coefficients, shards):
+            if coefficient:
+                row ^= MUL[coefficient].take(shard)
+    return result
+
+
+def _invert(matrix: np.ndarray) -> np.ndarray:
+    """Invert a square matrix over the field (Gauss-Jordan elimination)."""
+    size = len(matrix)
+    work = np.hstack([matrix, np.identity(size, dtype=np.uint8)])
+    for column in range(size):
+        pivots = np.nonzero(work[column:, column])[0]
+        if not len(pivots):
+            raise ValueError('Singular matrix')
+        pivot = column + pivots[0]
+        work[[column, pivot]] = work[[pivot, column]]
+        work[column] = MUL[inverse(work[column, column])].take(work[column])
+        for row in range(size):
+            if row != column and work[row, column]:
+                work[row] ^= MUL[work[row, column]].take(work[column])
+    return work[:, size:]
+
+
+def encode(data: np.ndarray, parity_shards: int) -> np.ndarray:
+    """
+    Return the parity shards of the data shards (a (data_shards, size)
+    uint8 array), as a (parity_shards, size) array.
+    """
+    return combine(cauchy_matrix(len(data), parity_shards), data)
+
+
+def decoder(indexes: Sequence[int], data_shards: int, parity_shards: int) -> np.ndarray:
+    """
+    Return the (data_shards, data_shards) matrix giving the data shards back
+    from the shards of the indexes (data_shards of them, in order): combine
+    its rows with those shards. It only depends on the indexes, so large
+    shards can be decoded a block at a time with the same matrix.
+    """
+    return _invert(generator(data_shards, parity_shards)[list(indexes)])
+
+
+def decode(
+    shards: Dict[int, np.ndarray],
+    data_shards: int,
+    parity_shards: int
+) -> List[np.ndarray]:
+    """
+    Return the data shards from any data_shards of the shards, given by
+    index (data shards first, then parity shards), all of the same size.
+    Raise ValueError if there are not enough of them.
+    """
+    if len(shards) < data_shards:
+        raise ValueError('{} shards needed, {} available'.format(data_shards, len(shards)))
+
+    # Prefer the data shards, they need no decoding
+    indexes = sorted(shards)[:data_shards]
+    missing = [index for index in range(data_shards) if index not in shards]
+    if not missing:
+        return [shards[index] for index in range(data_shards)]
+
+    matrix = decoder(indexes, data_shards, parity_shards)
+    recovered = combine(matrix[missing], np.array([shards[index] for index in indexes]))
+    found = dict(zip(missing, recovered))
+    return [shards[index] if index in shards else found[index] for index in range(data_shards)]
@@ -0,0 +1,234 @@
+"""
+Lossless output formats for the images holding a secret.
+
+LSB data only survives lossless encoders, so the output format is picked
+from a registry that only holds lossless ones (PNG, lossless WebP, TIFF and
+BMP). It is chosen by name or by the output file extension; lossy or unknown
+formats are rejected before anything is written.
+
+PNG is the most compact, uncompressed TIFF and BMP are the fastest to write
+(and read), lossless WebP sits in between.
+"""
+import contextlib
+import os
+import secrets
+import shutil
+import time
+from typing import Any, Dict, IO, Iterator, NamedTuple, Optional, Tuple, TYPE_CHECKING, Union
+import zlib
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+__author__ = 'computationalcore@gmail.com'
+
+# zlib strategies for the PNG output
+PNG_STRATEGIES = {
+    'default': zlib.Z_DEFAULT_STRATEGY,
+    'filtered': zlib.Z_FILTERED,
+    'huffman': zlib.Z_HUFFMAN_ONLY,
+    'rle': zlib.Z_RLE,
+    'fixed': zlib.Z_FIXED,
+}
+
+DEFAULT_FORMAT = 'png'
+
+Output = Union[str, os.PathLike, IO[bytes]]
+
+
+class OutputFormat(NamedTuple):
+    """A lossless output format."""
+    name: str
+    # PIL format name
+    pil_format: str
+    # File extensions, the first one is used for new file names
+    extensions: Tuple[str, ...]
+    # PIL save options that keep the encoder lossless
+    options: Dict[str, Any] = {}
+    # PIL feature the encoder depends on (if any)
+    feature: Optional[str] = None
+
+
+class SaveReport(NamedTuple):
+    """Outcome of saving an output image."""
+    format: str
+    bytes_written: int
+    seconds: float
+
+
+FORMATS: Dict[str, OutputFormat] = {}
+
+
+def register(output_format: OutputFormat) -> None:
+    """
+    Add an output format to the registry. Only register encoders that are
+    lossless with the informed options.
+    """
+    FORMATS[output_format.name] = output_format
+
+
+register(OutputFormat('png', 'PNG', ('.png',)))
+# exact: keep the colour of transparent pixels, they can hold data too
+register(OutputFormat('webp', 'WEBP', ('.webp',), {'lossless': True, 'exact': True}, 'webp'))
+register(OutputFormat('tiff', 'TIFF', ('.tiff', '.tif'), {'compression': 'raw'}))
+register(OutputFormat('bmp', 'BMP', ('.bmp',)))
+
+
+def available() -> Tuple[str, ...]:
+    """Return the names of the formats supported by the installed PIL."""
+    from PIL import features
+
+    return tuple(
+        name for name, output_format in FORMATS.items()
+        if not output_format.feature or features.check(output_format.feature)
+    )
+
+
+def from_extension(file_path: Union[str, os.PathLike]) -> Optional[OutputFormat]:
+    """Return the output format of a file name extension (if any)."""
+    extension = os.path.splitext(os.fspath(file_path))[1].lower()
+    for output_format in FORMATS.values():
+        if extension in output_format.extensions:
+            return output_format
+    return None
+
+
+def get_format(name: Optional[str] = None, output: Optional[Output] = None) -> OutputFormat:
+    """
+    Return the output format by name, else by the extension of the output
+    file path (PNG for file objects or when nothing is informed).
+    Raise ValueError if it is not a supported lossless format.
+    """
+    if name is not None:
+        output_format = FORMATS.get(name.lower())
+        if output_format is None:
+            raise ValueError('Unsupported output format: {}'.format(name))
+    elif isinstance(output, (str, os.PathLike)):
+        found = from_extension(output)
+        if found is None:
+            raise ValueError(
+                'Unsupported output file {}, use a lossless format ({})'.format(
+                    os.fspath(output), ', '.join(FORMATS)
+                )
+            )
+        output_format = found
+    else:
+        output_format = FORMATS[DEFAULT_FORMAT]
+
+    if output_format.name not in available():
+        raise ValueError('Output format not supported by PIL: {}'.format(output_format.name))
+    return output_format
+
+
+def filename(file_path: str, name: Optional[str] = None) -> str:
+    """
+    Return the file path with an extension of the output format (PNG if
+    not informed), appending one when it has another extension.
+    """
+    output_format = get_format(name)
+    if name is None and from_extension(file_path):
+        return file_path
+    if os.path.splitext(file_path)[1].lower() in output_format.extensions:
+        return file_path
+    return file_path + output_format.extensions[0]
+
+
+def png_options(
+    compress_level: Optional[int] = None,
+    compress_strategy: Optional[str] = None
+) -> Dict[str, int]:
+    """
+    Return the PIL save options for the PNG compression level (0, no
+    compression, to 9) and zlib strategy (a PNG_STRATEGIES name).
+    The options left as None keep PIL's defaults.
+    Raise ValueError if they are not valid.
+    """
+    options = {}
+    if compress_level is not None:
+        if not 0 <= compress_level <= 9:
+            raise ValueError('Invalid compression level: {}'.format(compress_level))
+        options['compress_level'] = compress_level
+    if compress_strategy is not None:
+        if compress_strategy not in PNG_STRATEGIES:
+            raise ValueError('Invalid compression strategy: {}'.format(compress_strategy))
+        options['compress_type'] = PNG_STRATEGIES[compress_strategy]
+    return options
+
+
+def resolve(
+    name: Optional[str] = None,
+    output: Optional[Output] = None,
+    compress_level: Optional[int] = None,
+    compress_strategy: Optional[str] = None
+) -> Tuple[OutputFormat, Dict[str, Any]]:
+    """
+    Return the output format (see get_format) and its PIL save options.
+    The compression options only apply to PNG.
+    Raise ValueError if the format or the options are not supported.
+    """
+    output_format = get_format(name, output)
+    options = dict(output_format.options)
+    if output_format.name == 'png':
+        options.update(png_options(compress_level, compress_strategy))
+    elif compress_level is not None or compress_strategy is not None:
+        raise ValueError('Compression options only apply to the PNG format')
+    return output_format, options
+
+
+def _timed_save(
+    image: 'Image.Image',
+    output: Output,
+    output_format: OutputFormat,
+    options: Dict[str, Any]
+) -> float:
+    """Save the image and return the time it took."""
+    start = time.perf_counter()
+    image.save(output, format=output_format.pil_format, **options)
+    return time.perf_counter() - start
+
+
+def save(
+    image: 'Image.Image',
+    output: Output,
+    name: Optional[str] = None,
+    compress_level: Optional[int] = None,
+    compress_strategy: Optional[str] = None
+) -> SaveReport:
+    """
+    Save an image to a file path or a binary file object in a lossless
+    format (see resolve) and report the bytes written and encode time.
+    """
+    output_format, options = resolve(name, output, compress_level, compress_strategy)
+    if isinstance(output, (str, os.PathLike)):
+        seconds = _timed_save(image, output, output_format, options)
+        bytes_written = os.path.getsize(output)
+    else:
+        start_position = output.tell()
+        seconds = _timed_save(image, output, output_format, options)
+        bytes_written = output.tell() - start_position
+
+    return SaveReport(output_format.name, bytes_written, seconds)
+
+
+@contextlib.contextmanager
+def replacing(file_path: Union[str, os.PathLike]) -> Iterator[str]:
+    """
+    Yield a temporary file path next to the file (same extension) to write
+    it to. The temporary file replaces the file when the block exits, or is
+    removed if the block fails, so the file is never left half written. An
+    existing file keeps its permissions.
+    """
+    directory, name = os.path.split(os.path.abspath(file_path))
+    root, extension = os.path.splitext(name)
+    temporary_file = os.path.join(
+        directory,
+        '.{}.{}{}'.format(root, secrets.token_hex(8), extension)
+    )
+    try:
+        yield temporary_file
+        if os.path.exists(file_path):
+            shutil.copymode(file_path, temporary_file)
+        os.replace(temporary_file, file_path)
+    finally:
+        if os.path.exists(temporary_file):
+            os.remove(temporary_file)
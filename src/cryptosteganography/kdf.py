@@ -0,0 +1,155 @@
+"""
+Key derivation from the password.
+
+Keys are derived with a salted and tunable KDF (scrypt by default, or
+PBKDF2-HMAC-SHA256). The salt and the parameters are saved in the container,
+next to the cipher data::
+
+    +-----------+------+------------+-----------------+------+
+    | algorithm | cost | block size | parallelization | salt |
+    +-----------+------+------------+-----------------+------+
+      1           4      1            1                 16
+
+For scrypt the cost is N (CPU/memory cost), for PBKDF2 the number of
+iterations (block size and parallelization are not used and saved as 0).
+
+Derived keys are kept in a bounded per-process LRU cache, so batch jobs that
+use one password over many images only pay the derivation cost once per salt.
+"""
+import functools
+import struct
+from typing import Any, cast, NamedTuple, Tuple
+
+from Cryptodome.Hash import HMAC, SHA256
+from Cryptodome.Protocol.KDF import PBKDF2, scrypt
+from Cryptodome.Random import get_random_bytes
+
+__author__ = 'computationalcore@gmail.com'
+
+SCRYPT = 1
+PBKDF2_SHA256 = 2
+
+KEY_SIZE = 32
+SALT_SIZE = 16
+KEY_CHECK_SIZE = 4
+# Derived keys kept in the cache
+CACHE_SIZE = 128
+
+# Big-endian: algorithm, cost, block size, parallelization, salt
+HEADER = struct.Struct('>BIBB{}s'.format(SALT_SIZE))
+
+# Upper bounds accepted when reading the parameters from an image, so a
+# crafted header can't make the derivation take forever
+MAX_SCRYPT_COST = 2 ** 20
+MAX_SCRYPT_BLOCK_SIZE = 32
+MAX_SCRYPT_PARALLELIZATION = 16
+# scrypt needs 128 * N * r bytes of memory: at most 256 MiB
+MAX_SCRYPT_MEMORY = 256 * 1024 * 1024
+# and runs in time proportional to N * r * p: at most 32 times the default
+# (a couple of seconds)
+MAX_SCRYPT_WORK = 2 ** 22
+MAX_PBKDF2_ITERATIONS = 2_000_000
+
+
+class KDFParams(NamedTuple):
+    """Key derivation function and its tuning parameters."""
+    algorithm: int = SCRYPT
+    cost: int = 2 ** 14
+    block_size: int = 8
+    parallelization: int = 1
+
+
+DEFAULT_PARAMS = KDFParams()
+
+
+def pbkdf2_params(iterations: int = 600_000) -> KDFParams:
+    """Return the parameters for PBKDF2-HMAC-SHA256."""
+    return KDFParams(PBKDF2_SHA256, iterations, 0, 0)
+
+
+def validate(params: KDFParams) -> None:
+    """Raise ValueError if the parameters are not supported."""
+    if params.algorithm == SCRYPT:
+        valid = (
+            2 <= params.cost <= MAX_SCRYPT_COST
+            and params.cost & (params.cost - 1) == 0
+            and 1 <= params.block_size <= MAX_SCRYPT_BLOCK_SIZE
+            and 1 <= params.parallelization <= MAX_SCRYPT_PARALLELIZATION
+            and 128 * params.cost * params.block_size <= MAX_SCRYPT_MEMORY
+            and params.cost * params.block_size * params.parallelization <= MAX_SCRYPT_WORK
+        )
+    elif params.algorithm == PBKDF2_SHA256:
+        valid = 1 <= params.cost <= MAX_PBKDF2_ITERATIONS
+    else:
+        valid = False
+
+    if not valid:
+        raise ValueError('Invalid key derivation parameters: {}'.format(params))
+
+
+def new_salt() -> bytes:
+    """Return a random salt."""
+    return get_random_bytes(SALT_SIZE)
+
+
+def pack(params: KDFParams, salt: bytes) -> bytes:
+    """Return the bytes saving the parameters and the salt."""
+    return HEADER.pack(*params, salt)
+
+
+def unpack(data: bytes) -> Tuple[KDFParams, bytes]:
+    """
+    Parse the parameters and the salt saved at the start of the data.
+    Raise ValueError if they are missing or not supported.
+    """
+    if len(data) < HEADER.size:
+        raise ValueError('Missing key derivation parameters')
+
+    algorithm, cost, block_size, parallelization, salt = HEADER.unpack_from(data)
+    params = KDFParams(algorithm, cost, block_size, parallelization)
+    validate(params)
+    return params, salt
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def derive_key(password: str, salt: bytes, params: KDFParams = DEFAULT_PARAMS) -> bytes:
+    """Derive the encryption key from the password (cached)."""
+    validate(params)
+    # UTF-8 encoded here, pycryptodome would encode str passwords as latin-1
+    # (its type hints only mention str, hence the Any)
+    secret: Any = password.encode()
+    if params.algorithm == SCRYPT:
+        key = scrypt(
+            secret,
+            cast(Any, salt),
+            KEY_SIZE,
+            N=params.cost,
+            r=params.block_size,
+            p=params.parallelization
+        )
+        return cast(bytes, key)
+    return PBKDF2(
+        secret,
+        salt,
+        KEY_SIZE,
+        count=params.cost,
+        hmac_hash_module=SHA256
+    )
+
+
+def key_check(key: bytes) -> bytes:
+    """
+    Return a short value computed from the key, saved next to the cipher data
+    so a wrong password is detected before decrypting anything.
+    """
+    return HMAC.new(key, b'cryptosteganography key check', SHA256).digest()[:KEY_CHECK_SIZE]
+
+
+def cache_info():
+    """Return the key cache statistics (hits, misses, maxsize, currsize)."""
+    return derive_key.cache_info()
+
+
+def cache_clear() -> None:
+    """Remove every derived key from the cache."""
+    derive_key.cache_clear()
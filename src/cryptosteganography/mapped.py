@@ -0,0 +1,125 @@
+"""
+Memory-mapped pixels of uncompressed image files.
+
+Uncompressed BMP and TIFF files store the pixels as raw bytes at a known
+position, so they can be mapped with numpy.memmap and changed in place: only
+the pages holding the pixels that are read or written go through the I/O,
+whatever the size of the image.
+
+The mapped array is a view with the same layout engine.to_array gives for the
+colour channels (rows top to bottom, then R, G and B), whatever the order the
+file stores them in. Alpha and padding bytes are left out of it.
+"""
+import contextlib
+import os
+from typing import Iterator, NamedTuple, Optional, Union
+
+import numpy as np
+from PIL import Image, ImageFile
+
+__author__ = 'computationalcore@gmail.com'
+
+FORMATS = ('BMP', 'TIFF')
+
+# Raw pixel layouts that can be mapped: bytes per pixel and the R, G and B
+# channels inside a pixel
+RAW_MODES = {
+    'RGB': (3, slice(0, 3)),
+    'RGBA': (4, slice(0, 3)),
+    'RGBX': (4, slice(0, 3)),
+    'BGR': (3, slice(2, None, -1)),
+    'BGRA': (4, slice(2, None, -1)),
+    'BGRX': (4, slice(2, None, -1)),
+}
+
+
+class Layout(NamedTuple):
+    """Position and layout of the raw pixels in an image file."""
+    offset: int
+    width: int
+    height: int
+    # Bytes per row, padding included
+    stride: int
+    pixel_size: int
+    channels: slice
+    # Rows stored from the bottom of the image up
+    bottom_up: bool
+
+
+def layout(image: ImageFile.ImageFile) -> Optional[Layout]:
+    """
+    Return the layout of the pixels of an image file just opened (before
+    its pixels are loaded), or None if they are not stored as raw RGB bytes
+    in one contiguous block.
+    """
+    if image.format not in FORMATS or image.mode not in ('RGB', 'RGBA') or not image.tile:
+        return None
+
+    codec, extents, offset, args = image.tile[0]
+    if isinstance(args, str):
+        args = (args, 0, 1)
+    rawmode, stride, orientation = (tuple(args) + (0, 1))[:3]
+    if codec != 'raw' or rawmode not in RAW_MODES:
+        return None
+
+    pixel_size, channels = RAW_MODES[rawmode]
+    stride = stride or image.width * pixel_size
+    # TIFF strips are mapped as one block only when they follow each other
+    for tile in image.tile[1:]:
+        if (
+            tile[0] != codec
+            or tile[3] != image.tile[0][3]
+            or orientation != 1
+            or tile[1][0] != 0
+            or tile[1][2] != image.width
+            or tile[2] != offset + tile[1][1] * stride
+        ):
+            return None
+    if extents[:3] != (0, 0, image.width) or image.tile[-1][1][3] != image.height:
+        return None
+
+    return Layout(offset, image.width, image.height, stride, pixel_size, channels, orientation < 0)
+
+
+def file_layout(file_path: Union[str, os.PathLike]) -> Layout:
+    """
+    Return the layout of the pixels of an image file.
+    Raise ValueError if it is not an uncompressed RGB(A) BMP or TIFF file.
+    """
+    with Image.open(file_path) as image:
+        found = layout(image)
+    if found is None:
+        raise ValueError(
+            'Not an uncompressed BMP or TIFF image: {}'.format(os.fspath(file_path))
+        )
+    return found
+
+
+@contextlib.contextmanager
+def open_pixels(
+    file_path: Union[str, os.PathLike],
+    writable: bool = False
+) -> Iterator[np.ndarray]:
+    """
+    Map the pixels of an uncompressed BMP or TIFF file as a (height, width,
+    3) uint8 array. When writable, the changes made to the array go to the
+    file, flushed on exit.
+    Raise ValueError if the file can't be mapped (see file_layout).
+    """
+    found = file_layout(file_path)
+    raw = np.memmap(
+        file_path,
+        dtype=np.uint8,
+        mode='r+' if writable else 'r',
+        offset=found.offset,
+        shape=(found.height, found.stride)
+    )
+    row_size = found.width * found.pixel_size
+    pixels = raw[:, :row_size].reshape(found.height, found.width, found.pixel_size)
+    pixels = pixels[..., found.channels]
+    if found.bottom_up:
+        pixels = pixels[::-1]
+
+    yield pixels
+    if writable:
+        raw.flush()
@@ -0,0 +1,125 @@
+"""
+Key-seeded pixel order for scattered container bodies.
+
+By default the body is written from the top-left pixel on, right after the
+header, so the changed pixels sit in the first rows of the image. A scattered
+body visits the pixels in a pseudo-random order seeded by the password
+instead, spreading the changes over the whole image.
+
+The order sorts the pixels by the values of a PCG64 raw stream seeded with a
+hash of the password. NumPy keeps its bit generators' raw streams stable
+across versions, so images stay readable after upgrades.
+
+Generating the order of tens of millions of pixels takes seconds, so orders
+are kept in a bounded per-process LRU cache (one entry per seed and number of
+pixels) and, when a directory is set with set_cache_dir, saved there as .npy
+files that later runs memory-map instead of generating them again. The
+files are derived from the password: keep the directory private.
+"""
+import functools
+import hashlib
+import os
+import tempfile
+from typing import Optional, Union
+
+from Cryptodome.Hash import HMAC, SHA256
+import numpy as np
+
+__author__ = 'computationalcore@gmail.com'
+
+# Orders kept in the cache (4 bytes per pixel each)
+CACHE_SIZE = 4
+
+_cache_dir: Optional[str] = None
+
+
+def seed(password: str) -> bytes:
+    """Return the seed of the pixel order of a password."""
+    return HMAC.new(password.encode(), b'cryptosteganography pixel order', SHA256).digest()
+
+
+def set_cache_dir(directory: Optional[Union[str, os.PathLike]]) -> None:
+    """
+    Save the generated orders as .npy files in the directory (created if
+    needed) and load them from there. None turns the disk cache off.
+    """
+    global _cache_dir
+    if directory is not None:
+        directory = os.path.expanduser(os.fspath(directory))
+        os.makedirs(directory, exist_ok=True)
+    _cache_dir = directory
+    pixel_order.cache_clear()
+
+
+def generate(order_seed: bytes, pixels: int) -> np.ndarray:
+    """Return a pixel order: the numbers from 0 to pixels - 1, shuffled."""
+    keys = np.random.PCG64(int.from_bytes(order_seed, 'big')).random_raw(pixels)
+    # Random high bits, the pixel index in the low bits: the keys are unique,
+    # so sorting them gives the same order with any algorithm, and the index
+    # comes back without an argsort
+    bits = np.uint64(max(pixels - 1, 1).bit_length())
+    keys >>= bits
+    keys <<= bits
+    keys |= np.arange(pixels, dtype=np.uint64)
+    keys.sort()
+    keys &= (np.uint64(1) << bits) - np.uint64(1)
+    return keys.astype(np.uint32 if pixels <= 1 << 32 else np.uint64)
+
+
+def _cache_file(order_seed: bytes, pixels: int) -> Optional[str]:
+    """Return the file of an order in the disk cache (if enabled)."""
+    if _cache_dir is None:
+        return None
+    # Not named after the seed itself
+    name = hashlib.sha256(order_seed + pixels.to_bytes(8, 'big')).hexdigest()
+    return os.path.join(_cache_dir, name + '.npy')
+
+
+def _load(file_path: str, pixels: int) -> Optional[np.ndarray]:
+    """Memory-map an order saved in the disk cache, None if missing or invalid."""
+    try:
+        order = np.load(file_path, mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+    if order.shape != (pixels,) or order.dtype.kind != 'u':
+        return None
+    return order
+
+
+def _save(file_path: str, order: np.ndarray) -> None:
+    """Save an order in the disk cache (atomically, concurrent runs may race)."""
+    descriptor, temporary_file = tempfile.mkstemp(dir=os.path.dirname(file_path), suffix='.npy')
+    try:
+        with os.fdopen(descriptor, 'wb') as f:
+            np.save(f, order)
+        os.replace(temporary_file, file_path)
+    except OSError:
+        if os.path.exists(temporary_file):
+            os.remove(temporary_file)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def pixel_order(order_seed: bytes, pixels: int) -> np.ndarray:
+    """Return the pixel order of a seed (see generate), cached."""
+    file_path = _cache_file(order_seed, pixels)
+    if file_path:
+        order = _load(file_path, pixels)
+        if order is not None:
+            return order
+
+    order = generate(order_seed, pixels)
+    if file_path:
+        _save(file_path, order)
+    # Shared by every caller
+    order.flags.writeable = False
+    return order
+
+
+def cache_info():
+    """Return the in-memory cache statistics (hits, misses, maxsize, currsize)."""
+    return pixel_order.cache_info()
+
+
+def cache_clear() -> None:
+    """Remove every order from the in-memory cache (the disk cache is kept)."""
+    pixel_order.cache_clear()
@@ -0,0 +1,160 @@
+"""
+Find the images holding a secret, without the password.
+
+Every secret starts with a container header (see the container module)
+stored in the lowest bit of the first 80 channels: scanning an image only
+needs its first 27 pixels, read with as little decoding as the format
+allows (see engine.head_pixels):
+
+- 8-bit RGB(A) PNG: the IDAT stream is inflated until the bytes of those
+  pixels are out, and only they are unfiltered,
+- uncompressed BMP and TIFF: the pixels are memory-mapped, only the first
+  rows' pages are read,
+- other lossless formats (WebP...): decoded by PIL,
+- lossy formats (JPEG...) can't carry LSB data: reported without a hit,
+  nothing decoded.
+
+Images saved in the legacy stegano format have no header and are not found.
+
+Directories are walked for the files with a lossless format extension, the
+files are scanned in a process pool, a bounded number of chunks of them at
+a time.
+"""
+import collections
+import itertools
+import os
+import time
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from PIL import Image
+
+from cryptosteganography import compression, container, formats
+
+__author__ = 'computationalcore@gmail.com'
+
+# PIL formats that can hold LSB data
+LOSSLESS_FORMATS = tuple(output_format.pil_format for output_format in formats.FORMATS.values())
+# Files looked for in directories
+EXTENSIONS = tuple(
+    extension
+    for output_format in formats.FORMATS.values()
+    for extension in output_format.extensions
+)
+# Files handed to a worker process at a time
+CHUNK_SIZE = 64
+# Chunks waiting for (or in) a worker process, per worker
+PENDING_CHUNKS = 2
+
+
+class ScanResult(NamedTuple):
+    """Outcome of scanning one image."""
+    image_file: str
+    # PIL format name
+    format: Optional[str] = None
+    header: Optional[container.Header] = None
+    error: Optional[str] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return the result as plain data (JSON friendly)."""
+        result: Dict[str, Any] = {'file': self.image_file, 'format': self.format}
+        if self.header:
+            codec_names = {codec: name for name, codec in compression.CODECS.items()}
+            result.update(
+                version=self.header.version,
+                length=self.header.length,
+                bits_per_channel=self.header.depth,
+                scattered=self.header.scattered,
+                compression=codec_names.get(self.header.codec),
+                shard=self.header.shard
+            )
+        if self.error:
+            result['error'] = self.error
+        return result
+
+
+class ScanSummary(NamedTuple):
+    """Outcome of a whole scan."""
+    images: int
+    hits: int
+    failed: int
+    seconds: float
+
+    @property
+    def images_per_second(self) -> float:
+        return self.images / self.seconds if self.seconds else 0.0
+
+
+def find_images(paths: Iterable[str]) -> Iterator[str]:
+    """
+    Return the image files of the paths: files as they are, directories
+    walked (sorted) for the files with a lossless format extension.
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for directory, directories, files in os.walk(path):
+            directories.sort()
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in EXTENSIONS:
+                    yield os.path.join(directory, name)
+
+
+def scan_file(image_file: str) -> ScanResult:
+    """Scan one image file for a container header."""
+    try:
+        with Image.open(image_file) as image:
+            image_format = image.format
+            if image_format not in LOSSLESS_FORMATS:
+                return ScanResult(image_file, image_format)
+            header = container.read_header(image)
+    except (OSError, ValueError) as error:
+        return ScanResult(image_file, error=str(error) or type(error).__name__)
+
+    return ScanResult(image_file, image_format, header)
+
+
+def _scan_files(image_files: List[str]) -> List[ScanResult]:
+    """Scan a chunk of image files, in a worker process."""
+    return [scan_file(image_file) for image_file in image_files]
+
+
+def scan(
+    paths: Iterable[str],
+    workers: Optional[int] = None,
+    on_result: Optional[Callable[[ScanResult], None]] = None
+) -> ScanSummary:
+    """
+    Scan the images of the paths (files or directories, see find_images)
+    in a process pool. on_result is called with each result, in order.
+
+    The directories are walked as the scan goes: the files are handed to
+    the pool in chunks, with at most PENDING_CHUNKS chunks per worker
+    waiting, so memory does not grow with the number of images.
+    """
+    # Loaded here, multiprocessing is slow to import
+    from concurrent.futures import Future, ProcessPoolExecutor
+
+    images = hits = failed = 0
+    start = time.perf_counter()
+    image_files = find_images(paths)
+    pending: Deque[Future] = collections.deque()
+    max_pending = PENDING_CHUNKS * (workers or os.cpu_count() or 1)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while True:
+            chunk = list(itertools.islice(image_files, CHUNK_SIZE))
+            if chunk:
+                pending.append(executor.submit(_scan_files, chunk))
+            if not pending:
+                break
+            if chunk and len(pending) < max_pending:
+                continue
+            for result in pending.popleft().result():
+                images += 1
+                hits += result.header is not None
+                failed += bool(result.error)
+                if on_result:
+                    on_result(result)
+
+    return ScanSummary(images, hits, failed, time.perf_counter() - start)
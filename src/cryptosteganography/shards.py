@@ -0,0 +1,580 @@
+"""
+Secrets split across several carrier images.
+
+A secret file larger than one image is split in shards, one per carrier, the
+shard sizes proportional to the carriers' capacities. Each shard is hidden
+like a regular secret (encrypted and authenticated on its own, flagged as a
+shard in the container header) and starts with a manifest::
+
+    +-------+--------+-------+-------+----------+--------+------+--------+
+    | magic | set id | index | count | required | offset | size | sha256 |
+    +-------+--------+-------+-------+----------+--------+------+--------+
+      4       16       4       4       4          8        8      32
+
+The set id ties the shards of one secret together, index and offset give
+their order, size and sha256 describe the whole secret and are checked once
+it is reassembled. The images can be given in any order.
+
+With parity shards (see the erasure module), the secret is split in
+required data shards of the same size, followed by count - required parity
+shards: any required images of the set give the secret back, missing or
+damaged ones (failing authentication) are rebuilt from the others.
+
+Shards are embedded and retrieved concurrently in a process pool, the
+secret is written back in order as the shards arrive.
+"""
+import hashlib
+import io
+import itertools
+import os
+import struct
+import tempfile
+import time
+from typing import (
+    Dict,
+    IO,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    TYPE_CHECKING
+)
+
+from cryptosteganography import batch, formats
+
+if TYPE_CHECKING:
+    from cryptosteganography.core import CryptoSteganography
+
+__author__ = 'computationalcore@gmail.com'
+
+MAGIC = b'CSHD'
+SET_ID_SIZE = 16
+# Big-endian: magic, set id, index, count, required, offset, secret size,
+# secret hash
+MANIFEST = struct.Struct('>4s{}sIIIQQ32s'.format(SET_ID_SIZE))
+
+# Bytes hashed at a time
+READ_SIZE = 1024 * 1024
+
+# Instance of the worker process (set once by the pool initializer)
+_crypto_steganography: Optional['CryptoSteganography'] = None
+
+
+class Manifest(NamedTuple):
+    """Manifest at the start of every shard."""
+    set_id: bytes
+    shard_index: int
+    shard_count: int
+    # Shards needed to rebuild the secret (shard_count without parity)
+    required: int
+    # Position of the shard data in the secret
+    offset: int
+    # Size and SHA-256 hash of the whole secret
+    size: int
+    sha256: bytes
+
+    def pack(self) -> bytes:
+        """Return the manifest bytes."""
+        return MANIFEST.pack(MAGIC, *self)
+
+    @classmethod
+    def unpack(cls, data: bytes) -> 'Manifest':
+        """Parse the manifest at the start of a shard, raise ValueError if invalid."""
+        if len(data) < MANIFEST.size:
+            raise ValueError('Missing shard manifest')
+        magic, *fields = MANIFEST.unpack_from(data)
+        manifest = cls(*fields)
+        if (
+            magic != MAGIC
+            or manifest.shard_index >= manifest.shard_count
+            or not 0 < manifest.required <= manifest.shard_count
+        ):
+            raise ValueError('Invalid shard manifest')
+        return manifest
+
+
+class ShardSummary(NamedTuple):
+    """Outcome of hiding or retrieving a sharded secret."""
+    shards: int
+    size: int
+    seconds: float
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.size / 1e6 / self.seconds if self.seconds else 0.0
+
+
+def plan(capacities: Sequence[int], size: int) -> List[Tuple[int, int]]:
+    """
+    Split size bytes in one (offset, size) range per carrier, proportional to
+    the carrier capacities (in bytes, manifest included).
+    Raise ValueError if they can't hold it.
+    """
+    room = [max(capacity - MANIFEST.size, 0) for capacity in capacities]
+    total = sum(room)
+    if size > total:
+        raise ValueError(
+            'The secret does not fit in the carriers: {} bytes, {} available'.format(size, total)
+        )
+
+    sizes = [size * capacity // total for capacity in room] if total else [0] * len(room)
+    # Hand the rounding leftovers to the carriers with room left
+    left = size - sum(sizes)
+    for index, capacity in enumerate(room):
+        extra = min(left, capacity - sizes[index])
+        sizes[index] += extra
+        left -= extra
+
+    ranges = []
+    offset = 0
+    for shard_size in sizes:
+        ranges.append((offset, shard_size))
+        offset += shard_size
+    return ranges
+
+
+def file_hash(file_path: str) -> bytes:
+    """Return the SHA-256 hash of a file."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_SIZE), b''):
+            digest.update(block)
+    return digest.digest()
+
+
+def _init_worker(crypto_steganography: 'CryptoSteganography') -> None:
+    """Keep the instance in the worker process."""
+    global _crypto_steganography
+    _crypto_steganography = crypto_steganography
+
+
+def _hide_shard(
+    manifest: Manifest,
+    source_file: str,
+    source_offset: int,
+    shard_size: int,
+    input_image_file: str,
+    output_image_file: str
+) -> int:
+    """Hide one shard, read from a range of the source file, in a worker process."""
+    assert _crypto_steganography is not None
+    with open(source_file, 'rb') as f:
+        f.seek(source_offset)
+        data = f.read(shard_size)
+    _crypto_steganography._hide_shard(
+        input_image_file,
+        output_image_file,
+        io.BytesIO(manifest.pack() + data)
+    )
+    return len(data)
+
+
+def _retrieve_shard(image_file: str) -> Tuple[Manifest, bytes]:
+    """Retrieve one shard, in a worker process."""
+    assert _crypto_steganography is not None
+    output = io.BytesIO()
+    if _crypto_steganography._retrieve_stream(image_file, output, READ_SIZE, shard=True) is None:
+        raise ValueError('No valid shard found in {}'.format(image_file))
+    data = output.getvalue()
+    return Manifest.unpack(data), data[MANIFEST.size:]
+
+
+class _Shard(NamedTuple):
+    """Shard to hide: its carrier, position in the secret and data source."""
+    carrier: int
+    offset: int
+    size: int
+    source_file: str
+    source_offset: int
+
+
+def coded_size(size: int, data_shards: int) -> int:
+    """Return the size of each shard of a secret coded in data_shards data shards."""
+    return -(-size // data_shards)
+
+
+def _write_parity(
+    secret_file: str,
+    shard_size: int,
+    data_shards: int,
+    parity_shards: int,
+    directory: str
+) -> List[str]:
+    """
+    Compute the parity shards of the secret file, a block of every data
+    shard at a time, and save them to files in the directory.
+    Return the file paths.
+    """
+    # Loaded here, the CLI imports this module (startup time)
+    import numpy as np
+
+    from cryptosteganography import erasure
+
+    parity_files = [
+        os.path.join(directory, 'parity{}'.format(index)) for index in range(parity_shards)
+    ]
+    outputs = [open(parity_file, 'wb') for parity_file in parity_files]
+    try:
+        with open(secret_file, 'rb') as f:
+            for start in range(0, shard_size, READ_SIZE):
+                length = min(READ_SIZE, shard_size - start)
+                # The last data shards are padded with zeros
+                block = np.zeros((data_shards, length), dtype=np.uint8)
+                for index in range(data_shards):
+                    f.seek(index * shard_size + start)
+                    data = f.read(length)
+                    block[index, :len(data)] = np.frombuffer(data, dtype=np.uint8)
+                for output, parity in zip(outputs, erasure.encode(block, parity_shards)):
+                    output.write(parity.tobytes())
+    finally:
+        for output in outputs:
+            output.close()
+    return parity_files
+
+
+def _coded_shards(
+    capacities: Sequence[int],
+    size: int,
+    parity_shards: int,
+    secret_file: str,
+    directory: str
+) -> List[_Shard]:
+    """
+    Return the data shards and parity shards of the secret file, one per
+    carrier, the parity shards saved in the directory.
+    Raise ValueError if they don't fit in the carriers.
+    """
+    data_shards = len(capacities) - parity_shards
+    if not 0 < parity_shards < len(capacities):
+        raise ValueError('At least one image is needed for the data besides the parity shards')
+    shard_size = coded_size(size, data_shards)
+    room = min(capacities) - MANIFEST.size
+    if shard_size > room:
+        raise ValueError(
+            'The secret does not fit in the carriers: {} bytes per shard, {} available'.format(
+                shard_size, max(room, 0)
+            )
+        )
+
+    shards = [
+        _Shard(index, index * shard_size, min(shard_size, max(size - index * shard_size, 0)),
+               secret_file, index * shard_size)
+        for index in range(data_shards)
+    ]
+    parity_files = _write_parity(secret_file, shard_size, data_shards, parity_shards, directory)
+    shards.extend(
+        _Shard(index, index * shard_size, shard_size, parity_file, 0)
+        for index, parity_file in enumerate(parity_files, data_shards)
+    )
+    return shards
+
+
+def hide(
+    crypto_steganography: 'CryptoSteganography',
+    input_image_files: Sequence[str],
+    output_image_files: Sequence[str],
+    secret_file: str,
+    workers: Optional[int] = None,
+    parity: int = 0
+) -> ShardSummary:
+    """
+    Split the secret file in shards and hide them in the input images, one
+    shard per image, saved to the output images (lossless format from their
+    extensions). Carriers left without data are not saved.
+
+    With parity shards, the secret is split in shards of the same size in
+    the first images and the last parity images get the parity shards: any
+    len(input_image_files) - parity of the output images (all saved) are
+    enough to retrieve it.
+
+    Raise ValueError if the secret does not fit in the images, or if
+    several output images are the same file.
+    """
+    if len(input_image_files) != len(output_image_files):
+        raise ValueError('One output image is needed per input image')
+    duplicates = batch.duplicate_paths(output_image_files)
+    if duplicates:
+        raise ValueError('Several images write the same output: {}'.format(', '.join(duplicates)))
+
+    start = time.perf_counter()
+    size = os.path.getsize(secret_file)
+    capacities = [
+        crypto_steganography.capacity(input_image_file) for input_image_file in input_image_files
+    ]
+    sha256 = file_hash(secret_file)
+
+    if parity:
+        with tempfile.TemporaryDirectory() as directory:
+            shards = _coded_shards(capacities, size, parity, secret_file, directory)
+            _hide_shards(
+                crypto_steganography,
+                input_image_files,
+                output_image_files,
+                shards,
+                len(shards) - parity,
+                size,
+                sha256,
+                workers
+            )
+    else:
+        # An empty secret still gets one shard
+        shards = [
+            _Shard(carrier, offset, shard_size, secret_file, offset)
+            for carrier, (offset, shard_size) in enumerate(plan(capacities, size))
+            if shard_size
+        ] or [_Shard(0, 0, 0, secret_file, 0)]
+        _hide_shards(
+            crypto_steganography,
+            input_image_files,
+            output_image_files,
+            shards,
+            len(shards),
+            size,
+            sha256,
+            workers
+        )
+
+    return ShardSummary(len(shards), size, time.perf_counter() - start)
+
+
+def _hide_shards(
+    crypto_steganography: 'CryptoSteganography',
+    input_image_files: Sequence[str],
+    output_image_files: Sequence[str],
+    shards: Sequence[_Shard],
+    required: int,
+    size: int,
+    sha256: bytes,
+    workers: Optional[int]
+) -> None:
+    """Hide the shards of one secret concurrently in a process pool."""
+    # Loaded here, multiprocessing is slow to import (CLI startup)
+    from concurrent.futures import ProcessPoolExecutor
+
+    set_id = os.urandom(SET_ID_SIZE)
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(crypto_steganography,)
+    ) as executor:
+        futures = [
+            executor.submit(
+                _hide_shard,
+                Manifest(set_id, index, len(shards), required, shard.offset, size, sha256),
+                shard.source_file,
+                shard.source_offset,
+                shard.size,
+                input_image_files[shard.carrier],
+                output_image_files[shard.carrier]
+            )
+            for index, shard in enumerate(shards)
+        ]
+        for future in futures:
+            future.result()
+
+
+def retrieve(
+    crypto_steganography: 'CryptoSteganography',
+    image_files: Sequence[str],
+    output_file: str,
+    workers: Optional[int] = None
+) -> ShardSummary:
+    """
+    Retrieve the shards hidden in the images (in any order) and write the
+    secret to the output file, in order, as the shards arrive.
+
+    Secrets hidden with parity shards are written once enough shards are
+    retrieved (they are spooled to temporary files until then), images
+    without a valid shard are skipped as long as enough are left.
+
+    Raise ValueError if a shard is missing, invalid or from another secret,
+    or if the secret hash does not match. An existing output file is left
+    untouched then.
+    """
+    from concurrent.futures import as_completed, ProcessPoolExecutor
+
+    start = time.perf_counter()
+    failures: List[str] = []
+
+    def retrieved(futures: Iterable) -> Iterator[Tuple[Manifest, bytes]]:
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except (OSError, ValueError) as error:
+                failures.append(str(error))
+
+    try:
+        # Written next to the output file, a failure leaves an existing
+        # file untouched
+        with formats.replacing(output_file) as temporary_file:
+            with open(temporary_file, 'wb') as f, ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(crypto_steganography,)
+            ) as executor:
+                futures = [
+                    executor.submit(_retrieve_shard, image_file) for image_file in image_files
+                ]
+                manifest = _reassemble(retrieved(futures), f)
+    except ValueError as error:
+        if failures:
+            raise ValueError('{} ({})'.format(error, '; '.join(failures))) from None
+        raise
+
+    return ShardSummary(manifest.shard_count, manifest.size, time.perf_counter() - start)
+
+
+def _reassemble(shards: Iterable[Tuple[Manifest, bytes]], f: IO[bytes]) -> Manifest:
+    """
+    Write the secret of the shards (manifest and data, in any order) to a
+    file. Return the manifest of the first shard.
+    Raise ValueError if there are not enough shards of one secret, or if the
+    secret hash does not match.
+    """
+    shards = iter(shards)
+    first = next(shards, None)
+    if first is None:
+        raise ValueError('Missing shards')
+    manifest = first[0]
+    if manifest.required == manifest.shard_count:
+        _write_in_order(manifest, itertools.chain([first], shards), f)
+    else:
+        _write_decoded(manifest, itertools.chain([first], shards), f)
+    return manifest
+
+
+def _check_set(manifest: Manifest, first: Manifest) -> None:
+    """Raise ValueError if the shard is not from the secret of the first one."""
+    if manifest._replace(shard_index=0, offset=0) != first._replace(shard_index=0, offset=0):
+        raise ValueError('Shards of different secrets')
+
+
+def _write_in_order(
+    first: Manifest,
+    shards: Iterable[Tuple[Manifest, bytes]],
+    f: IO[bytes]
+) -> None:
+    """
+    Write the shards (all the shards of a secret without parity, in any
+    order) to a file in order.
+    """
+    pending: Dict[int, Tuple[Manifest, bytes]] = {}
+    digest = hashlib.sha256()
+    written = 0
+    following = 0
+
+    for manifest, data in shards:
+        _check_set(manifest, first)
+        if manifest.shard_index in pending or manifest.shard_index < following:
+            raise ValueError('Duplicate shard {}'.format(manifest.shard_index))
+        pending[manifest.shard_index] = manifest, data
+
+        while following in pending:
+            manifest, data = pending.pop(following)
+            if manifest.offset != written:
+                raise ValueError('Shard {} is out of place'.format(following))
+            f.write(data)
+            digest.update(data)
+            written += len(data)
+            following += 1
+
+    if following != first.shard_count or written != first.size:
+        raise ValueError('Missing shards')
+    if digest.digest() != first.sha256:
+        raise ValueError('The secret hash does not match')
+
+
+def _write_decoded(
+    first: Manifest,
+    shards: Iterable[Tuple[Manifest, bytes]],
+    f: IO[bytes]
+) -> None:
+    """
+    Decode the data shards from the shards (of a secret with parity, in
+    any order) and write them to a file. The shards are spooled to
+    temporary files as they arrive, and decoded a block at a time, so the
+    secret is never held in memory.
+    """
+    shard_size = coded_size(first.size, first.required)
+    seen = set()
+    with tempfile.TemporaryDirectory() as directory:
+        spooled: Dict[int, str] = {}
+        for manifest, data in shards:
+            _check_set(manifest, first)
+            index = manifest.shard_index
+            if index in seen:
+                raise ValueError('Duplicate shard {}'.format(index))
+            seen.add(index)
+            if manifest.offset != index * shard_size or len(data) != _coded_length(first, index):
+                raise ValueError('Shard {} is out of place'.format(index))
+            # The ones past the first required are not needed
+            if len(spooled) < first.required:
+                spooled[index] = os.path.join(directory, 'shard{}'.format(index))
+                with open(spooled[index], 'wb') as shard_file:
+                    shard_file.write(data)
+
+        if len(spooled) < first.required:
+            raise ValueError(
+                'Missing shards: {} of the {} needed'.format(len(spooled), first.required)
+            )
+        _recover_data(first, spooled, directory)
+
+        digest = hashlib.sha256()
+        for index in range(first.required):
+            with open(spooled[index], 'rb') as shard_file:
+                left = _coded_length(first, index)
+                while left:
+                    data = shard_file.read(min(READ_SIZE, left))
+                    f.write(data)
+                    digest.update(data)
+                    left -= len(data)
+    if digest.digest() != first.sha256:
+        raise ValueError('The secret hash does not match')
+
+
+def _coded_length(first: Manifest, index: int) -> int:
+    """Return the length of a shard of a secret with parity (see _coded_shards)."""
+    shard_size = coded_size(first.size, first.required)
+    if index >= first.required:
+        return shard_size
+    return min(shard_size, max(first.size - index * shard_size, 0))
+
+
+def _recover_data(first: Manifest, spooled: Dict[int, str], directory: str) -> None:
+    """
+    Decode the missing data shards from the spooled ones (required of
+    them), a block of every shard at a time, and spool them too.
+    """
+    missing = [index for index in range(first.required) if index not in spooled]
+    if not missing:
+        return
+
+    # Loaded here, the CLI imports this module (startup time)
+    import numpy as np
+
+    from cryptosteganography import erasure
+
+    shard_size = coded_size(first.size, first.required)
+    indexes = sorted(spooled)
+    matrix = erasure.decoder(indexes, first.required, first.shard_count - first.required)[missing]
+    inputs: List[IO[bytes]] = [open(spooled[index], 'rb') for index in indexes]
+    outputs: List[IO[bytes]] = []
+    try:
+        for index in missing:
+            spooled[index] = os.path.join(directory, 'shard{}'.format(index))
+            outputs.append(open(spooled[index], 'wb'))
+        for start in range(0, shard_size, READ_SIZE):
+            length = min(READ_SIZE, shard_size - start)
+            # The last data shards are padded with zeros
+            block = np.zeros((len(indexes), length), dtype=np.uint8)
+            for row, shard_file in zip(block, inputs):
+                data = shard_file.read(length)
+                row[:len(data)] = np.frombuffer(data, dtype=np.uint8)
+            for output, recovered in zip(outputs, erasure.combine(matrix, block)):
+                output.write(recovered.tobytes())
+    finally:
+        for shard_file in inputs + outputs:
+            shard_file.close()
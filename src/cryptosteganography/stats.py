@@ -0,0 +1,98 @@
+"""
+Per-stage instrumentation of hide and retrieve.
+
+Each call collects the wall time, bytes processed and pixels touched of its
+stages (image decoding, key derivation, encryption, embedding, encoding...)
+in a Stats object, handed to the ``on_stats`` callback of CryptoSteganography.
+Stages run more than once (the chunks of a stream) are added up. Other
+figures of the call (the compression ratio...) are kept as named values.
+"""
+import contextlib
+import time
+from typing import Dict, Iterator, NamedTuple
+
+__author__ = 'computationalcore@gmail.com'
+
+HIDE = 'hide'
+RETRIEVE = 'retrieve'
+
+
+class Stage(NamedTuple):
+    """Totals of one stage."""
+    name: str
+    seconds: float = 0.0
+    # Bytes processed
+    size: int = 0
+    # Pixels decoded, read or written
+    pixels: int = 0
+
+
+class Stats(object):
+    """Stages of one hide or retrieve call, in the order they first ran."""
+
+    def __init__(self, operation: str) -> None:
+        self.operation = operation
+        self.stages: Dict[str, Stage] = {}
+        self.values: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float, size: int = 0, pixels: int = 0) -> None:
+        """Add a run of a stage."""
+        stage = self.stages.get(name, Stage(name))
+        self.stages[name] = Stage(
+            name,
+            stage.seconds + seconds,
+            stage.size + size,
+            stage.pixels + pixels
+        )
+
+    def set(self, name: str, value: float) -> None:
+        """Record a named value of the call."""
+        self.values[name] = value
+
+    @contextlib.contextmanager
+    def stage(self, name: str, size: int = 0, pixels: int = 0) -> Iterator[None]:
+        """Time the code run inside the context as a stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, size, pixels)
+
+    @property
+    def seconds(self) -> float:
+        """Time of all the stages."""
+        return sum(stage.seconds for stage in self.stages.values())
+
+    def as_dict(self) -> dict:
+        """Return the stats as plain data (JSON friendly)."""
+        return {
+            'operation': self.operation,
+            'seconds': self.seconds,
+            'stages': [stage._asdict() for stage in self.stages.values()],
+            'values': dict(self.values),
+        }
+
+    def report(self) -> str:
+        """Return the stages as a text table."""
+        lines = ['{:<10} {:>10} {:>7} {:>12} {:>10}'.format(
+            self.operation, 'time (ms)', '%', 'bytes', 'pixels'
+        )]
+        for stage in self.stages.values():
+            lines.append('{:<10} {:>10.1f} {:>7.1f} {:>12} {:>10}'.format(
+                stage.name,
+                stage.seconds * 1000,
+                stage.seconds / self.seconds * 100 if self.seconds else 0,
+                stage.size,
+                stage.pixels
+            ))
+        lines.append('{:<10} {:>10.1f}'.format('total', self.seconds * 1000))
+        for name, value in self.values.items():
+            lines.append('{}: {:g}'.format(name, value))
+        return '\n'.join(lines)
+
+    def __repr__(self) -> str:
+        return 'Stats({!r}, {!r}, {!r})'.format(
+            self.operation,
+            list(self.stages.values()),
+            self.values
+        )
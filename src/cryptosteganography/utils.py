@@ -1,10 +1,28 @@
-from typing import Optional, Tuple
+import functools
+import os
+from typing import Callable, Optional, Tuple, TYPE_CHECKING
 
-from cryptosteganography import CryptoSteganography
+from cryptosteganography import formats
+
+if TYPE_CHECKING:
+    from cryptosteganography.core import CryptoSteganography
 
 __author__ = 'computationalcore@gmail.com'
 
 
+@functools.lru_cache(maxsize=8)
+def get_crypto_steganography(password: Optional[str]) -> 'CryptoSteganography':
+    """
+    Get the CryptoSteganography instance for a password.
+    Instances are reused, so calls with the same password share the salt and
+    the derived key instead of running the key derivation every time.
+    """
+    # Loaded here, so the CLI starts without the image and crypto libraries
+    from cryptosteganography.core import CryptoSteganography
+
+    return CryptoSteganography(password)
+
+
 def get_data_from_file(file_path: str) -> Tuple[Optional[bytes], Optional[str]]:
     """
     Get binary data from a file path.
@@ -24,6 +42,19 @@ def get_data_from_file(file_path: str) -> Tuple[Optional[bytes], Optional[str]]:
     return (data, error)
 
 
+def check_data_file(file_path: str) -> Optional[str]:
+    """
+    Check that a secret file exists and is not empty, without reading it.
+    """
+    try:
+        if not os.path.getsize(file_path):
+            return "Failed: Message file content can't be empty"
+    except FileNotFoundError:
+        return 'Failed: File {} not found.'.format(file_path)
+
+    return None
+
+
 def get_secret_from_image(
     password: Optional[str],
     file_path: str
@@ -34,7 +65,7 @@ def get_secret_from_image(
     secret = None
     error = None
 
-    crypto_steganography = CryptoSteganography(password)
+    crypto_steganography = get_crypto_steganography(password)
 
     try:
         secret = crypto_steganography.retrieve(file_path)
@@ -50,45 +81,123 @@ def get_secret_from_image(
     return (secret, error)
 
 
-def get_output_image_filename(output_image_file: str) -> str:
+def get_output_image_filename(
+    output_image_file: str,
+    output_format: Optional[str] = None
+) -> str:
     """
     Return the output filename from the an expected file name
-    (the lib only support PNG files as output format)
+    (the lib only support lossless formats as output, PNG by default)
     """
     if not output_image_file:
-        output_image_file = 'output.png'
-    else:
-        # If output image doesn't have png suffix or is in other format, force png append
-        if output_image_file[-4:].lower() != '.png':
-            output_image_file += '.png'
+        output_image_file = 'output'
 
-    return output_image_file
+    # If output image doesn't have a lossless format suffix (or the one of
+    # the informed format), force the format suffix append
+    return formats.filename(output_image_file, output_format)
 
 
-def save_output_image(
-    password: Optional[str],
-    input_image_file: str,
-    message: Optional[bytes],
-    output_image_file: str
-) -> Optional[str]:
+def _hide(input_image_file: str, hide: Callable[[], object]) -> Optional[str]:
     """
-    Save the output image with secret data inside.
+    Run the hide operation and return the error message (if any).
     """
-
-    crypto_steganography = CryptoSteganography(password)
-
     error = None
     try:
-        crypto_steganography.hide(input_image_file, output_image_file, message)
+        hide()
     except FileNotFoundError:
         error = 'Failed: Input file {} not found.'.format(input_image_file)
     except OSError as os_error:
         # It can be invalid file format
         error = 'Failed: %s' % os_error
+    except ValueError as value_error:
+        # Unsupported output settings or data too long for the image
+        error = 'Failed: %s' % value_error
 
     return error
 
 
+def save_output_image(
+    password: Optional[str],
+    input_image_file: str,
+    message: Optional[bytes],
+    output_image_file: str,
+    compress_level: Optional[int] = None,
+    compress_strategy: Optional[str] = None,
+    output_format: Optional[str] = None
+) -> Optional[str]:
+    """
+    Save the output image with secret data inside.
+    """
+
+    crypto_steganography = get_crypto_steganography(password)
+
+    return _hide(
+        input_image_file,
+        lambda: crypto_steganography.hide(
+            input_image_file,
+            output_image_file,
+            message,
+            compress_level=compress_level,
+            compress_strategy=compress_strategy,
+            output_format=output_format
+        )
+    )
+
+
+def save_output_image_from_file(
+    password: Optional[str],
+    input_image_file: str,
+    message_file: str,
+    output_image_file: str,
+    compress_level: Optional[int] = None,
+    compress_strategy: Optional[str] = None,
+    output_format: Optional[str] = None
+) -> Optional[str]:
+    """
+    Save the output image with the content of a secret file inside, streaming
+    the file instead of loading it in memory.
+    """
+
+    crypto_steganography = get_crypto_steganography(password)
+
+    def hide() -> None:
+        with open(message_file, 'rb') as f:
+            crypto_steganography.hide_stream(
+                input_image_file,
+                output_image_file,
+                f,
+                compress_level=compress_level,
+                compress_strategy=compress_strategy,
+                output_format=output_format
+            )
+
+    return _hide(input_image_file, hide)
+
+
+def save_secret_file_from_image(
+    password: Optional[str],
+    file_path: str,
+    retrieved_file: str
+) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Stream the secret hided inside an image file to the retrieved file.
+    """
+    crypto_steganography = get_crypto_steganography(password)
+
+    # Moved over the retrieved file only once the data is valid, so a
+    # failure leaves an existing file untouched
+    try:
+        with formats.replacing(retrieved_file) as temporary_file:
+            with open(temporary_file, 'wb') as f:
+                size = crypto_steganography.retrieve_stream(file_path, f)
+            if size is None:
+                raise ValueError('No valid data found')
+    except ValueError as error:
+        return (None, str(error))
+
+    return ('{} saved with success'.format(retrieved_file), None)
+
+
 def save_secret_file(secret, retrieved_file):
     """
     Save the secret data from bunary to file.
@@ -1,7 +1,11 @@
 import argparse
 import builtins
 import io
+import json
 import os
+import pstats
+import shutil
+import subprocess
 import sys
 from unittest import mock
 
@@ -18,6 +22,7 @@ INPUT_MESSAGE_AUDIO_FILE = 'tests/assets/test_file.mp3'
 OUTPUT_IMAGE = 'tests/output_files/image_file_cli.png'
 OUTPUT_IMAGE_JPG_EXPECTED = 'tests/output_files/image_file_cli_other.jpg'
 OUTPUT_MESSAGE_FILE = 'tests/output_files/message_file_cli.txt'
+OUTPUT_MESSAGE_INVALID_FILE = 'tests/output_files/message_file_cli_invalid.txt'
 OUTPUT_MESSAGE_AUDIO_FILE = 'tests/output_files/test_file_cli.mp3'
 
 # The cli change any change output format to PNG
@@ -104,10 +109,11 @@ def test_empty_command(mock_args, monkeypatch, capsys) -> None:
 
     output = str(capsys.readouterr().out)
 
-    assert "usage: cryptosteganography [-h] [-v] {save,retrieve}" in output
+    assert "usage: cryptosteganography [-h] [-v]" in output
+    assert "{save,retrieve,batch-save,batch-retrieve,shard-save,shard-retrieve,scan}" in output
     assert "Cryptosteganography is an application to save or retrieve an encrypted message" in output
-    assert "-h, --help       show this help message and exit" in output
-    assert "-v, --version    show program's version number and exit" in output
+    assert "-h, --help            show this help message and exit" in output
+    assert "-v, --version         show program's version number and exit" in output
 
 
 @mock.patch(
@@ -128,10 +134,11 @@ def test_invalid_command(mock_args, monkeypatch, capsys) -> None:
 
     output = str(capsys.readouterr().out)
 
-    assert "usage: cryptosteganography [-h] [-v] {save,retrieve}" in output
+    assert "usage: cryptosteganography [-h] [-v]" in output
+    assert "{save,retrieve,batch-save,batch-retrieve,shard-save,shard-retrieve,scan}" in output
     assert "Cryptosteganography is an application to save or retrieve an encrypted message" in output
-    assert "-h, --help       show this help message and exit" in output
-    assert "-v, --version    show program's version number and exit" in output
+    assert "-h, --help            show this help message and exit" in output
+    assert "-v, --version         show program's version number and exit" in output
 
 
 ###############################
@@ -598,3 +605,605 @@ def test_retrieve_message_jpg_success(mock_args, monkeypatch, capsys) -> None:
     output = str(capsys.readouterr().out)
     assert output == 'Hello World. 你好，世界!!!\n'
 
+
+@mock.patch(
+    'argparse.ArgumentParser.parse_args',
+    return_value=argparse.Namespace(
+        command='retrieve',
+        input_image_file=OUTPUT_IMAGE_JPG_REAL,
+        retrieved_file=OUTPUT_MESSAGE_INVALID_FILE
+    )
+)
+def test_retrieve_message_as_file_invalid_password(mock_args, monkeypatch, capsys) -> None:
+    # Password prompt
+    monkeypatch.setattr('getpass.getpass', lambda prompt: 'Wrong Password')
+
+    # Call CLI
+    with pytest.raises(SystemExit) as pytest_wrapped_e:
+        sys.exit(cli.main())
+    assert pytest_wrapped_e.type == SystemExit
+    assert pytest_wrapped_e.value.code == ExitStatus.failure
+
+    output = str(capsys.readouterr().out)
+    assert output == 'No valid data found\n'
+
+    # No partial data left behind
+    assert not os.path.isfile(OUTPUT_MESSAGE_INVALID_FILE)
+
+
+@pytest.mark.parametrize('input_image_file', [OUTPUT_IMAGE_JPG_REAL, 'nonexistent_image.png'])
+def test_retrieve_message_as_file_keeps_existing_file(
+    input_image_file,
+    tmp_path,
+    monkeypatch,
+    capsys
+) -> None:
+    # Password prompt
+    monkeypatch.setattr('getpass.getpass', lambda prompt: 'Wrong Password')
+
+    retrieved_file = tmp_path / 'precious.txt'
+    retrieved_file.write_bytes(b'Precious data')
+    retrieved_file.chmod(0o640)
+
+    with mock.patch(
+        'argparse.ArgumentParser.parse_args',
+        return_value=argparse.Namespace(
+            command='retrieve',
+            input_image_file=input_image_file,
+            retrieved_file=str(retrieved_file)
+        )
+    ):
+        assert cli.main() == ExitStatus.failure
+
+    assert str(capsys.readouterr().out) == 'No valid data found\n'
+    # Neither truncated nor removed, and no temporary file left behind
+    assert retrieved_file.read_bytes() == b'Precious data'
+    assert os.listdir(tmp_path) == ['precious.txt']
+
+
+def test_retrieve_message_as_file_replaces_existing_file(tmp_path, monkeypatch, capsys) -> None:
+    from cryptosteganography import CryptoSteganography
+
+    monkeypatch.setattr('getpass.getpass', lambda prompt: 'password')
+    image_file = str(tmp_path / 'image.png')
+    CryptoSteganography('password').hide(INPUT_IMAGE, image_file, 'Hello World')
+    retrieved_file = tmp_path / 'message.txt'
+    retrieved_file.write_bytes(b'Old data, longer than the new one')
+    retrieved_file.chmod(0o640)
+
+    monkeypatch.setattr(sys, 'argv', [
+        'cryptosteganography', 'retrieve', '-i', image_file, '-o', str(retrieved_file)
+    ])
+    assert cli.main() == ExitStatus.success
+
+    assert capsys.readouterr().out == f'{retrieved_file} saved with success\n'
+    assert retrieved_file.read_bytes() == b'Hello World'
+    # Same permissions
+    assert retrieved_file.stat().st_mode & 0o777 == 0o640
+    assert sorted(os.listdir(tmp_path)) == ['image.png', 'message.txt']
+
+
+################
+# Batch Tests  #
+################
+
+def test_batch_save_and_retrieve_success(tmp_path, monkeypatch, capsys) -> None:
+    # Password prompt
+    monkeypatch.setattr('getpass.getpass', lambda prompt: '48dj_你好，世界')
+
+    (tmp_path / 'input').mkdir()
+    for name in ('a.jpg', 'b.jpg'):
+        shutil.copy(INPUT_IMAGE, tmp_path / 'input' / name)
+
+    with mock.patch(
+        'argparse.ArgumentParser.parse_args',
+        return_value=argparse.Namespace(
+            command='batch-save',
+            manifest_file=None,
+            input_patterns=[f'{tmp_path}/input/*.jpg', f'{tmp_path}/input/a.jpg'],
+            output_dir=str(tmp_path / 'images'),
+            workers=2,
+            message=None,
+            message_file=INPUT_MESSAGE_TEXT_FILE
+        )
+    ):
+        assert cli.main() == ExitStatus.success
+
+    output = str(capsys.readouterr().out).splitlines()
+    assert sorted(output[:2]) == [
+        f'[OK] {tmp_path}/input/a.jpg -> {tmp_path}/images/a.png',
+        f'[OK] {tmp_path}/input/b.jpg -> {tmp_path}/images/b.png',
+    ]
+    assert output[2].startswith('2 images in ')
+    assert output[2].endswith(' MB/s), 0 failed')
+
+    manifest = tmp_path / 'manifest.jsonl'
+    manifest.write_text(
+        f'{{"input": "{tmp_path}/images/a.png", "output": "{tmp_path}/secret.txt"}}\n'
+        f'{{"input": "{INPUT_IMAGE}"}}\n'
+    )
+    with mock.patch(
+        'argparse.ArgumentParser.parse_args',
+        return_value=argparse.Namespace(
+            command='batch-retrieve',
+            manifest_file=str(manifest),
+            input_patterns=None,
+            output_dir=None,
+            workers=1
+        )
+    ):
+        assert cli.main() == ExitStatus.failure
+
+    output = str(capsys.readouterr().out).splitlines()
+    assert output[:2] == [
+        f'[OK] {tmp_path}/images/a.png -> {tmp_path}/secret.txt',
+        f'[FAILED] {INPUT_IMAGE}: No valid data found',
+    ]
+    assert output[2].startswith('2 images in ')
+    assert output[2].endswith(' MB/s), 1 failed')
+
+    with open(INPUT_MESSAGE_TEXT_FILE, 'rb') as f:
+        assert (tmp_path / 'secret.txt').read_bytes() == f.read()
+
+
+def test_batch_save_csv_manifest_success(tmp_path, monkeypatch, capsys) -> None:
+    # Password prompt
+    monkeypatch.setattr('getpass.getpass', lambda prompt: '48dj_你好，世界')
+
+    manifest = tmp_path / 'manifest.csv'
+    manifest.write_text(
+        'input,output,message\n'
+        f'{INPUT_IMAGE},{tmp_path}/output.png,Hello World\n'
+    )
+    with mock.patch(
+        'argparse.ArgumentParser.parse_args',
+        return_value=argparse.Namespace(
+            command='batch-save',
+            manifest_file=str(manifest),
+            input_patterns=None,
+            output_dir=None,
+            workers=None
+        )
+    ):
+        assert cli.main() == ExitStatus.success
+
+    with mock.patch(
+        'argparse.ArgumentParser.parse_args',
+        return_value=argparse.Namespace(
+            command='batch-retrieve',
+            manifest_file=None,
+            input_patterns=[f'{tmp_path}/*.png'],
+            output_dir=None,
+            workers=None
+        )
+    ):
+        assert cli.main() == ExitStatus.success
+
+    output = str(capsys.readouterr().out).splitlines()
+    assert output[0] == f'[OK] {INPUT_IMAGE} -> {tmp_path}/output.png'
+    assert output[2] == f'[OK] {tmp_path}/output.png: Hello World'
+
+
+@pytest.mark.parametrize('namespace, expected', [
+    (
+        dict(manifest_file='invalid.csv', input_patterns=None, output_dir=None, workers=None),
+        'Failed: File invalid.csv not found.'
+    ),
+    (
+        dict(manifest_file=INPUT_MESSAGE_TEXT_FILE, input_patterns=None, output_dir=None,
+             workers=None),
+        f'Failed: Unknown manifest format: {INPUT_MESSAGE_TEXT_FILE}'
+    ),
+    (
+        dict(manifest_file=None, input_patterns=[INPUT_IMAGE], output_dir=None, workers=None,
+             message='Hello', message_file=None),
+        'Failed: The output directory is required with --input'
+    ),
+    (
+        dict(manifest_file=None, input_patterns=[INPUT_IMAGE], output_dir='out', workers=None,
+             message=None, message_file=None),
+        "Failed: Message can't be empty"
+    ),
+    (
+        dict(manifest_file=None, input_patterns=[INPUT_IMAGE], output_dir='out', workers=0,
+             message='Hello', message_file=None),
+        'Failed: The number of workers must be at least 1'
+    ),
+])
+def test_batch_save_invalid_input_error(namespace, expected, capsys) -> None:
+    with mock.patch(
+        'argparse.ArgumentParser.parse_args',
+        return_value=argparse.Namespace(command='batch-save', **namespace)
+    ):
+        assert cli.main() == ExitStatus.failure
+
+    output = str(capsys.readouterr().out)
+    assert output == expected + '\n'
+
+
+@pytest.mark.parametrize('rows, expected', [
+    (
+        f'{INPUT_IMAGE},,Hello\n{INPUT_IMAGE},,World\n',
+        f'Failed: Batch item without output: {INPUT_IMAGE}'
+    ),
+    (
+        f'{INPUT_IMAGE},{{tmp_path}}/a,Hello\n{INPUT_IMAGE},{{tmp_path}}/a.png,World\n',
+        'Failed: Several images write the same output: {tmp_path}/a.png'
+    ),
+])
+def test_batch_save_manifest_output_error(rows, expected, tmp_path, capsys) -> None:
+    manifest = tmp_path / 'manifest.csv'
+    manifest.write_text('input,output,message\n' + rows.format(tmp_path=tmp_path))
+
+    # Rejected before asking for the password
+    with mock.patch('getpass.getpass', side_effect=AssertionError), mock.patch(
+        'argparse.ArgumentParser.parse_args',
+        return_value=argparse.Namespace(
+            command='batch-save',
+            manifest_file=str(manifest),
+            input_patterns=None,
+            output_dir=None,
+            workers=None
+        )
+    ):
+        assert cli.main() == ExitStatus.failure
+
+    assert str(capsys.readouterr().out) == expected.format(tmp_path=tmp_path) + '\n'
+    assert os.listdir(tmp_path) == ['manifest.csv']
+
+
+def test_batch_save_same_image_name_error(tmp_path, capsys) -> None:
+    for directory, name in (('x', 'img.jpg'), ('y', 'img.jpg'), ('y', 'img.png')):
+        (tmp_path / directory).mkdir(exist_ok=True)
+        shutil.copy(INPUT_IMAGE, tmp_path / directory / name)
+
+    with mock.patch('getpass.getpass', side_effect=AssertionError), mock.patch(
+        'argparse.ArgumentParser.parse_args',
+        return_value=argparse.Namespace(
+            command='batch-save',
+            manifest_file=None,
+            input_patterns=[f'{tmp_path}/*/img.*'],
+            output_dir=str(tmp_path / 'images'),
+            workers=None,
+            message='Hello',
+            message_file=None
+        )
+    ):
+        assert cli.main() == ExitStatus.failure
+
+    output = str(capsys.readouterr().out)
+    assert output == f'Failed: Several images write the same output: {tmp_path}/images/img.png\n'
+    assert not os.path.exists(tmp_path / 'images')
+
+
+@pytest.mark.parametrize('argv', [
+    ['--compression-level', '1'],
+    ['--compression-level', '0', '--compression-strategy', 'huffman'],
+    ['--compression-strategy', 'rle'],
+])
+def test_save_compression_options_success(argv, tmp_path, monkeypatch, capsys) -> None:
+    output_image_file = str(tmp_path / 'output.png')
+    monkeypatch.setattr('getpass.getpass', lambda prompt: 'password')
+    monkeypatch.setattr(sys, 'argv', [
+        'cryptosteganography', 'save', '-i', INPUT_IMAGE, '-m', 'Hello World',
+        '-o', output_image_file
+    ] + argv)
+
+    assert cli.main() == ExitStatus.success
+    assert capsys.readouterr().out == f'Output image {output_image_file} saved with success\n'
+
+    monkeypatch.setattr(sys, 'argv', [
+        'cryptosteganography', 'retrieve', '-i', output_image_file
+    ])
+    assert cli.main() == ExitStatus.success
+    assert capsys.readouterr().out == 'Hello World\n'
+
+
+def test_save_compression_level_invalid(monkeypatch, capsys) -> None:
+    monkeypatch.setattr(sys, 'argv', [
+        'cryptosteganography', 'save', '-i', INPUT_IMAGE, '-m', 'Hello World',
+        '-o', OUTPUT_IMAGE, '--compression-level', '10'
+    ])
+
+    with pytest.raises(SystemExit):
+        cli.main()
+    assert 'invalid choice' in capsys.readouterr().err
+
+
+def test_save_format_success(tmp_path, monkeypatch, capsys) -> None:
+    output_image_file = str(tmp_path / 'output')
+    monkeypatch.setattr('getpass.getpass', lambda prompt: 'password')
+    monkeypatch.setattr(sys, 'argv', [
+        'cryptosteganography', 'save', '-i', INPUT_IMAGE, '-m', 'Hello World',
+        '-o', output_image_file, '--format', 'bmp'
+    ])
+
+    assert cli.main() == ExitStatus.success
+    assert capsys.readouterr().out == f'Output image {output_image_file}.bmp saved with success\n'
+
+    monkeypatch.setattr(sys, 'argv', [
+        'cryptosteganography', 'retrieve', '-i', output_image_file + '.bmp'
+    ])
+    assert cli.main() == ExitStatus.success
+    assert capsys.readouterr().out == 'Hello World\n'
+
+
+def test_save_format_compression_level_error(tmp_path, monkeypatch, capsys) -> None:
+    output_image_file = str(tmp_path / 'output.tiff')
+    monkeypatch.setattr('getpass.getpass', lambda prompt: 'password')
+    monkeypatch.setattr(sys, 'argv', [
+        'cryptosteganography', 'save', '-i', INPUT_IMAGE, '-m', 'Hello World',
+        '-o', output_image_file, '--compression-level', '1'
+    ])
+
+    assert cli.main() == ExitStatus.failure
+    assert capsys.readouterr().out == (
+        'Failed: Compression options only apply to the PNG format\n'
+    )
+
+
+def test_profile_success(tmp_path, monkeypatch, capsys) -> None:
+    output_image_file = str(tmp_path / 'output.png')
+    profile_file = str(tmp_path / 'save.prof')
+    monkeypatch.setattr('getpass.getpass', lambda prompt: 'password')
+    monkeypatch.setattr(sys, 'argv', [
+        'cryptosteganography', 'save', '-i', INPUT_IMAGE, '-m', 'Hello World',
+        '-o', output_image_file, '--profile', profile_file
+    ])
+
+    assert cli.main() == ExitStatus.success
+    captured = capsys.readouterr()
+    assert captured.out == f'Output image {output_image_file} saved with success\n'
+    assert captured.err.startswith('hide ')
+    assert 'encode' in captured.err
+    assert f'Profile saved to {profile_file}' in captured.err
+    assert pstats.Stats(profile_file).total_calls
+
+    monkeypatch.setattr(sys, 'argv', [
+        'cryptosteganography', 'retrieve', '-i', output_image_file, '--profile'
+    ])
+    assert cli.main() == ExitStatus.success
+    captured = capsys.readouterr()
+    assert captured.out == 'Hello World\n'
+    assert captured.err.startswith('retrieve ')
+    assert 'decrypt' in captured.err
+
+
+# Modules the CLI must not load before running a sub command
+HEAVY_MODULES = (
+    'numpy', 'PIL', 'Cryptodome', 'stegano', 'cv2', 'asyncio', 'multiprocessing',
+    'importlib.metadata'
+)
+# Import time budget of the CLI module, interpreter startup excluded
+IMPORT_TIME_BUDGET_US = 150_000
+
+
+def test_cli_import_is_lazy() -> None:
+    code = 'import sys, cryptosteganography.cli; print(" ".join(sys.modules))'
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        capture_output=True,
+        text=True,
+        check=True
+    )
+
+    assert not set(result.stdout.split()) & set(HEAVY_MODULES)
+    cumulative_us = [
+        int(line.split('|')[1])
+        for line in result.stderr.splitlines()
+        if line.split('|')[-1].strip() == 'cryptosteganography.cli'
+    ]
+    assert cumulative_us[0] < IMPORT_TIME_BUDGET_US
+
+
+def test_shard_save_and_retrieve_success(tmp_path, monkeypatch, capsys) -> None:
+    # Password prompt
+    monkeypatch.setattr('getpass.getpass', lambda prompt: '48dj_你好，世界')
+
+    (tmp_path / 'input').mkdir()
+    for name in ('a.jpg', 'b.jpg', 'c.jpg'):
+        shutil.copy(INPUT_IMAGE, tmp_path / 'input' / name)
+
+    with mock.patch(
+        'argparse.ArgumentParser.parse_args',
+        return_value=argparse.Namespace(
+            command='shard-save',
+            input_patterns=[f'{tmp_path}/input/*.jpg'],
+            message_file=INPUT_MESSAGE_AUDIO_FILE,
+            output_dir=str(tmp_path / 'images'),
+            workers=2,
+            parity=0
+        )
+    ):
+        assert cli.main() == ExitStatus.success
+    assert str(capsys.readouterr().out).startswith('3 shards, 51559 bytes in ')
+    assert sorted(os.listdir(tmp_path / 'images')) == ['a.png', 'b.png', 'c.png']
+
+    with mock.patch(
+        'argparse.ArgumentParser.parse_args',
+        return_value=argparse.Namespace(
+            command='shard-retrieve',
+            input_patterns=[f'{tmp_path}/images/*.png'],
+            retrieved_file=str(tmp_path / 'secret.mp3'),
+            workers=None
+        )
+    ):
+        assert cli.main() == ExitStatus.success
+
+    with open(INPUT_MESSAGE_AUDIO_FILE, 'rb') as f:
+        assert (tmp_path / 'secret.mp3').read_bytes() == f.read()
+
+    # A missing shard
+    with mock.patch(
+        'argparse.ArgumentParser.parse_args',
+        return_value=argparse.Namespace(
+            command='shard-retrieve',
+            input_patterns=[f'{tmp_path}/images/a.png'],
+            retrieved_file=str(tmp_path / 'other.mp3'),
+            workers=None
+        )
+    ):
+        assert cli.main() == ExitStatus.failure
+    assert 'Failed: Missing shards' in str(capsys.readouterr().out)
+
+
+def test_shard_save_with_parity_and_retrieve_with_a_lost_image(
+    tmp_path,
+    monkeypatch,
+    capsys
+) -> None:
+    # Password prompt
+    monkeypatch.setattr('getpass.getpass', lambda prompt: '48dj_你好，世界')
+
+    (tmp_path / 'input').mkdir()
+    for name in ('a.jpg', 'b.jpg', 'c.jpg'):
+        shutil.copy(INPUT_IMAGE, tmp_path / 'input' / name)
+
+    with mock.patch(
+        'argparse.ArgumentParser.parse_args',
+        return_value=argparse.Namespace(
+            command='shard-save',
+            input_patterns=[f'{tmp_path}/input/*.jpg'],
+            message_file=INPUT_MESSAGE_AUDIO_FILE,
+            output_dir=str(tmp_path / 'images'),
+            workers=2,
+            parity=1
+        )
+    ):
+        assert cli.main() == ExitStatus.success
+    assert str(capsys.readouterr().out).startswith('3 shards, 51559 bytes in ')
+
+    os.remove(tmp_path / 'images' / 'a.png')
+    with mock.patch(
+        'argparse.ArgumentParser.parse_args',
+        return_value=argparse.Namespace(
+            command='shard-retrieve',
+            input_patterns=[f'{tmp_path}/images/*.png'],
+            retrieved_file=str(tmp_path / 'secret.mp3'),
+            workers=None
+        )
+    ):
+        assert cli.main() == ExitStatus.success
+
+    with open(INPUT_MESSAGE_AUDIO_FILE, 'rb') as f:
+        assert (tmp_path / 'secret.mp3').read_bytes() == f.read()
+
+
+@pytest.mark.parametrize('namespace, expected', [
+    ({'message_file': 'nonexistent.txt', 'workers': None, 'parity': 0},
+     'Failed: File nonexistent.txt not found.'),
+    ({'message_file': INPUT_MESSAGE_TEXT_FILE, 'workers': 0, 'parity': 0},
+     'Failed: The number of workers must be at least 1'),
+    ({'message_file': INPUT_MESSAGE_TEXT_FILE, 'workers': None, 'parity': -1},
+     "Failed: The number of parity shards can't be negative"),
+])
+def test_shard_save_invalid_input_error(namespace, expected, capsys) -> None:
+    with mock.patch(
+        'argparse.ArgumentParser.parse_args',
+        return_value=argparse.Namespace(
+            command='shard-save',
+            input_patterns=[INPUT_IMAGE],
+            output_dir='tests/output_files',
+            **namespace
+        )
+    ):
+        assert cli.main() == ExitStatus.failure
+    assert str(capsys.readouterr().out).strip() == expected
+
+
+def test_shard_save_same_image_name_error(tmp_path, capsys) -> None:
+    for directory in ('x', 'y', 'z'):
+        (tmp_path / directory).mkdir()
+        shutil.copy(INPUT_IMAGE, tmp_path / directory / 'img.jpg')
+
+    with mock.patch('getpass.getpass', side_effect=AssertionError), mock.patch(
+        'argparse.ArgumentParser.parse_args',
+        return_value=argparse.Namespace(
+            command='shard-save',
+            input_patterns=[f'{tmp_path}/*/img.jpg'],
+            output_dir=str(tmp_path / 'images'),
+            message_file=INPUT_MESSAGE_AUDIO_FILE,
+            workers=None,
+            parity=0
+        )
+    ):
+        assert cli.main() == ExitStatus.failure
+
+    output = str(capsys.readouterr().out)
+    assert output == f'Failed: Several images write the same output: {tmp_path}/images/img.png\n'
+    assert not os.path.exists(tmp_path / 'images')
+
+
+def test_scan_success(tmp_path, capsys) -> None:
+    from cryptosteganography import CryptoSteganography
+    from PIL import Image
+
+    (tmp_path / 'images' / 'nested').mkdir(parents=True)
+    CryptoSteganography('48dj_你好，世界').hide(
+        INPUT_IMAGE,
+        str(tmp_path / 'images' / 'nested' / 'secret.png'),
+        'Hello World'
+    )
+    shutil.copy(INPUT_IMAGE, tmp_path / 'images' / 'cover.jpg')
+    Image.open(INPUT_IMAGE).save(tmp_path / 'images' / 'cover.png')
+
+    with mock.patch(
+        'argparse.ArgumentParser.parse_args',
+        return_value=argparse.Namespace(
+            command='scan',
+            input_paths=[str(tmp_path / 'images')],
+            index_file=str(tmp_path / 'index.jsonl'),
+            workers=2
+        )
+    ):
+        assert cli.main() == ExitStatus.success
+    assert ' 2 images in ' in ' ' + capsys.readouterr().err
+    with open(tmp_path / 'index.jsonl', encoding='utf-8') as f:
+        hits = [json.loads(line) for line in f]
+    assert hits == [{
+        'file': str(tmp_path / 'images' / 'nested' / 'secret.png'),
+        'format': 'PNG',
+        'version': 3,
+        'length': 66,
+        'bits_per_channel': 1,
+        'scattered': False,
+        'compression': None,
+        'shard': False,
+    }]
+
+
+def test_scan_invalid_workers_error(capsys) -> None:
+    with mock.patch(
+        'argparse.ArgumentParser.parse_args',
+        return_value=argparse.Namespace(
+            command='scan',
+            input_paths=['tests/assets'],
+            index_file=None,
+            workers=0
+        )
+    ):
+        assert cli.main() == ExitStatus.failure
+    output = str(capsys.readouterr().out).strip()
+    assert output == 'Failed: The number of workers must be at least 1'
+
+
+def test_scan_failed_image_error(tmp_path, capsys) -> None:
+    (tmp_path / 'images').mkdir()
+    shutil.copy(INPUT_IMAGE, tmp_path / 'images' / 'cover.jpg')
+    with open(tmp_path / 'images' / 'broken.png', 'wb') as f:
+        f.write(b'not an image')
+
+    with mock.patch(
+        'argparse.ArgumentParser.parse_args',
+        return_value=argparse.Namespace(
+            command='scan',
+            input_paths=[str(tmp_path / 'images')],
+            index_file=str(tmp_path / 'index.jsonl'),
+            workers=1
+        )
+    ):
+        assert cli.main() == ExitStatus.failure
+    errors = capsys.readouterr().err
+    assert f'[FAILED] {tmp_path}/images/broken.png: ' in errors
+    assert ', 0 hits, 1 failed' in errors
+    assert os.path.getsize(tmp_path / 'index.jsonl') == 0
@@ -1,6 +1,18 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import io
+import itertools
+import os
+import shutil
+import subprocess
+import sys
+import time
+
 import pytest
 from cryptosteganography import CryptoSteganography
+from cryptosteganography.utils import get_output_image_filename
 from Cryptodome.Cipher import AES
+import numpy as np
 from PIL import Image  # Importing Image module from PIL
 
 INPUT_IMAGE = 'tests/assets/test_image.jpg'
@@ -176,3 +188,1430 @@ def test_retrieve_with_index_error() -> None:
     secret = crypto_steganography.retrieve(OUTPUT_IMAGE)
 
     assert secret is None
+
+
+@pytest.mark.parametrize('hide_engine, retrieve_engine', [
+    ('numpy', 'stegano'),
+    ('stegano', 'numpy'),
+    ('stegano', 'stegano'),
+])
+def test_engine_compatibility(hide_engine: str, retrieve_engine: str) -> None:
+    key = 'test_key'
+    secret_message = 'Hello World. 你好，世界!!!'
+
+    CryptoSteganography(key, engine=hide_engine).hide(
+      INPUT_IMAGE,
+      OUTPUT_IMAGE,
+      secret_message
+    )
+
+    secret = CryptoSteganography(key, engine=retrieve_engine).retrieve(OUTPUT_IMAGE)
+
+    assert secret == secret_message
+
+
+def test_engine_same_pixels_as_stegano() -> None:
+    from stegano import lsb
+
+    from cryptosteganography import engine
+
+    message = 'SGVsbG8gV29ybGQ='
+    with Image.open(INPUT_IMAGE) as image:
+        pixels = engine.to_array(image, writable=True)
+    # stegano's LSB format: "<length>:<message>", padded up to a whole pixel
+    data = '{}:{}'.format(len(message), message).encode('latin-1')
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+    engine.embed_bits(pixels, np.pad(bits, (0, -len(bits) % engine.CHANNELS)))
+
+    expected = np.asarray(lsb.hide(INPUT_IMAGE, message))
+
+    assert np.array_equal(pixels, expected)
+    assert lsb.reveal(engine.to_image(pixels)) == message
+
+
+def test_engine_rgba_image() -> None:
+    key = 'test_key'
+
+    image = Image.new('RGBA', (40, 30), color=(10, 20, 30, 128))
+    image.save(OUTPUT_IMAGE)
+
+    crypto_steganography = CryptoSteganography(key)
+    crypto_steganography.hide(OUTPUT_IMAGE, OUTPUT_IMAGE, 'Hello World')
+
+    with Image.open(OUTPUT_IMAGE) as output_image:
+        assert output_image.mode == 'RGBA'
+        # The alpha channel is left untouched
+        assert set(np.asarray(output_image)[..., 3].ravel()) == {128}
+
+    assert crypto_steganography.retrieve(OUTPUT_IMAGE) == 'Hello World'
+
+
+def test_engine_message_too_long() -> None:
+    key = 'test_key'
+
+    image = Image.new('RGB', (10, 10), color='white')
+    image.save(OUTPUT_IMAGE)
+
+    crypto_steganography = CryptoSteganography(key)
+    with pytest.raises(ValueError):
+        crypto_steganography.hide(OUTPUT_IMAGE, OUTPUT_IMAGE, 'Hello World' * 10)
+
+
+def test_invalid_engine() -> None:
+    with pytest.raises(ValueError):
+        CryptoSteganography('test_key', engine='invalid')
+
+
+def test_container_header() -> None:
+    from cryptosteganography import container
+
+    header = container.unpack_header(container.pack_header(1234, flags=2))
+
+    assert header == container.Header(container.VERSION, 2, 1234)
+    assert container.unpack_header(b'1234:abcdefgh') is None
+    assert container.unpack_header(b'CSTG') is None
+
+
+def test_binary_container_smaller_than_legacy() -> None:
+    key = 'test_key'
+
+    with open(INPUT_MESSAGE_AUDIO_FILE, 'rb') as f:
+        secret_message = f.read()
+
+    # Room for the raw binary payload but not for its base64 version
+    image = Image.new('RGB', (400, 400), color='white')
+    image.save(OUTPUT_IMAGE)
+
+    with pytest.raises(Exception):
+        CryptoSteganography(key, engine='stegano').hide(OUTPUT_IMAGE, OUTPUT_IMAGE, secret_message)
+
+    crypto_steganography = CryptoSteganography(key)
+    crypto_steganography.hide(OUTPUT_IMAGE, OUTPUT_IMAGE, secret_message)
+
+    assert crypto_steganography.retrieve(OUTPUT_IMAGE) == secret_message
+
+
+def test_retrieve_reads_only_needed_rows(monkeypatch) -> None:
+    from cryptosteganography import engine
+
+    key = 'test_key'
+    image = Image.new('RGB', (100, 100), color='white')
+    image.save(OUTPUT_IMAGE)
+
+    crypto_steganography = CryptoSteganography(key)
+    crypto_steganography.hide(OUTPUT_IMAGE, OUTPUT_IMAGE, 'x' * 500)
+
+    read_rows = []
+    original_read_rows = engine.read_rows
+
+    def spy_read_rows(image, first, last):
+        read_rows.append((first, last))
+        return original_read_rows(image, first, last)
+
+    monkeypatch.setattr(engine, 'read_rows', spy_read_rows)
+
+    assert crypto_steganography.retrieve(OUTPUT_IMAGE) == 'x' * 500
+    # Header from the PNG data (not decoded), then exactly the rows of the
+    # body prefix (39 bytes), data (500 bytes) and tag (16 bytes): 10 + 555
+    # bytes are 4520 bits, in rows of 300 channels
+    assert read_rows == [(0, 2), (1, 15), (14, 16)]
+
+    # No container and no legacy prefix: rejected after reading the header
+    read_rows.clear()
+    assert crypto_steganography.retrieve(INPUT_IMAGE) is None
+    assert all(last <= 1 for _, last in read_rows)
+
+
+@pytest.mark.parametrize('extension', ['.png', '.bmp', '.tiff'])
+def test_retrieve_rejects_without_decoding(extension: str, tmp_path, monkeypatch) -> None:
+    from PIL import ImageFile
+
+    from cryptosteganography import container
+
+    image_file = str(tmp_path / ('cover' + extension))
+    Image.open(INPUT_IMAGE).save(image_file)
+
+    def load(self):
+        raise AssertionError('Pixels decoded')
+
+    monkeypatch.setattr(ImageFile.ImageFile, 'load', load)
+
+    with Image.open(image_file) as image:
+        assert container.read_header(image) is None
+    assert CryptoSteganography('test_key').retrieve(image_file) is None
+
+
+def test_retrieve_header_length_larger_than_image() -> None:
+    from cryptosteganography import container, engine
+
+    key = 'test_key'
+    with Image.open(INPUT_IMAGE) as image:
+        pixels = engine.to_array(image, writable=True)
+    engine.embed(pixels, container.pack_header(2 ** 32 - 1))
+    engine.to_image(pixels).save(OUTPUT_IMAGE)
+
+    with Image.open(OUTPUT_IMAGE) as image:
+        assert container.read_header(image) is None
+    assert CryptoSteganography(key).retrieve(OUTPUT_IMAGE) is None
+
+
+def test_kdf_cache() -> None:
+    from cryptosteganography import kdf
+
+    key = 'test_key'
+    kdf.cache_clear()
+
+    crypto_steganography = CryptoSteganography(key)
+    crypto_steganography.hide(INPUT_IMAGE, OUTPUT_IMAGE, 'Hello World')
+    crypto_steganography.hide(INPUT_IMAGE, OUTPUT_IMAGE, 'Hello World')
+    # A new instance reads the salt from the image, the key is cached
+    assert CryptoSteganography(key).retrieve(OUTPUT_IMAGE) == 'Hello World'
+
+    cache_info = kdf.cache_info()
+    assert cache_info.misses == 1
+    assert cache_info.hits == 2
+
+
+def test_kdf_pbkdf2() -> None:
+    from cryptosteganography import kdf
+
+    key = 'test_key'
+    crypto_steganography = CryptoSteganography(key, kdf_params=kdf.pbkdf2_params(1000))
+    crypto_steganography.hide(INPUT_IMAGE, OUTPUT_IMAGE, 'Hello World')
+
+    assert CryptoSteganography(key).retrieve(OUTPUT_IMAGE) == 'Hello World'
+    assert CryptoSteganography('wrong key').retrieve(OUTPUT_IMAGE) is None
+
+
+@pytest.mark.parametrize('params', [
+    (1, 1000, 8, 1),
+    (1, 2 ** 30, 8, 1),
+    # 4 GiB of memory, minutes of work
+    (1, 2 ** 20, 32, 16),
+    # Within the memory bound, too much work
+    (1, 2 ** 16, 32, 16),
+    (2, 0, 0, 0),
+    (2, 10_000_000, 0, 0),
+    (9, 1000, 0, 0),
+])
+def test_kdf_invalid_params(params: tuple) -> None:
+    from cryptosteganography import kdf
+
+    with pytest.raises(ValueError):
+        CryptoSteganography('test_key', kdf_params=kdf.KDFParams(*params))
+
+
+def test_retrieve_container_version_1() -> None:
+    import hashlib
+
+    from Cryptodome.Util.Padding import pad
+
+    from cryptosteganography import container, engine
+
+    key = 'test_key'
+    iv = b'\x01' * AES.block_size
+    cypher_data = AES.new(
+        hashlib.sha256(key.encode()).digest(),
+        AES.MODE_CBC,
+        iv
+    ).encrypt(pad(b'Hello World', AES.block_size))
+
+    with Image.open(INPUT_IMAGE) as image:
+        pixels = engine.to_array(image, writable=True)
+    container.write_header(pixels, len(iv + cypher_data), version=1)
+    container.write_body(pixels, iv + cypher_data)
+    engine.to_image(pixels).save(OUTPUT_IMAGE)
+
+    assert CryptoSteganography(key).retrieve(OUTPUT_IMAGE) == 'Hello World'
+
+
+@pytest.mark.parametrize('chunk_size', [16, 1000, 1024 * 1024])
+def test_stream(chunk_size: int) -> None:
+    key = 'test_key'
+
+    with open(INPUT_MESSAGE_AUDIO_FILE, 'rb') as f:
+        secret_message = f.read()
+
+    crypto_steganography = CryptoSteganography(key)
+    with open(INPUT_MESSAGE_AUDIO_FILE, 'rb') as f:
+        size = crypto_steganography.hide_stream(INPUT_IMAGE, OUTPUT_IMAGE, f, chunk_size)
+
+    assert size == len(secret_message)
+    # Same container as hide
+    assert crypto_steganography.retrieve(OUTPUT_IMAGE) == secret_message
+
+    output = io.BytesIO()
+    size = crypto_steganography.retrieve_stream(OUTPUT_IMAGE, output, chunk_size)
+
+    assert size == len(secret_message)
+    assert output.getvalue() == secret_message
+
+
+@pytest.mark.parametrize('engine', ['numpy', 'stegano'])
+def test_retrieve_stream_from_hide(engine: str) -> None:
+    key = 'test_key'
+
+    crypto_steganography = CryptoSteganography(key, engine=engine)
+    crypto_steganography.hide(INPUT_IMAGE, OUTPUT_IMAGE, 'Hello World')
+
+    output = io.BytesIO()
+
+    assert crypto_steganography.retrieve_stream(OUTPUT_IMAGE, output) == 11
+    assert output.getvalue() == b'Hello World'
+
+
+def test_retrieve_stream_invalid() -> None:
+    key = 'test_key'
+
+    crypto_steganography = CryptoSteganography(key)
+    crypto_steganography.hide_stream(INPUT_IMAGE, OUTPUT_IMAGE, io.BytesIO(b'Hello World'))
+
+    assert CryptoSteganography('jfffhh').retrieve_stream(OUTPUT_IMAGE, io.BytesIO()) is None
+    assert crypto_steganography.retrieve_stream(INPUT_IMAGE, io.BytesIO()) is None
+    assert crypto_steganography.retrieve_stream('nonexistent_image.jpg', io.BytesIO()) is None
+
+
+@pytest.mark.parametrize('size', [(40, 30), (100, 7), (3, 3)])
+def test_capacity(size: tuple) -> None:
+    key = 'test_key'
+
+    image = Image.new('RGB', size, color='white')
+    image.save(OUTPUT_IMAGE)
+
+    crypto_steganography = CryptoSteganography(key)
+    capacity = crypto_steganography.capacity(OUTPUT_IMAGE)
+
+    if capacity:
+        assert crypto_steganography.fits(OUTPUT_IMAGE, capacity)
+        crypto_steganography.hide(OUTPUT_IMAGE, OUTPUT_IMAGE, b'x' * capacity)
+        assert crypto_steganography.retrieve(OUTPUT_IMAGE) == 'x' * capacity
+
+    # Exact for the binary container
+    assert not crypto_steganography.fits(OUTPUT_IMAGE, capacity + 1)
+    with pytest.raises(ValueError):
+        crypto_steganography.hide(OUTPUT_IMAGE, OUTPUT_IMAGE, b'x' * (capacity + 1))
+
+
+def test_capacity_stegano_engine() -> None:
+    key = 'test_key'
+
+    crypto_steganography = CryptoSteganography(key, engine='stegano')
+    capacity = crypto_steganography.capacity(INPUT_IMAGE)
+
+    # base64 makes it smaller than the binary container
+    assert capacity < CryptoSteganography(key).capacity(INPUT_IMAGE)
+    crypto_steganography.hide(INPUT_IMAGE, OUTPUT_IMAGE, b'x' * capacity)
+    assert crypto_steganography.retrieve(OUTPUT_IMAGE) == 'x' * capacity
+
+
+def test_capacity_does_not_decode_pixels(monkeypatch) -> None:
+    from PIL import ImageFile
+
+    def load(self):
+        raise AssertionError('Pixels decoded')
+
+    monkeypatch.setattr(ImageFile.ImageFile, 'load', load)
+
+    assert CryptoSteganography('test_key').capacity(INPUT_IMAGE) == 97600
+    assert CryptoSteganography('test_key').fits(INPUT_IMAGE, 51559)
+
+
+@pytest.mark.parametrize('bits_per_channel', [1, 2, 3, 4])
+def test_bits_per_channel(bits_per_channel: int) -> None:
+    key = 'test_key'
+
+    with open(INPUT_MESSAGE_AUDIO_FILE, 'rb') as f:
+        secret_message = f.read()
+
+    crypto_steganography = CryptoSteganography(key, bits_per_channel=bits_per_channel)
+    crypto_steganography.hide(INPUT_IMAGE, OUTPUT_IMAGE, secret_message)
+
+    # Detected from the image
+    assert CryptoSteganography(key).retrieve(OUTPUT_IMAGE) == secret_message
+
+    # Fewer pixels touched with more bits per channel
+    with Image.open(INPUT_IMAGE) as original, Image.open(OUTPUT_IMAGE) as output:
+        changed = np.any(np.asarray(original) != np.asarray(output), axis=2)
+    last_pixel = np.flatnonzero(changed)[-1]
+    assert last_pixel < (len(secret_message) + 100) * 8 / 3 / bits_per_channel
+
+    # Stream with chunks that don't end on a channel boundary
+    with open(INPUT_MESSAGE_AUDIO_FILE, 'rb') as f:
+        crypto_steganography.hide_stream(INPUT_IMAGE, OUTPUT_IMAGE, f, 1000)
+    output = io.BytesIO()
+    CryptoSteganography(key).retrieve_stream(OUTPUT_IMAGE, output, 1000)
+
+    assert output.getvalue() == secret_message
+
+
+def test_bits_per_channel_capacity() -> None:
+    key = 'test_key'
+
+    capacities = [
+        CryptoSteganography(key, bits_per_channel=depth).capacity(INPUT_IMAGE)
+        for depth in (1, 2, 4)
+    ]
+
+    assert capacities[1] > 1.99 * capacities[0]
+    assert capacities[2] > 3.99 * capacities[0]
+
+
+@pytest.mark.parametrize('engine, bits_per_channel', [
+    ('numpy', 0),
+    ('numpy', 5),
+    ('stegano', 2),
+])
+def test_bits_per_channel_invalid(engine: str, bits_per_channel: int) -> None:
+    with pytest.raises(ValueError):
+        CryptoSteganography('test_key', engine=engine, bits_per_channel=bits_per_channel)
+
+
+@pytest.mark.parametrize('depth', [1, 2, 3, 4])
+def test_engine_position(depth: int) -> None:
+    from cryptosteganography import engine
+
+    pixels = np.zeros((10, 10, 3), dtype=np.uint8)
+    engine.embed(pixels, b'Hello', 5, depth)
+    engine.embed(pixels, b' World', 5, depth, 40)
+
+    assert engine.extract(pixels, 11, 5, depth) == b'Hello World'
+    assert engine.extract(pixels, 5, 5, depth, 48) == b'World'
+    # Only the depth lowest bits are used
+    assert pixels.max() < 2 ** depth
+
+
+def test_retrieve_container_version_2() -> None:
+    from Cryptodome.Util.Padding import pad
+
+    from cryptosteganography import container, engine, kdf
+
+    key = 'test_key'
+    salt = b'\x02' * kdf.SALT_SIZE
+    iv = b'\x01' * AES.block_size
+    cypher_data = AES.new(
+        kdf.derive_key(key, salt, kdf.DEFAULT_PARAMS),
+        AES.MODE_CBC,
+        iv
+    ).encrypt(pad(b'Hello World', AES.block_size))
+
+    with Image.open(INPUT_IMAGE) as image:
+        pixels = engine.to_array(image, writable=True)
+    body = kdf.pack(kdf.DEFAULT_PARAMS, salt) + iv + cypher_data
+    container.write_header(pixels, len(body), version=2)
+    container.write_body(pixels, body)
+    engine.to_image(pixels).save(OUTPUT_IMAGE)
+
+    assert CryptoSteganography(key).retrieve(OUTPUT_IMAGE) == 'Hello World'
+    assert CryptoSteganography('wrong key').retrieve(OUTPUT_IMAGE) is None
+
+    with pytest.raises(ValueError, match='Invalid key'):
+        CryptoSteganography('wrong key').update(OUTPUT_IMAGE, 'Bye')
+    CryptoSteganography(key).update(OUTPUT_IMAGE, 'Bye')
+    assert CryptoSteganography(key).retrieve(OUTPUT_IMAGE) == 'Bye'
+
+
+def test_wrong_key_rejected_before_decryption(monkeypatch) -> None:
+    from cryptosteganography import engine
+
+    key = 'test_key'
+    crypto_steganography = CryptoSteganography(key)
+    crypto_steganography.hide(INPUT_IMAGE, OUTPUT_IMAGE, 'x' * 10000)
+
+    read_rows = []
+    original_read_rows = engine.read_rows
+
+    def spy_read_rows(image, first, last):
+        read_rows.append((first, last))
+        return original_read_rows(image, first, last)
+
+    monkeypatch.setattr(engine, 'read_rows', spy_read_rows)
+
+    output = io.BytesIO()
+    assert CryptoSteganography('wrong key').retrieve_stream(OUTPUT_IMAGE, output) is None
+    # Body prefix only (the header is read from the PNG data), nothing
+    # written
+    assert read_rows == [(0, 1)]
+    assert output.getvalue() == b''
+
+
+def test_tampered_data() -> None:
+    from cryptosteganography import container, engine
+
+    key = 'test_key'
+    crypto_steganography = CryptoSteganography(key)
+    crypto_steganography.hide(INPUT_IMAGE, OUTPUT_IMAGE, 'Hello World')
+
+    with Image.open(OUTPUT_IMAGE) as image:
+        pixels = engine.to_array(image, writable=True)
+    # Flip one bit of the cipher data
+    pixels.reshape(-1)[container.HEADER_BITS + 39 * 8] ^= 1
+    engine.to_image(pixels).save(OUTPUT_IMAGE)
+
+    assert crypto_steganography.retrieve(OUTPUT_IMAGE) is None
+
+
+def _image_sources() -> list:
+    with open(INPUT_IMAGE, 'rb') as f:
+        data = f.read()
+    with Image.open(INPUT_IMAGE) as image:
+        image = image.convert('RGB')
+    return [
+        data,
+        bytearray(data),
+        io.BytesIO(data),
+        image,
+        np.asarray(image),
+    ]
+
+
+@pytest.mark.parametrize('engine', ['numpy', 'stegano'])
+@pytest.mark.parametrize('source', _image_sources())
+def test_in_memory_sources(engine: str, source) -> None:
+    crypto_steganography = CryptoSteganography('in memory', engine=engine)
+    if isinstance(source, io.BytesIO):
+        source.seek(0)
+
+    data = crypto_steganography.hide_bytes(source, 'Hello World')
+
+    assert data.startswith(b'\x89PNG')
+    assert crypto_steganography.retrieve(data) == 'Hello World'
+    assert crypto_steganography.retrieve(io.BytesIO(data)) == 'Hello World'
+
+
+def test_hide_image_leaves_input_open() -> None:
+    crypto_steganography = CryptoSteganography('in memory')
+    with Image.open(INPUT_IMAGE) as image:
+        secret = crypto_steganography.hide_image(image, b'\x00\xff')
+        # The caller's image is not closed
+        image.load()
+
+    assert isinstance(secret, Image.Image)
+    assert crypto_steganography.retrieve(secret) == b'\x00\xff'
+    assert crypto_steganography.retrieve(np.asarray(secret)) == b'\x00\xff'
+
+
+def test_hide_to_file_object() -> None:
+    crypto_steganography = CryptoSteganography('in memory')
+    output = io.BytesIO()
+    stream_output = io.BytesIO()
+
+    crypto_steganography.hide(INPUT_IMAGE, output, 'Hello World')
+    size = crypto_steganography.hide_stream(INPUT_IMAGE, stream_output, io.BytesIO(b'data'))
+
+    assert size == 4
+    assert crypto_steganography.retrieve(output.getvalue()) == 'Hello World'
+    assert crypto_steganography.retrieve(stream_output.getvalue()) == 'data'
+    assert crypto_steganography.capacity(output.getvalue()) == 97600
+
+
+def test_retrieve_invalid_bytes() -> None:
+    crypto_steganography = CryptoSteganography('in memory')
+
+    assert crypto_steganography.retrieve(b'not an image') is None
+
+
+def test_png_compression_options() -> None:
+    crypto_steganography = CryptoSteganography('compression')
+    sizes = {}
+    for compress_level in (0, 1, 9):
+        data = crypto_steganography.hide_bytes(INPUT_IMAGE, 'Hello World', compress_level)
+        assert crypto_steganography.retrieve(data) == 'Hello World'
+        sizes[compress_level] = len(data)
+
+    data = crypto_steganography.hide_bytes(
+        INPUT_IMAGE,
+        'Hello World',
+        compress_strategy='huffman'
+    )
+
+    assert crypto_steganography.retrieve(data) == 'Hello World'
+    # Level 0 only stores the pixels
+    assert sizes[0] > sizes[1] > sizes[9]
+
+
+@pytest.mark.parametrize('options', [
+    {'compress_level': 10},
+    {'compress_level': -1},
+    {'compress_strategy': 'unknown'},
+])
+def test_png_compression_options_invalid(options: dict) -> None:
+    crypto_steganography = CryptoSteganography('compression')
+
+    with pytest.raises(ValueError):
+        crypto_steganography.hide(INPUT_IMAGE, OUTPUT_IMAGE, 'Hello World', **options)
+
+
+@pytest.mark.parametrize('output_format, extension', [
+    ('png', '.png'),
+    ('webp', '.webp'),
+    ('tiff', '.tif'),
+    ('bmp', '.bmp'),
+])
+def test_output_formats(output_format: str, extension: str, tmp_path) -> None:
+    crypto_steganography = CryptoSteganography('formats')
+    output_image_file = str(tmp_path / ('output' + extension))
+
+    report = crypto_steganography.hide(INPUT_IMAGE, output_image_file, 'Hello World')
+    data = crypto_steganography.hide_bytes(INPUT_IMAGE, 'Hello World', output_format=output_format)
+
+    assert report.format == output_format
+    assert report.bytes_written == os.path.getsize(output_image_file)
+    assert report.seconds > 0
+    assert crypto_steganography.retrieve(output_image_file) == 'Hello World'
+    assert crypto_steganography.retrieve(data) == 'Hello World'
+
+
+@pytest.mark.parametrize('output_image_file, options', [
+    ('output.jpg', {}),
+    ('output', {}),
+    ('output.png', {'output_format': 'jpeg'}),
+    ('output.bmp', {'compress_level': 1}),
+])
+def test_output_format_invalid(output_image_file: str, options: dict, tmp_path) -> None:
+    crypto_steganography = CryptoSteganography('formats')
+    output_image_file = str(tmp_path / output_image_file)
+
+    with pytest.raises(ValueError):
+        crypto_steganography.hide(INPUT_IMAGE, output_image_file, 'Hello World', **options)
+    # Nothing is written
+    assert not os.listdir(tmp_path)
+
+
+@pytest.mark.parametrize('output_image_file, output_format, expected', [
+    ('', None, 'output.png'),
+    ('image.jpg', None, 'image.jpg.png'),
+    ('image.TIF', None, 'image.TIF'),
+    ('image.webp', None, 'image.webp'),
+    ('image.png', 'bmp', 'image.png.bmp'),
+    ('image', 'tiff', 'image.tiff'),
+])
+def test_output_image_filename(output_image_file: str, output_format: str, expected: str) -> None:
+    assert get_output_image_filename(output_image_file, output_format) == expected
+
+
+def test_async_hide_retrieve() -> None:
+    crypto_steganography = CryptoSteganography('async', max_concurrency=2)
+    running = []
+
+    async def hide_and_retrieve(message):
+        data = await crypto_steganography.ahide_bytes(INPUT_IMAGE, message)
+        return await crypto_steganography.aretrieve(data)
+
+    async def main():
+        messages = ['message {}'.format(i) for i in range(4)]
+        task = asyncio.gather(*(hide_and_retrieve(message) for message in messages))
+        # The event loop keeps running other work meanwhile
+        while not task.done():
+            running.append(True)
+            await asyncio.sleep(0)
+        return messages, await task
+
+    messages, secrets = asyncio.run(main())
+
+    assert secrets == messages
+    assert running
+
+
+def test_async_max_concurrency(monkeypatch) -> None:
+    crypto_steganography = CryptoSteganography('async', max_concurrency=2)
+    calls = []
+    active = []
+
+    def retrieve(input_image_file):
+        active.append(input_image_file)
+        calls.append(len(active))
+        time.sleep(0.01)
+        active.remove(input_image_file)
+        return input_image_file
+
+    monkeypatch.setattr(crypto_steganography, 'retrieve', retrieve)
+
+    async def main():
+        return await asyncio.gather(*(crypto_steganography.aretrieve(i) for i in range(6)))
+
+    assert asyncio.run(main()) == list(range(6))
+    assert max(calls) <= 2
+
+
+def test_async_process_pool() -> None:
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        crypto_steganography = CryptoSteganography('async', executor=executor)
+
+        async def main():
+            data = await crypto_steganography.ahide_bytes(INPUT_IMAGE, 'Hello World')
+            return await crypto_steganography.aretrieve(data)
+
+        assert asyncio.run(main()) == 'Hello World'
+
+
+def test_stats() -> None:
+    collected = []
+    crypto_steganography = CryptoSteganography('stats', on_stats=collected.append)
+
+    crypto_steganography.hide(INPUT_IMAGE, OUTPUT_IMAGE, b'x' * 1000)
+    crypto_steganography.retrieve(OUTPUT_IMAGE)
+
+    hide_stats, retrieve_stats = collected
+    assert hide_stats.operation == 'hide'
+    assert list(hide_stats.stages) == ['decode', 'kdf', 'embed', 'encrypt', 'encode']
+    assert hide_stats.stages['encrypt'].size == 1000
+    assert hide_stats.stages['decode'].pixels == 260440
+    # Header, prefix, data and tag: 80 + 1055 * 8 channels
+    assert hide_stats.stages['embed'].pixels == 2840
+    assert hide_stats.stages['encode'].size == os.path.getsize(OUTPUT_IMAGE)
+    assert hide_stats.seconds == pytest.approx(
+        sum(stage.seconds for stage in hide_stats.stages.values())
+    )
+
+    assert retrieve_stats.operation == 'retrieve'
+    assert list(retrieve_stats.stages) == ['header', 'extract', 'kdf', 'decrypt']
+    assert retrieve_stats.stages['decrypt'].size == 1000
+    assert retrieve_stats.stages['extract'].pixels == 2840
+    assert 'total' in retrieve_stats.report()
+    assert retrieve_stats.as_dict()['stages'][0]['name'] == 'header'
+
+
+def test_stats_stream_and_legacy() -> None:
+    collected = []
+    crypto_steganography = CryptoSteganography('stats', on_stats=collected.append)
+
+    crypto_steganography.hide_stream(INPUT_IMAGE, OUTPUT_IMAGE, io.BytesIO(b'x' * 100), 30)
+    CryptoSteganography('stats', engine='stegano').hide(INPUT_IMAGE, OUTPUT_IMAGE, 'legacy')
+    crypto_steganography.retrieve(OUTPUT_IMAGE)
+    crypto_steganography.retrieve(INVALID_IMAGE)
+
+    stream_stats, legacy_stats, invalid_stats = collected
+    assert stream_stats.stages['encrypt'].size == 100
+    assert list(legacy_stats.stages) == ['header', 'extract', 'decrypt']
+    assert not invalid_stats.stages
+
+
+def test_lazy_imports() -> None:
+    code = (
+        'import sys, cryptosteganography; '
+        'print(" ".join(sys.modules)); '
+        'cryptosteganography.CryptoSteganography; '
+        'print(" ".join(sys.modules))'
+    )
+    result = subprocess.run(
+        [sys.executable, '-c', code],
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    package, library = (set(line.split()) for line in result.stdout.splitlines())
+
+    assert not package & {'numpy', 'PIL', 'Cryptodome', 'stegano', 'cv2'}
+    assert 'cryptosteganography.core' in library
+    # Only loaded by the stegano engine and the async methods
+    assert not library & {'stegano', 'cv2', 'asyncio'}
+
+
+@pytest.mark.parametrize('depth', [1, 2, 3, 4])
+@pytest.mark.parametrize('channels', [3, 4])
+def test_engine_parallel_bands(depth: int, channels: int, monkeypatch) -> None:
+    from cryptosteganography import engine
+
+    # Split even small writes
+    monkeypatch.setattr(engine, 'PARALLEL_MIN_CHANNELS', 0)
+    rng = np.random.default_rng(depth)
+    pixels = rng.integers(0, 256, (37, 53, channels), dtype=np.uint8)
+    data = rng.bytes(500)
+
+    for offset, position in [(0, 0), (80, 0), (80, 24), (7, 3)]:
+        serial = pixels.copy()
+        parallel = pixels.copy()
+        engine.embed(serial, data, offset, depth, position)
+        engine.embed(parallel, data, offset, depth, position, workers=4)
+
+        assert np.array_equal(serial, parallel)
+        assert engine.extract(parallel, len(data), offset, depth, position, workers=4) == data
+    assert len(engine.bands(pixels, 80, 80 + 500 * 8, 4)) == 4
+
+
+def test_workers() -> None:
+    crypto_steganography = CryptoSteganography('workers', workers=4)
+
+    data = crypto_steganography.hide_bytes(INPUT_IMAGE, b'x' * 50000)
+
+    assert crypto_steganography.retrieve(data) == 'x' * 50000
+    with pytest.raises(ValueError):
+        CryptoSteganography('workers', workers=0)
+
+
+@pytest.mark.parametrize('extension, mode', [
+    ('.bmp', 'RGB'),
+    ('.bmp', 'RGBA'),
+    ('.tiff', 'RGB'),
+    ('.tiff', 'RGBA'),
+])
+def test_mapped_pixels(extension: str, mode: str, tmp_path) -> None:
+    from cryptosteganography import mapped
+
+    # Odd width: BMP rows are padded
+    pixels = np.random.default_rng(0).integers(0, 256, (31, 45, len(mode)), dtype=np.uint8)
+    image_file = str(tmp_path / ('carrier' + extension))
+    Image.fromarray(pixels).save(image_file, compression='raw')
+
+    with mapped.open_pixels(image_file, writable=True) as mapped_pixels:
+        with Image.open(image_file) as image:
+            assert np.array_equal(mapped_pixels, np.asarray(image)[..., :3])
+        mapped_pixels[0, 0] = (1, 2, 3)
+        mapped_pixels[-1, -1] = (4, 5, 6)
+
+    with Image.open(image_file) as image:
+        changed = np.asarray(image)
+    assert tuple(changed[0, 0, :3]) == (1, 2, 3)
+    assert tuple(changed[-1, -1, :3]) == (4, 5, 6)
+    assert np.array_equal(changed[1:-1], np.asarray(pixels)[1:-1, :, :changed.shape[2]])
+
+
+@pytest.mark.parametrize('extension', ['.bmp', '.tiff'])
+def test_hide_in_place(extension: str, tmp_path) -> None:
+    crypto_steganography = CryptoSteganography('in place')
+    pixels = np.random.default_rng(1).integers(0, 256, (300, 201, 3), dtype=np.uint8)
+    input_image_file = str(tmp_path / ('input' + extension))
+    output_image_file = str(tmp_path / ('output' + extension))
+    Image.fromarray(pixels).save(input_image_file, compression='raw')
+    with open(input_image_file, 'rb') as f:
+        original = f.read()
+
+    assert crypto_steganography.hide_in_place(input_image_file, 'Hello World',
+                                              output_image_file) == 11
+    # The input is left as it was
+    with open(input_image_file, 'rb') as f:
+        assert f.read() == original
+    assert crypto_steganography.retrieve(output_image_file) == 'Hello World'
+    # Only the first two rows carry the data
+    with Image.open(output_image_file) as image:
+        changed = np.asarray(image)
+    assert np.array_equal(changed[2:], pixels[2:])
+    assert os.path.getsize(output_image_file) == len(original)
+
+    crypto_steganography.hide_in_place(input_image_file, b'\xff\x00' * 1000)
+    assert crypto_steganography.retrieve(input_image_file) == b'\xff\x00' * 1000
+
+
+def test_hide_in_place_invalid(tmp_path) -> None:
+    crypto_steganography = CryptoSteganography('in place')
+    pixels = np.zeros((20, 20, 3), dtype=np.uint8)
+    input_image_file = str(tmp_path / 'input.bmp')
+    Image.fromarray(pixels).save(input_image_file)
+    Image.fromarray(pixels).save(str(tmp_path / 'input.png'))
+    Image.fromarray(pixels).save(str(tmp_path / 'input.tiff'), compression='tiff_deflate')
+
+    for image_file in ['input.png', 'input.tiff']:
+        with pytest.raises(ValueError):
+            crypto_steganography.hide_in_place(str(tmp_path / image_file), 'Hello World')
+    # Rejected before changing the file
+    with pytest.raises(ValueError):
+        crypto_steganography.hide_in_place(input_image_file, 'x' * 200)
+    with Image.open(input_image_file) as image:
+        assert not np.asarray(image).any()
+
+
+def test_banded_png(tmp_path) -> None:
+    from cryptosteganography import banded
+
+    pixels = np.random.default_rng(8).integers(0, 256, (700, 130, 4), dtype=np.uint8)
+    image_file = str(tmp_path / 'banded.png')
+    banded.write(pixels, image_file)
+    layout = banded.read_layout(image_file)
+    assert layout is not None
+    assert len(layout.bands) == 2
+    with Image.open(image_file) as image:
+        assert np.array_equal(np.asarray(image), pixels)
+
+    # Only the first band compressed again
+    pixels[:3] ^= 1
+    banded.rewrite(image_file, layout, pixels, 1, image_file)
+    decoded = layout.empty_pixels()
+    banded.read_bands(image_file, banded.read_layout(image_file), decoded, 0, 2)
+    assert np.array_equal(decoded, pixels)
+    with Image.open(image_file) as image:
+        assert np.array_equal(np.asarray(image), pixels)
+
+    Image.fromarray(pixels).save(str(tmp_path / 'regular.png'))
+    assert banded.read_layout(str(tmp_path / 'regular.png')) is None
+
+
+def test_update(tmp_path) -> None:
+    from cryptosteganography import banded, container
+
+    collected = []
+    crypto_steganography = CryptoSteganography('update', on_stats=collected.append)
+    pixels = np.random.default_rng(9).integers(0, 256, (1500, 300, 3), dtype=np.uint8)
+    input_image_file = str(tmp_path / 'input.png')
+    image_file = str(tmp_path / 'stego.png')
+    Image.fromarray(pixels).save(input_image_file)
+    crypto_steganography.hide(input_image_file, image_file, 'x' * 5000)
+    with Image.open(image_file) as image:
+        hidden = np.asarray(image)
+    old_header = container.read_header(hidden)
+
+    # Decoded and saved whole the first time, as a banded PNG
+    assert crypto_steganography.update(image_file, 'new token') == 9
+    assert crypto_steganography.retrieve(image_file) == 'new token'
+    layout = banded.read_layout(image_file)
+    assert layout is not None
+    with Image.open(image_file) as image:
+        updated = np.asarray(image)
+    # The rest of the old secret is overwritten, past it nothing changes
+    assert container.read_body(updated, old_header, 100) != container.read_body(
+        hidden, old_header, 100
+    )
+    rows = -(-crypto_steganography._pixels(old_header.length) // 300)
+    assert np.array_equal(updated[rows:], pixels[rows:])
+
+    # Then only the first band is decoded and compressed again
+    assert crypto_steganography.update(image_file, b'\xff\x00' * 10) == 20
+    assert crypto_steganography.retrieve(image_file) == b'\xff\x00' * 10
+    hide_stats = collected[-2]
+    assert hide_stats.stages['decode'].pixels == layout.band_rows * 300
+    assert hide_stats.stages['encode'].pixels == layout.band_rows * 300
+    # Pixels of the old (9 bytes) and new containers only
+    assert 0 < hide_stats.values['pixels changed'] <= crypto_steganography._pixels(100)
+
+    crypto_steganography.update(image_file, 'Hello World', str(tmp_path / 'output.bmp'))
+    assert crypto_steganography.retrieve(str(tmp_path / 'output.bmp')) == 'Hello World'
+
+    with pytest.raises(ValueError):
+        crypto_steganography.update(input_image_file, 'Hello World')
+
+
+@pytest.mark.parametrize('scatter', [False, True])
+def test_update_wrong_password(tmp_path, scatter) -> None:
+    image_file = str(tmp_path / 'stego.png')
+    CryptoSteganography('update', scatter=scatter).hide(INPUT_IMAGE, image_file, 'Hello World')
+    with open(image_file, 'rb') as f:
+        before = f.read()
+
+    for crypto_steganography in [
+        CryptoSteganography('other', scatter=scatter),
+        CryptoSteganography('other', scatter=not scatter),
+    ]:
+        with pytest.raises(ValueError):
+            crypto_steganography.update(image_file, 'Bye')
+        with open(image_file, 'rb') as f:
+            assert f.read() == before
+    assert CryptoSteganography('update').retrieve(image_file) == 'Hello World'
+
+    CryptoSteganography('update', scatter=scatter).update(image_file, 'Bye')
+    assert CryptoSteganography('update').retrieve(image_file) == 'Bye'
+
+
+@pytest.mark.parametrize('extension, writer', [
+    ('.png', 'cryptosteganography.banded.write'),
+    ('.bmp', 'cryptosteganography.formats._timed_save'),
+])
+def test_update_failure_keeps_input(extension, writer, tmp_path, monkeypatch) -> None:
+    image_file = str(tmp_path / ('stego' + extension))
+    CryptoSteganography('update').hide(INPUT_IMAGE, image_file, 'Hello World')
+    with open(image_file, 'rb') as f:
+        before = f.read()
+
+    def write_half(image, output, *args):
+        with open(output, 'wb') as f:
+            f.write(before[:len(before) // 2])
+        raise OSError('No space left on device')
+
+    monkeypatch.setattr(writer, write_half)
+    with pytest.raises(OSError):
+        CryptoSteganography('update').update(image_file, 'Bye')
+
+    with open(image_file, 'rb') as f:
+        assert f.read() == before
+    assert os.listdir(tmp_path) == ['stego' + extension]
+
+
+@pytest.mark.parametrize('size, mode', [((40, 50), 'RGB'), ((9, 7), 'RGBA'), ((30, 1), 'RGB')])
+def test_banded_first_pixels(tmp_path, size, mode) -> None:
+    from cryptosteganography import banded
+
+    # Gradients and noise, so PIL picks every row filter
+    rng = np.random.default_rng(10)
+    pixels = rng.integers(0, 256, size + (len(mode),), dtype=np.uint8)
+    pixels[:, :size[1] // 2] = np.arange(size[1] // 2)[np.newaxis, :, np.newaxis] * 5
+    image_file = str(tmp_path / 'image.png')
+    Image.fromarray(pixels, mode).save(image_file)
+
+    with open(image_file, 'rb') as f:
+        header_pixels = banded.first_pixels(f, 27)
+    assert np.array_equal(header_pixels[0], pixels.reshape(-1, len(mode))[:27])
+
+
+def test_scan(tmp_path) -> None:
+    from cryptosteganography import container, scan
+
+    crypto_steganography = CryptoSteganography('scan')
+    (tmp_path / 'nested').mkdir()
+    crypto_steganography.hide(INPUT_IMAGE, str(tmp_path / 'a.png'), 'Hello World')
+    crypto_steganography.hide(INPUT_IMAGE, str(tmp_path / 'nested' / 'b.bmp'), 'x' * 100)
+    CryptoSteganography('scan', compression='zlib', scatter=True).hide(
+        INPUT_IMAGE,
+        str(tmp_path / 'nested' / 'c.tiff'),
+        'x'
+    )
+    Image.open(INPUT_IMAGE).save(str(tmp_path / 'cover.png'))
+    with open(tmp_path / 'broken.png', 'wb') as f:
+        f.write(b'not an image')
+
+    result = scan.scan_file(str(tmp_path / 'a.png'))
+    assert result.format == 'PNG'
+    assert result.header == container.Header(3, 0, 66)
+    assert scan.scan_file(INPUT_IMAGE) == scan.ScanResult(INPUT_IMAGE, 'JPEG')
+    assert scan.scan_file(str(tmp_path / 'broken.png')).error
+
+    results = []
+    summary = scan.scan([str(tmp_path), INPUT_IMAGE], workers=2, on_result=results.append)
+    assert (summary.images, summary.hits, summary.failed) == (6, 3, 1)
+    assert [os.path.basename(result.image_file) for result in results] == [
+        'a.png', 'broken.png', 'cover.png', 'b.bmp', 'c.tiff', 'test_image.jpg'
+    ]
+    assert results[3].as_dict()['length'] == 155
+    assert results[4].as_dict()['scattered']
+    assert results[4].as_dict()['compression'] == 'zlib'
+
+
+def test_scan_bounded_chunks(tmp_path, monkeypatch) -> None:
+    from cryptosteganography import scan
+
+    Image.open(INPUT_IMAGE).save(str(tmp_path / '0.png'))
+    for index in range(1, 10):
+        shutil.copy(tmp_path / '0.png', tmp_path / f'{index}.png')
+    monkeypatch.setattr(scan, 'CHUNK_SIZE', 1)
+    monkeypatch.setattr(scan, 'PENDING_CHUNKS', 1)
+
+    # Files taken from the walk but not reported yet
+    walked = []
+    find_images = scan.find_images
+    monkeypatch.setattr(
+        scan,
+        'find_images',
+        lambda paths: (walked.append(image) or image for image in find_images(paths))
+    )
+    pending = []
+    results = []
+
+    def on_result(result) -> None:
+        results.append(result)
+        pending.append(len(walked) - len(results))
+
+    summary = scan.scan([str(tmp_path)], workers=2, on_result=on_result)
+    assert summary.images == 10
+    assert [os.path.basename(result.image_file) for result in results] == [
+        f'{index}.png' for index in range(10)
+    ]
+    assert max(pending) < 2
+
+
+def test_carrier() -> None:
+    from cryptosteganography import carriers
+
+    crypto_steganography = CryptoSteganography('carrier')
+    carrier = carriers.Carrier(INPUT_IMAGE)
+    assert not carrier.pixels.flags.writeable
+    original = carrier.pixels.copy()
+
+    for message in ['first', 'second']:
+        secret = crypto_steganography.hide_bytes(carrier, message)
+        assert crypto_steganography.retrieve(secret) == message
+    # Every hide works on its own copy
+    assert np.array_equal(carrier.pixels, original)
+    assert crypto_steganography.capacity(carrier) == crypto_steganography.capacity(INPUT_IMAGE)
+    assert crypto_steganography.retrieve(carrier) is None
+
+
+def test_carrier_cache(tmp_path) -> None:
+    from cryptosteganography import carriers
+
+    collected = []
+    crypto_steganography = CryptoSteganography(
+        'carrier',
+        carrier_cache=True,
+        on_stats=collected.append
+    )
+    input_image_file = str(tmp_path / 'input.png')
+    Image.fromarray(np.zeros((30, 40, 3), dtype=np.uint8)).save(input_image_file)
+    carriers.cache_clear()
+
+    for message in ['first', 'second']:
+        secret = crypto_steganography.hide_bytes(input_image_file, message)
+        assert crypto_steganography.retrieve(secret) == message
+    assert carriers.cache_info().hits == 1
+    assert carriers.cache_info().misses == 1
+    assert 'decode' not in collected[0].stages
+    assert collected[0].stages['copy'].pixels == 1200
+    assert carriers.load(input_image_file) is carriers.load(input_image_file)
+
+    # A cover changed on disk is decoded again
+    Image.fromarray(np.full((30, 40, 3), 255, dtype=np.uint8)).save(input_image_file)
+    os.utime(input_image_file, ns=(0, 0))
+    assert carriers.load(input_image_file).pixels.min() == 255
+    carriers.cache_clear()
+
+
+@pytest.mark.parametrize('bits_per_channel', [1, 3])
+def test_scatter(bits_per_channel: int) -> None:
+    crypto_steganography = CryptoSteganography(
+        'scatter',
+        bits_per_channel=bits_per_channel,
+        scatter=True
+    )
+    pixels = np.random.default_rng(2).integers(0, 256, (120, 90, 3), dtype=np.uint8)
+    capacity = crypto_steganography.capacity(pixels)
+
+    for message in [b'\xff' * 500, b'\xfe' * capacity]:
+        data = crypto_steganography.hide_bytes(pixels, message)
+
+        assert crypto_steganography.retrieve(data) == message
+        # Detected from the header flags
+        assert CryptoSteganography('scatter').retrieve(data) == message
+        assert CryptoSteganography('other').retrieve(data) is None
+    with pytest.raises(ValueError):
+        crypto_steganography.hide_bytes(pixels, b'\xfe' * (capacity + 1))
+
+    # The changed pixels are spread over the image, not in the first rows
+    with Image.open(io.BytesIO(crypto_steganography.hide_bytes(pixels, b'\xff' * 500))) as image:
+        changed = (np.asarray(image) != pixels).any(axis=2)
+    assert changed[-30:].any()
+    with pytest.raises(ValueError):
+        CryptoSteganography('scatter', engine='stegano', scatter=True)
+
+
+def test_scatter_in_place(tmp_path) -> None:
+    crypto_steganography = CryptoSteganography('scatter', scatter=True)
+    pixels = np.random.default_rng(3).integers(0, 256, (70, 51, 3), dtype=np.uint8)
+    input_image_file = str(tmp_path / 'input.bmp')
+    Image.fromarray(pixels).save(input_image_file)
+
+    crypto_steganography.hide_in_place(input_image_file, 'Hello World')
+
+    assert crypto_steganography.retrieve(input_image_file) == 'Hello World'
+
+
+def test_permutation_cache(tmp_path) -> None:
+    from cryptosteganography import permutation
+
+    # The order is part of the image format, it must never change
+    assert permutation.generate(bytes(32), 10).tolist() == [3, 2, 1, 8, 6, 0, 7, 4, 5, 9]
+
+    seed = permutation.seed('cache')
+    permutation.set_cache_dir(tmp_path)
+    try:
+        order = permutation.pixel_order(seed, 1000)
+        assert permutation.pixel_order(seed, 1000) is order
+        assert permutation.cache_info().hits == 1
+        assert sorted(order) == list(range(1000))
+        assert len(os.listdir(tmp_path)) == 1
+
+        # Loaded from the disk cache
+        permutation.cache_clear()
+        loaded = permutation.pixel_order(seed, 1000)
+        assert isinstance(loaded, np.memmap)
+        assert np.array_equal(loaded, order)
+    finally:
+        permutation.set_cache_dir(None)
+    assert not isinstance(permutation.pixel_order(seed, 1000), np.memmap)
+
+
+@pytest.mark.parametrize('compression, codec', [('zlib', 1), ('lzma', 2), ('auto', None)])
+def test_compression(compression: str, codec: int) -> None:
+    from cryptosteganography import compression as compression_codecs, container
+
+    hide_stats = []
+    crypto_steganography = CryptoSteganography(
+        'compression',
+        compression=compression,
+        on_stats=hide_stats.append
+    )
+    message = b'2024-01-01 12:00:00 INFO request served in 12 ms\n' * 2000
+    capacity = crypto_steganography.capacity(INPUT_IMAGE)
+
+    for chunk_size in [1000, 1024 * 1024]:
+        output = io.BytesIO()
+        crypto_steganography.hide_stream(INPUT_IMAGE, output, io.BytesIO(message), chunk_size)
+        with Image.open(output) as image:
+            header = container.read_header(image)
+
+        assert header.codec == (codec or compression_codecs.select('auto', message))
+        assert header.length < len(message) // 10
+        assert crypto_steganography.retrieve(output.getvalue()) == message.decode()
+        assert CryptoSteganography('compression').retrieve(output.getvalue()) == message.decode()
+    assert 0 < hide_stats[0].values['compression ratio'] < 0.1
+    assert hide_stats[0].values['pixels saved'] > 0
+    assert 'compress' in hide_stats[0].stages
+
+    # Fits even if larger than the capacity
+    message = b'\x00' * (capacity * 2)
+    assert crypto_steganography.retrieve(crypto_steganography.hide_bytes(INPUT_IMAGE, message)) \
+        == message.decode()
+
+
+def test_compression_auto_skips_incompressible() -> None:
+    from cryptosteganography import container
+
+    hide_stats = []
+    crypto_steganography = CryptoSteganography(
+        'compression',
+        compression='auto',
+        on_stats=hide_stats.append
+    )
+    message = np.random.default_rng(4).bytes(20000)
+
+    data = crypto_steganography.hide_bytes(INPUT_IMAGE, message)
+
+    with Image.open(io.BytesIO(data)) as image:
+        assert container.read_header(image).codec == 0
+    assert crypto_steganography.retrieve(data) == message
+    assert not hide_stats[0].values
+
+
+def test_compression_in_place(tmp_path) -> None:
+    crypto_steganography = CryptoSteganography('compression', compression='zlib')
+    input_image_file = str(tmp_path / 'input.bmp')
+    Image.fromarray(np.zeros((100, 100, 3), dtype=np.uint8)).save(input_image_file)
+    message = 'x' * crypto_steganography.capacity(input_image_file) * 4
+
+    crypto_steganography.hide_in_place(input_image_file, message)
+
+    assert crypto_steganography.retrieve(input_image_file) == message
+    with pytest.raises(ValueError):
+        CryptoSteganography('compression').hide_in_place(input_image_file, message)
+
+    # Incompressible data grows: rejected before the file is changed
+    uncompressed_capacity = CryptoSteganography('compression').capacity(input_image_file)
+    with open(input_image_file, 'rb') as f:
+        before = f.read()
+    with pytest.raises(ValueError, match='too long'):
+        crypto_steganography.hide_in_place(
+            input_image_file,
+            np.random.default_rng(8).bytes(uncompressed_capacity)
+        )
+    with open(input_image_file, 'rb') as f:
+        assert f.read() == before
+    assert crypto_steganography.retrieve(input_image_file) == message
+
+
+@pytest.mark.parametrize('compression', ['zlib', 'lzma', 'auto'])
+def test_compression_capacity(compression: str) -> None:
+    crypto_steganography = CryptoSteganography('compression', compression=compression)
+    capacity = crypto_steganography.capacity(INPUT_IMAGE)
+    assert 0 < capacity < CryptoSteganography('compression').capacity(INPUT_IMAGE)
+
+    # Incompressible data of the capacity still fits
+    message = np.random.default_rng(9).bytes(capacity)
+    assert crypto_steganography.fits(INPUT_IMAGE, capacity)
+    assert crypto_steganography.retrieve(crypto_steganography.hide_bytes(INPUT_IMAGE, message)) \
+        == message
+
+
+@pytest.mark.parametrize('compression', ['zlib', 'lzma', 'auto'])
+def test_compression_capacity_small_carrier(compression: str) -> None:
+    crypto_steganography = CryptoSteganography('compression', compression=compression)
+    carrier = np.random.default_rng(11).integers(0, 256, (23, 37, 3), dtype=np.uint8)
+    capacity = crypto_steganography.capacity(carrier)
+    assert capacity > 0
+
+    message = np.random.default_rng(12).bytes(capacity)
+    assert crypto_steganography.fits(carrier, capacity)
+    assert crypto_steganography.retrieve(crypto_steganography.hide_bytes(carrier, message)) \
+        == message
+
+
+@pytest.mark.parametrize('size', [0, 1, 243, 16385, 65537, 300000])
+def test_compression_bound(size: int) -> None:
+    from cryptosteganography import compression
+
+    data = np.random.default_rng(size).bytes(size)
+    for codec in [compression.ZLIB, compression.LZMA]:
+        compressor = compression.compressor(codec)
+        compressed = b''.join(
+            compressor.compress(data[start:start + 1000]) for start in range(0, size, 1000)
+        ) + compressor.flush()
+        assert len(compressed) <= compression.codec_bound(size, codec)
+    assert compression.bound(size, None) == size
+    assert compression.max_size(compression.bound(size, 'lzma'), 'lzma') == size
+
+
+def test_compression_invalid() -> None:
+    from cryptosteganography import compression
+
+    with pytest.raises(ValueError):
+        CryptoSteganography('compression', compression='gzip')
+    with pytest.raises(ValueError):
+        CryptoSteganography('compression', engine='stegano', compression='zlib')
+    if 'zstd' not in compression.available():
+        with pytest.raises(ValueError):
+            CryptoSteganography('compression', compression='zstd')
+
+
+def test_shards_plan() -> None:
+    from cryptosteganography import shards
+
+    overhead = shards.MANIFEST.size
+    assert shards.plan([overhead + 100, overhead + 300], 200) == [(0, 50), (50, 150)]
+    assert shards.plan([overhead + 100, overhead + 300], 400) == [(0, 100), (100, 300)]
+    assert shards.plan([overhead + 2, overhead + 2, overhead + 2], 4) == [(0, 2), (2, 1), (3, 1)]
+    with pytest.raises(ValueError):
+        shards.plan([overhead + 100, 10], 101)
+
+
+def test_shards(tmp_path) -> None:
+    from cryptosteganography import shards
+
+    crypto_steganography = CryptoSteganography('shards')
+    rng = np.random.default_rng(5)
+    input_image_files = []
+    for index, size in enumerate([(60, 50), (40, 70), (50, 50), (30, 30)]):
+        input_image_file = str(tmp_path / 'input{}.png'.format(index))
+        Image.fromarray(rng.integers(0, 256, size + (3,), dtype=np.uint8)).save(input_image_file)
+        input_image_files.append(input_image_file)
+    output_image_files = [str(tmp_path / 'output{}.png'.format(index)) for index in range(4)]
+    secret = rng.bytes(2500)
+    secret_file = str(tmp_path / 'secret.bin')
+    with open(secret_file, 'wb') as f:
+        f.write(secret)
+
+    summary = shards.hide(
+        crypto_steganography,
+        input_image_files,
+        output_image_files,
+        secret_file,
+        workers=2
+    )
+    assert summary.shards == 4
+    assert summary.size == len(secret)
+
+    # In any order
+    output_file = str(tmp_path / 'retrieved.bin')
+    summary = shards.retrieve(crypto_steganography, output_image_files[::-1], output_file, 2)
+    assert summary.size == len(secret)
+    with open(output_file, 'rb') as f:
+        assert f.read() == secret
+
+    # Shards are not whole secrets
+    assert crypto_steganography.retrieve(output_image_files[0]) is None
+    # A failure leaves an existing output file untouched
+    os.chmod(output_file, 0o640)
+    for password, image_files in [
+        ('shards', output_image_files[:3]),
+        ('shards', output_image_files + output_image_files[:1]),
+        ('shards', output_image_files[:3] + [input_image_files[3]]),
+        ('other', output_image_files),
+    ]:
+        with pytest.raises(ValueError):
+            shards.retrieve(CryptoSteganography(password), image_files, output_file, 2)
+        with open(output_file, 'rb') as f:
+            assert f.read() == secret
+        assert os.stat(output_file).st_mode & 0o777 == 0o640
+    with pytest.raises(ValueError):
+        shards.retrieve(crypto_steganography, output_image_files[:3], str(tmp_path / 'new.bin'))
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        ['secret.bin', 'retrieved.bin'] + [
+            os.path.basename(image_file) for image_file in input_image_files + output_image_files
+        ]
+    )
+
+    # Two shards can't go to the same output image
+    with pytest.raises(ValueError, match='Several images write the same output'):
+        shards.hide(
+            crypto_steganography,
+            input_image_files,
+            output_image_files[:3] + [str(tmp_path / 'other' / '..' / 'output0.png')],
+            secret_file
+        )
+
+    # Too large for the carriers
+    with open(secret_file, 'wb') as f:
+        f.write(secret * 3)
+    with pytest.raises(ValueError):
+        shards.hide(crypto_steganography, input_image_files, output_image_files, secret_file)
+
+
+def test_erasure_any_data_shards_of_the_shards() -> None:
+    from cryptosteganography import erasure
+
+    rng = np.random.default_rng(6)
+    data = rng.integers(0, 256, (4, 1000), dtype=np.uint8)
+    parity = erasure.encode(data, 3)
+    assert parity.shape == (3, 1000)
+    coded = dict(enumerate(list(data) + list(parity)))
+
+    for kept in itertools.combinations(range(7), 4):
+        decoded = erasure.decode({index: coded[index] for index in kept}, 4, 3)
+        assert all(np.array_equal(row, expected) for row, expected in zip(decoded, data))
+
+    with pytest.raises(ValueError):
+        erasure.decode({index: coded[index] for index in range(3)}, 4, 3)
+    with pytest.raises(ValueError):
+        erasure.encode(np.zeros((200, 10), dtype=np.uint8), 57)
+
+
+def test_shards_with_parity(tmp_path, monkeypatch) -> None:
+    from cryptosteganography import shards
+
+    crypto_steganography = CryptoSteganography('parity')
+    rng = np.random.default_rng(7)
+    input_image_files = []
+    for index in range(5):
+        input_image_file = str(tmp_path / 'input{}.png'.format(index))
+        Image.fromarray(rng.integers(0, 256, (60, 60, 3), dtype=np.uint8)).save(input_image_file)
+        input_image_files.append(input_image_file)
+    output_image_files = [str(tmp_path / 'output{}.png'.format(index)) for index in range(5)]
+    secret = rng.bytes(3001)
+    secret_file = str(tmp_path / 'secret.bin')
+    with open(secret_file, 'wb') as f:
+        f.write(secret)
+
+    summary = shards.hide(
+        crypto_steganography,
+        input_image_files,
+        output_image_files,
+        secret_file,
+        workers=2,
+        parity=2
+    )
+    assert summary.shards == 5
+    assert summary.size == len(secret)
+
+    # Any 3 of the 5 images, a damaged one is skipped
+    output_file = str(tmp_path / 'retrieved.bin')
+    for image_files in [
+        output_image_files,
+        output_image_files[2:],
+        output_image_files[::2],
+        output_image_files[1:3] + [input_image_files[0]] + output_image_files[4:],
+    ]:
+        shards.retrieve(crypto_steganography, image_files, output_file, 2)
+        with open(output_file, 'rb') as f:
+            assert f.read() == secret
+
+    with pytest.raises(ValueError, match='Missing shards: 2 of the 3 needed'):
+        shards.retrieve(crypto_steganography, output_image_files[3:], output_file, 2)
+    with open(output_file, 'rb') as f:
+        assert f.read() == secret
+
+    # Lost data shards are decoded a block at a time
+    monkeypatch.setattr(shards, 'READ_SIZE', 100)
+    shards.retrieve(crypto_steganography, output_image_files[1:4], output_file, 2)
+    with open(output_file, 'rb') as f:
+        assert f.read() == secret
+
+    # The shards are the same size, each must fit in the smallest carrier
+    with pytest.raises(ValueError):
+        shards.hide(
+            crypto_steganography,
+            input_image_files,
+            output_image_files,
+            secret_file,
+            parity=4
+        )
+    with pytest.raises(ValueError):
+        shards.hide(
+            crypto_steganography,
+            input_image_files,
+            output_image_files,
+            secret_file,
+            parity=5
+        )